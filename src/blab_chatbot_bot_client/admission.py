@@ -0,0 +1,224 @@
+"""Contains a class that decides whether new conversations can be started.
+
+When the server is over capacity, the controller's request to start a
+conversation is answered with HTTP status 503 and a ``Retry-After`` header,
+so that it can back off instead of slowing down the existing conversations.
+The server is over capacity if any of the configured limits is exceeded:
+
+- the number of active conversations (``MAX_CONVERSATIONS``);
+- the number of handler calls waiting for a thread
+  (``ADMISSION_MAX_QUEUE_DEPTH``);
+- the 99th percentile of the latency of recent incoming messages, from their
+  arrival until ``on_receive_message`` returns
+  (``ADMISSION_MAX_P99_LATENCY``).
+
+Optionally (``ADMISSION_WAIT``), requests wait for a limited time until there
+is capacity before being refused.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from logging import getLogger
+from math import ceil
+from threading import Lock
+from time import monotonic, sleep
+from typing import TYPE_CHECKING
+
+from blab_chatbot_bot_client import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from blab_chatbot_bot_client.settings_format import (
+        BlabWebSocketConnectionSettings,
+    )
+
+LATENCY_WINDOW = 10.0
+"""Time (in seconds) during which latencies are considered recent"""
+
+LATENCY_SAMPLES = 1024
+"""Maximum number of recent latencies that are kept"""
+
+
+class AdmissionController:
+    """Decides whether the server has capacity for a new conversation."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        conversations: Callable[[], int],
+        queue_depth: Callable[[], int] | None = None,
+        max_conversations: int = 0,
+        max_queue_depth: int = 0,
+        max_p99_latency: float = 0,
+        retry_after: float = 1,
+        wait: float = 0,
+        registry: metrics.MetricsRegistry = metrics.registry,
+    ):
+        """Create an instance.
+
+        Args:
+            conversations: function that returns the number of
+                active conversations
+            queue_depth: function that returns the number of handler calls
+                waiting for a thread (``None`` if handlers are not queued)
+            max_conversations: maximum number of active conversations
+                (0 for no limit)
+            max_queue_depth: maximum number of waiting handler calls
+                (0 for no limit)
+            max_p99_latency: maximum 99th percentile of recent latencies
+                (in seconds, 0 for no limit)
+            retry_after: time (in seconds) after which refused requests
+                should be retried
+            wait: maximum time (in seconds) a request waits for capacity
+                before being refused
+            registry: where the metrics are registered
+        """
+        self._conversations = conversations
+        self._queue_depth = queue_depth
+        self._max_conversations = max_conversations
+        self._max_queue_depth = max_queue_depth
+        self._max_p99_latency = max_p99_latency
+        self.retry_after = retry_after
+        self._wait = wait
+        self._latencies: deque[tuple[float, float]] = deque(maxlen=LATENCY_SAMPLES)
+        self._latencies_lock = Lock()
+        self._rejected = registry.counter(
+            "admission_rejected_total",
+            "Number of conversations refused because the server was over capacity",
+        )
+        self._waited = registry.counter(
+            "admission_wait_seconds_total",
+            "Total time spent by conversation starts waiting for capacity",
+        )
+
+    @classmethod
+    def from_settings(
+        cls,
+        connection_settings: BlabWebSocketConnectionSettings,
+        conversations: Callable[[], int],
+        queue_depth: Callable[[], int] | None = None,
+    ) -> AdmissionController:
+        """Create an instance with the limits defined in the settings.
+
+        Args:
+            connection_settings: the connection settings
+            conversations: function that returns the number of
+                active conversations
+            queue_depth: function that returns the number of handler calls
+                waiting for a thread (``None`` if handlers are not queued)
+
+        Returns:
+            the new instance
+        """
+        return cls(
+            conversations,
+            queue_depth,
+            connection_settings.get("MAX_CONVERSATIONS", 0),
+            connection_settings.get("ADMISSION_MAX_QUEUE_DEPTH", 0),
+            connection_settings.get("ADMISSION_MAX_P99_LATENCY", 0),
+            connection_settings.get("ADMISSION_RETRY_AFTER", 1),
+            connection_settings.get("ADMISSION_WAIT", 0),
+        )
+
+    def record_latency(self, latency: float) -> None:
+        """Record the latency of an incoming message.
+
+        Args:
+            latency: time (in seconds) from the arrival of the message
+                until it was handled
+        """
+        if self._max_p99_latency:
+            with self._latencies_lock:
+                self._latencies.append((monotonic(), latency))
+
+    def p99_latency(self) -> float:
+        """Compute the 99th percentile of the recent latencies.
+
+        Returns
+            the percentile (in seconds), or 0 if there are no recent latencies
+        """
+        limit = monotonic() - LATENCY_WINDOW
+        with self._latencies_lock:
+            while self._latencies and self._latencies[0][0] < limit:
+                self._latencies.popleft()
+            latencies = sorted(latency for _, latency in self._latencies)
+        if not latencies:
+            return 0
+        return latencies[ceil(len(latencies) * 0.99) - 1]
+
+    def overload_reason(self) -> str | None:
+        """Check whether the server is over capacity.
+
+        Returns
+            a description of the exceeded limit, or ``None`` if there is capacity
+        """
+        if self._max_conversations and self._conversations() >= self._max_conversations:
+            return "too many conversations"
+        if (
+            self._max_queue_depth
+            and self._queue_depth
+            and self._queue_depth() >= self._max_queue_depth
+        ):
+            return "too many pending handler calls"
+        if self._max_p99_latency and self.p99_latency() > self._max_p99_latency:
+            return "high latency"
+        return None
+
+    def admit(self) -> bool:
+        """Decide whether a new conversation can start.
+
+        If the server is over capacity, it waits (up to the time defined
+        by ``wait``) until there is capacity.
+
+        Returns
+            whether the conversation can start
+        """
+        reason = self.overload_reason()
+        if reason is None:
+            return True
+        start = monotonic()
+        while (remaining := start + self._wait - monotonic()) > 0:
+            sleep(min(remaining, 0.05))
+            reason = self.overload_reason()
+            if reason is None:
+                break
+        return self._finish_waiting(start, reason)
+
+    async def admit_async(self) -> bool:
+        """Decide whether a new conversation can start, without blocking.
+
+        It is the same as ``admit``, but it waits on the event loop.
+
+        Returns
+            whether the conversation can start
+        """
+        import asyncio
+
+        reason = self.overload_reason()
+        if reason is None:
+            return True
+        start = monotonic()
+        while (remaining := start + self._wait - monotonic()) > 0:
+            await asyncio.sleep(min(remaining, 0.05))
+            reason = self.overload_reason()
+            if reason is None:
+                break
+        return self._finish_waiting(start, reason)
+
+    def _finish_waiting(self, start: float, reason: str | None) -> bool:
+        if self._wait:
+            self._waited.inc(monotonic() - start)
+        if reason is None:
+            return True
+        self._rejected.inc()
+        getLogger(__name__).debug("refusing a new conversation: %s", reason)
+        return False
+
+    def refusal(self) -> tuple[str, int, dict[str, str]]:
+        """Create the HTTP response sent when a conversation is refused.
+
+        Returns
+            the body, the status and the headers of the response
+        """
+        return "", 503, {"Retry-After": str(max(1, ceil(self.retry_after)))}
@@ -0,0 +1,306 @@
+"""Contains a cache of the answers generated by bots.
+
+Bots that always give the same answers to the same (normalized) question can
+enable the cache with the setting ``ANSWER_CACHE_SIZE``. The answers are kept
+in memory, evicting the least recently used ones, and optionally also in an
+SQLite database (``ANSWER_CACHE_PATH``), which can be shared by several
+processes. Cached answers expire after ``ANSWER_CACHE_TTL`` seconds.
+
+The key of each message is computed by ``answer_cache_key``, which can be
+overridden by bots.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+from collections import OrderedDict
+from functools import wraps
+from inspect import isasyncgenfunction, iscoroutinefunction, isgeneratorfunction
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING, Any, TypeVar, cast
+
+from blab_chatbot_bot_client import metrics
+from blab_chatbot_bot_client.data_structures import MessageType, OutgoingMessage
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from blab_chatbot_bot_client.conversation import BotClientConversation
+    from blab_chatbot_bot_client.data_structures import CompactMessage, Message
+
+FunctionType = TypeVar("FunctionType", bound="Callable[..., Any]")
+
+
+def _serialize(
+    message: Message | CompactMessage, answers: list[OutgoingMessage]
+) -> str:
+    """Convert answers to JSON, without their local ids.
+
+    Args:
+        message: the message that has been answered
+        answers: the answers
+
+    Returns:
+        the serialized answers
+    """
+    result = []
+    for answer in answers:
+        d = answer.to_dict()
+        del d["local_id"]
+        if answer.quoted_message_id and answer.quoted_message_id == message.id:
+            # the answer quotes the question, not a fixed message
+            del d["quoted_message_id"]
+            d["quotes_question"] = True
+        result.append(d)
+    return json.dumps(result)
+
+
+def _deserialize(
+    data: str, message: Message | CompactMessage, new_local_id: Callable[[], str]
+) -> list[OutgoingMessage]:
+    """Recreate answers from JSON.
+
+    Args:
+        data: the serialized answers
+        message: the message being answered
+        new_local_id: function that generates the local id of each answer
+
+    Returns:
+        the answers
+    """
+    return [
+        OutgoingMessage(
+            local_id=new_local_id(),
+            type=MessageType(d["type"]),
+            text=d.get("text"),
+            quoted_message_id=message.id
+            if d.get("quotes_question")
+            else d.get("quoted_message_id"),
+            command=d.get("command"),
+            options=d.get("options", []),
+            external_file_url=d.get("external_file_url"),
+        )
+        for d in json.loads(data)
+    ]
+
+
+class AnswerCache:
+    """Stores answers in memory and, optionally, in an SQLite database."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        max_size: int,
+        ttl: float = 0,
+        path: str | None = None,
+        disk_max_size: int = 0,
+        registry: metrics.MetricsRegistry = metrics.registry,
+    ):
+        """Create an instance.
+
+        Args:
+            max_size: maximum number of entries kept in memory
+            ttl: time (in seconds) after which entries expire (0 for never)
+            path: path to an SQLite database where entries are also stored
+            disk_max_size: maximum number of entries in the database
+                (0 for no limit); the oldest entries are removed first
+            registry: where the metrics are registered
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._disk_max_size = disk_max_size
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = Lock()
+        self._database: sqlite3.Connection | None = None
+        if path:
+            self._database = sqlite3.connect(
+                path, timeout=5, check_same_thread=False, isolation_level=None
+            )
+            self._database.execute("PRAGMA journal_mode=WAL")
+            self._database.execute(
+                "CREATE TABLE IF NOT EXISTS answers"
+                " (key TEXT PRIMARY KEY, expires REAL, data TEXT)"
+            )
+            self._database.execute(
+                "CREATE INDEX IF NOT EXISTS answers_expires ON answers (expires)"
+            )
+        self._hits = registry.counter(
+            "answer_cache_hits_total", "Number of messages answered from the cache"
+        )
+        self._misses = registry.counter(
+            "answer_cache_misses_total", "Number of messages not found in the cache"
+        )
+
+    def get(
+        self,
+        key: str,
+        message: Message | CompactMessage,
+        new_local_id: Callable[[], str],
+    ) -> list[OutgoingMessage] | None:
+        """Obtain the cached answers to a message.
+
+        Args:
+            key: the key of the message
+            message: the message being answered
+            new_local_id: function that generates the local id of each answer
+
+        Returns:
+            the answers (with new local ids), or ``None`` if they are not cached
+        """
+        now = time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] < now:
+                del self._entries[key]
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+            elif self._database:
+                row = self._database.execute(
+                    "SELECT expires, data FROM answers WHERE key = ? AND expires >= ?",
+                    (key, now),
+                ).fetchone()
+                if row:
+                    entry = row
+                    self._store_in_memory(key, row)
+        if entry is None:
+            self._misses.inc()
+            return None
+        self._hits.inc()
+        return _deserialize(entry[1], message, new_local_id)
+
+    def put(
+        self,
+        key: str,
+        message: Message | CompactMessage,
+        answers: list[OutgoingMessage],
+    ) -> None:
+        """Store the answers to a message.
+
+        Args:
+            key: the key of the message
+            message: the message that has been answered
+            answers: the answers
+        """
+        now = time()
+        entry = (
+            now + self._ttl if self._ttl else float("inf"),
+            _serialize(message, answers),
+        )
+        with self._lock:
+            self._store_in_memory(key, entry)
+            if self._database:
+                self._database.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?)", (key, *entry)
+                )
+                # replaced entries get new row ids, so the oldest have the lowest
+                self._database.execute(
+                    "DELETE FROM answers WHERE expires < ? OR (? > 0 AND rowid <="
+                    " (SELECT MAX(rowid) FROM answers) - ?)",
+                    (now, self._disk_max_size, self._disk_max_size),
+                )
+
+    def _store_in_memory(self, key: str, entry: tuple[float, str]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def _lookup(
+        self,
+        conversation: BotClientConversation[Any],
+        message: Message | CompactMessage,
+    ) -> tuple[str | None, list[OutgoingMessage] | None]:
+        key = conversation.answer_cache_key(message)
+        if key is None:
+            return None, None
+        return key, self.get(key, message, conversation.generate_local_id)
+
+    def wrap(
+        self,
+        conversation: BotClientConversation[Any],
+        generate_answer: FunctionType,
+    ) -> FunctionType:
+        """Wrap the method ``generate_answer`` of a conversation.
+
+        Args:
+            conversation: the conversation
+            generate_answer: the bound method (which can be a coroutine function,
+                a generator function or an async generator function)
+
+        Returns:
+            a function that returns the cached answers if they exist, and
+            otherwise calls ``generate_answer`` and caches its answers
+            (generated answers are passed on as they are produced, and
+            cached only if the generator is exhausted)
+        """
+        if isasyncgenfunction(generate_answer):
+            return self._wrap_async_generator(conversation, generate_answer)
+        if isgeneratorfunction(generate_answer):
+            return self._wrap_generator(conversation, generate_answer)
+
+        if iscoroutinefunction(generate_answer):
+
+            @wraps(generate_answer)
+            async def async_wrapper(message: Message | CompactMessage) -> Any:
+                key, answers = self._lookup(conversation, message)
+                if answers is None:
+                    answers = await generate_answer(message)
+                    if key is not None:
+                        self.put(key, message, answers)
+                return answers
+
+            return cast("FunctionType", async_wrapper)
+
+        @wraps(generate_answer)
+        def wrapper(message: Message | CompactMessage) -> Any:
+            key, answers = self._lookup(conversation, message)
+            if answers is None:
+                answers = list(generate_answer(message))
+                if key is not None:
+                    self.put(key, message, answers)
+            return answers
+
+        return cast("FunctionType", wrapper)
+
+    def _wrap_generator(
+        self,
+        conversation: BotClientConversation[Any],
+        generate_answer: FunctionType,
+    ) -> FunctionType:
+        @wraps(generate_answer)
+        def wrapper(message: Message | CompactMessage) -> Any:
+            key, answers = self._lookup(conversation, message)
+            if answers is not None:
+                yield from answers
+                return
+            answers = []
+            for answer in generate_answer(message):
+                answers.append(answer)
+                yield answer
+            if key is not None:
+                self.put(key, message, answers)
+
+        return cast("FunctionType", wrapper)
+
+    def _wrap_async_generator(
+        self,
+        conversation: BotClientConversation[Any],
+        generate_answer: FunctionType,
+    ) -> FunctionType:
+        @wraps(generate_answer)
+        async def wrapper(message: Message | CompactMessage) -> Any:
+            key, answers = self._lookup(conversation, message)
+            if answers is not None:
+                for answer in answers:
+                    yield answer
+                return
+            answers = []
+            async for answer in generate_answer(message):
+                answers.append(answer)
+                yield answer
+            if key is not None:
+                self.put(key, message, answers)
+
+        return cast("FunctionType", wrapper)
@@ -0,0 +1,588 @@
+"""Contains classes that download the files attached to messages.
+
+Messages with media (e.g. audio or video) carry the URL of their file
+(``file_url`` or ``external_file_url``). ``AttachmentFetcher`` downloads it
+in chunks, reusing HTTP connections to the same server, so that large files
+can be processed as they arrive without being held in memory.
+
+If a cache directory is configured (``ATTACHMENT_CACHE_DIR``), downloaded
+files are stored there, named after a hash of their URLs, and the least
+recently used ones are removed when the total size exceeds
+``ATTACHMENT_CACHE_SIZE``. Cached files can be read in chunks or mapped
+into memory, so that they are paged in by the operating system on demand.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from hashlib import sha256
+from http import HTTPStatus
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import IO, TYPE_CHECKING, Any, cast
+from urllib.parse import urljoin, urlsplit
+
+from blab_chatbot_bot_client import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+    from http.client import HTTPResponse
+
+    from blab_chatbot_bot_client.data_structures import CompactMessage, Message
+    from blab_chatbot_bot_client.settings_format import BlabConnectionSettings
+
+CHUNK_SIZE = 64 * 1024
+"""Default size (in bytes) of the chunks in which files are read"""
+
+MAX_REDIRECTS = 5
+"""Maximum number of redirections followed when a file is downloaded"""
+
+_REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+
+_TEMPORARY_PREFIX = ".download-"
+"""Prefix of the names of files that are still being downloaded"""
+
+
+class AttachmentError(Exception):
+    """Raised when an attached file cannot be downloaded."""
+
+
+def attachment_url(message: Message | CompactMessage) -> str | None:
+    """Obtain the URL of the file attached to a message.
+
+    Args:
+        message: the message
+
+    Returns:
+        the URL (possibly relative), or ``None`` if there is no file
+    """
+    return message.file_url or message.external_file_url
+
+
+class Blob:
+    """Represents a file stored in the attachment cache."""
+
+    __slots__ = ("path", "size")
+
+    def __init__(self, path: Path, size: int):
+        """Create an instance.
+
+        Args:
+            path: path to the file
+            size: size of the file (in bytes)
+        """
+        self.path = path
+        self.size = size
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({str(self.path)!r}, size={self.size})"
+
+    def open(self) -> IO[bytes]:
+        """Open the file for reading.
+
+        Returns
+            the open file (in binary mode)
+        """
+        return self.path.open("rb")
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Read the file in chunks.
+
+        Args:
+            chunk_size: maximum size of each chunk (in bytes)
+
+        Yields:
+            the chunks
+        """
+        with self.open() as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    @contextmanager
+    def mmap(self) -> Iterator[mmap.mmap | bytes]:
+        """Map the file into memory (read-only).
+
+        The returned object can be sliced and passed to functions that
+        accept bytes-like objects without reading the whole file. It must
+        not be used after the ``with`` block.
+
+        Yields
+            the memory map (or empty bytes if the file is empty)
+        """
+        with self.open() as f:
+            if not self.size:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield data
+
+
+class BlobCache:
+    """Stores downloaded files in a directory, limited by their total size.
+
+    It can be used by several threads and processes.
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        """Create an instance, creating the directory if it does not exist.
+
+        Args:
+            directory: directory where the files are stored
+            max_size: maximum total size of the files (in bytes); the least
+                recently used ones are removed when it is exceeded
+        """
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+        self._lock = Lock()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, url: str) -> Path:
+        return self._directory / sha256(url.encode("utf-8")).hexdigest()
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        """List the cached files.
+
+        Returns
+            the time of the last access, the size and the path of each file
+        """
+        result = []
+        for entry in os.scandir(self._directory):
+            if entry.name.startswith(_TEMPORARY_PREFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # removed by another process
+            result.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+        return result
+
+    def get(self, url: str) -> Blob | None:
+        """Obtain the cached file downloaded from a URL.
+
+        Args:
+            url: the URL of the file
+
+        Returns:
+            the file, or ``None`` if it is not cached
+        """
+        path = self._path(url)
+        try:
+            # the modification time marks the last access
+            os.utime(path)
+            return Blob(path, path.stat().st_size)
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def writer(self, url: str) -> Iterator[IO[bytes]]:
+        """Create a file where the contents downloaded from a URL are written.
+
+        The file is only added to the cache when the ``with`` block
+        finishes without errors.
+
+        Args:
+            url: the URL of the file
+
+        Yields:
+            the file open for writing
+        """
+        with self._temporary_file() as f:
+            yield f
+        self._publish(Path(f.name), url)
+
+    def store(self, url: str, chunks: Iterable[bytes]) -> Blob:
+        """Add the contents downloaded from a URL to the cache.
+
+        Args:
+            url: the URL of the file
+            chunks: the contents of the file
+
+        Returns:
+            the cached file
+        """
+        with self._temporary_file() as f:
+            for chunk in chunks:
+                f.write(chunk)
+        return self._publish(Path(f.name), url)
+
+    @contextmanager
+    def _temporary_file(self) -> Iterator[IO[bytes]]:
+        """Create a temporary file in the cache directory.
+
+        The file is removed if the ``with`` block raises an exception.
+
+        Yields
+            the file open for writing
+        """
+        with NamedTemporaryFile(
+            dir=self._directory, prefix=_TEMPORARY_PREFIX, delete=False
+        ) as f:
+            try:
+                yield cast(IO[bytes], f)
+            except BaseException:
+                f.close()
+                Path(f.name).unlink(missing_ok=True)
+                raise
+
+    def _publish(self, temporary_path: Path, url: str) -> Blob:
+        """Move a downloaded file into the cache.
+
+        Args:
+            temporary_path: path to the temporary file
+            url: the URL of the file
+
+        Returns:
+            the cached file (it is not removed by the eviction
+            that its addition may cause)
+        """
+        path = self._path(url)
+        size = temporary_path.stat().st_size
+        temporary_path.replace(path)
+        with self._lock:
+            self._size += size
+            if self._size > self._max_size:
+                self._evict(keep=path)
+        return Blob(path, size)
+
+    def _evict(self, keep: Path) -> None:
+        """Remove the least recently used files until the size limit is met.
+
+        Args:
+            keep: a file that is not removed (the most recent one)
+        """
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self._max_size:
+                break
+            if path == keep:
+                continue
+            # files mapped into memory remain readable until they are closed
+            path.unlink(missing_ok=True)
+            self._size -= size
+
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _pool_key(scheme: str, host: str, port: int) -> tuple[str, str, int]:
+    return scheme, host.lower(), port
+
+
+class ConnectionPool:
+    """Keeps HTTP connections open so that they can be reused.
+
+    It can be used by several threads.
+    """
+
+    def __init__(self, timeout: float = 30, max_idle_per_host: int = 4):
+        """Create an empty pool.
+
+        Args:
+            timeout: timeout (in seconds) of the connections
+            max_idle_per_host: maximum number of idle connections
+                kept for each server
+        """
+        self._timeout = timeout
+        self._max_idle_per_host = max_idle_per_host
+        self._idle: dict[tuple[str, str, int], deque[HTTPConnection]] = {}
+        self._lock = Lock()
+
+    def request(self, url: str) -> tuple[HTTPConnection, HTTPResponse]:
+        """Send a GET request.
+
+        An idle connection to the server is reused if there is one.
+        After reading the response, the connection must be returned
+        with ``release``.
+
+        Args:
+            url: absolute URL (``http`` or ``https``)
+
+        Returns:
+            the connection and the response (whose body has not been read)
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            error = f"Unsupported URL: {url}"
+            raise AttachmentError(error)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        key = _pool_key(
+            parts.scheme,
+            parts.hostname or "",
+            parts.port or _DEFAULT_PORTS[parts.scheme],
+        )
+        with self._lock:
+            idle = self._idle.get(key)
+            connection = idle.pop() if idle else None
+        if connection:
+            try:
+                connection.request("GET", target)
+                return connection, connection.getresponse()
+            except (HTTPException, OSError):
+                connection.close()  # closed by the server while idle
+        connection_class = (
+            HTTPSConnection if parts.scheme == "https" else HTTPConnection
+        )
+        # the host and the port are passed separately, since the network
+        # location may contain credentials
+        new_connection = connection_class(
+            parts.hostname or "", parts.port, timeout=self._timeout
+        )
+        new_connection.request("GET", target)
+        return new_connection, new_connection.getresponse()
+
+    def release(self, connection: HTTPConnection, response: HTTPResponse) -> None:
+        """Return a connection whose response has been read completely.
+
+        Args:
+            connection: the connection
+            response: the response obtained from the connection
+        """
+        if response.will_close or not response.isclosed():
+            connection.close()
+            return
+        key = _pool_key(
+            "https" if isinstance(connection, HTTPSConnection) else "http",
+            connection.host,
+            connection.port,
+        )
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            if len(idle) < self._max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self) -> None:
+        """Close all the idle connections."""
+        with self._lock:
+            connections = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+
+class AttachmentFetcher:
+    """Downloads attached files, optionally caching them on disk."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        cache_dir: str | None = None,
+        max_cache_size: int = 1024**3,
+        base_url: str | None = None,
+        timeout: float = 30,
+        registry: metrics.MetricsRegistry = metrics.registry,
+    ):
+        """Create an instance.
+
+        Args:
+            cache_dir: directory where downloaded files are cached
+                (by default, they are not cached)
+            max_cache_size: maximum total size (in bytes) of the cached files
+            base_url: URL against which relative URLs are resolved
+            timeout: timeout (in seconds) of the connections
+            registry: where the metrics are registered
+        """
+        self._cache = BlobCache(cache_dir, max_cache_size) if cache_dir else None
+        self._base_url = base_url
+        self._pool = ConnectionPool(timeout)
+        # downloads in progress for fetch, shared by concurrent calls
+        self._downloads: dict[str, Future[Blob]] = {}
+        self._downloads_lock = Lock()
+        self._hits = registry.counter(
+            "attachment_cache_hits_total",
+            "Number of attached files read from the cache",
+        )
+        self._misses = registry.counter(
+            "attachment_cache_misses_total",
+            "Number of attached files not found in the cache",
+        )
+        self._downloaded = registry.counter(
+            "attachment_downloaded_bytes_total",
+            "Number of bytes of attached files downloaded",
+        )
+
+    @classmethod
+    def from_settings(
+        cls, connection_settings: BlabConnectionSettings
+    ) -> AttachmentFetcher:
+        """Create an instance with the values defined in the settings.
+
+        Args:
+            connection_settings: the connection settings
+
+        Returns:
+            the new instance
+        """
+        base_url = connection_settings.get("ATTACHMENT_BASE_URL")
+        if base_url is None:
+            ws_url = cast("dict[str, Any]", connection_settings).get(
+                "BLAB_CONTROLLER_WS_URL"
+            )
+            if ws_url:
+                # ws://host -> http://host, wss://host -> https://host
+                base_url = "http" + ws_url[2:] + "/"
+        return cls(
+            connection_settings.get("ATTACHMENT_CACHE_DIR"),
+            connection_settings.get("ATTACHMENT_CACHE_SIZE", 1024**3),
+            base_url,
+            connection_settings.get("ATTACHMENT_TIMEOUT", 30),
+        )
+
+    def _resolve(self, url: str) -> str:
+        return urljoin(self._base_url, url) if self._base_url else url
+
+    def stream(self, url: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Read a file in chunks, downloading it only if it is not cached.
+
+        The download starts when the first chunk is requested. If there is
+        a cache, the file is stored there as it is read (only if it is read
+        until the end).
+
+        Args:
+            url: the URL of the file (relative URLs are resolved
+                against the base URL)
+            chunk_size: maximum size of each chunk (in bytes)
+
+        Yields:
+            the chunks
+        """
+        url = self._resolve(url)
+        blob = self._cache.get(url) if self._cache else None
+        if blob:
+            self._hits.inc()
+            yield from blob.chunks(chunk_size)
+            return
+        self._misses.inc()
+        if not self._cache:
+            yield from self._download(url, chunk_size)
+            return
+        with self._cache.writer(url) as f:
+            for chunk in self._download(url, chunk_size):
+                f.write(chunk)
+                yield chunk
+
+    def fetch(self, url: str) -> Blob:
+        """Obtain a file from the cache, downloading it if necessary.
+
+        Concurrent calls for the same file share a single download.
+
+        Args:
+            url: the URL of the file (relative URLs are resolved
+                against the base URL)
+
+        Raises:
+            AttachmentError: if the file cannot be downloaded
+            ValueError: if there is no cache
+
+        Returns:
+            the cached file
+        """
+        if not self._cache:
+            error = "ATTACHMENT_CACHE_DIR is not defined"
+            raise ValueError(error)
+        url = self._resolve(url)
+        blob = self._cache.get(url)
+        if blob:
+            self._hits.inc()
+            return blob
+        with self._downloads_lock:
+            download = self._downloads.get(url)
+            if download:
+                owner = False
+            else:
+                owner = True
+                download = self._downloads[url] = Future()
+        if not owner:
+            # another thread is downloading the same file
+            return download.result()
+        self._misses.inc()
+        try:
+            blob = self._cache.store(url, self._download(url, CHUNK_SIZE))
+        except BaseException as e:
+            download.set_exception(e)
+            raise
+        else:
+            download.set_result(blob)
+            return blob
+        finally:
+            with self._downloads_lock:
+                del self._downloads[url]
+
+    def _download(self, url: str, chunk_size: int) -> Iterator[bytes]:
+        """Download a file in chunks, following redirections.
+
+        Args:
+            url: the absolute URL of the file
+            chunk_size: maximum size of each chunk (in bytes)
+
+        Yields:
+            the chunks
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            connection: HTTPConnection | None = None
+            try:
+                connection, response = self._pool.request(url)
+                if response.status != HTTPStatus.OK:
+                    # the body of redirections and errors is discarded
+                    response.read()
+                    self._pool.release(connection, response)
+            except (HTTPException, OSError) as e:
+                if connection:
+                    connection.close()
+                error = f"Could not download {url}: {e!r}"
+                raise AttachmentError(error) from e
+            location = response.getheader("Location")
+            if response.status in _REDIRECT_STATUSES and location:
+                url = urljoin(url, location)
+                continue
+            if response.status != HTTPStatus.OK:
+                error = f"Could not download {url}: HTTP status {response.status}"
+                raise AttachmentError(error)
+            try:
+                while chunk := self._read(response, url, chunk_size):
+                    self._downloaded.inc(len(chunk))
+                    yield chunk
+            except BaseException:
+                # the rest of the response is not read, so it cannot be reused
+                connection.close()
+                raise
+            self._pool.release(connection, response)
+            return
+        error = f"Could not download {url}: too many redirections"
+        raise AttachmentError(error)
+
+    @classmethod
+    def _read(cls, response: HTTPResponse, url: str, chunk_size: int) -> bytes:
+        """Read the next chunk of the body of a response.
+
+        Args:
+            response: the response
+            url: the URL of the file (used in error messages)
+            chunk_size: maximum size of the chunk (in bytes)
+
+        Raises:
+            AttachmentError: if the connection fails (e.g. it is closed
+                before the end of the body)
+
+        Returns:
+            the chunk (empty at the end of the body)
+        """
+        try:
+            return response.read(chunk_size)
+        except (HTTPException, OSError) as e:
+            error = f"Could not download {url}: {e!r}"
+            raise AttachmentError(error) from e
+
+    def close(self) -> None:
+        """Close the idle connections."""
+        self._pool.close()
@@ -0,0 +1,253 @@
+"""Contains a tool that answers a large set of conversations offline.
+
+Each line of the input file is a JSON object that describes a conversation.
+It contains either the messages sent by the user (``"messages"``, a list of
+strings) or a single message (``"text"``), and optionally an id (``"id"``,
+by default the line number). For example::
+
+    {"id": "q1", "text": "What is the capital of Brazil?"}
+    {"id": "q2", "messages": ["Hi", "How deep is the Atlantic Ocean?"]}
+
+Each line of the output file is a JSON object with the id of the conversation,
+the greetings of the bot (``"greeting"``, only if it sends the first message)
+and the answers to each user message (``"answers"``), in the format of
+``OutgoingMessage.to_dict``. If the bot raises an exception, the output
+contains the error (``"error"``) instead.
+
+The conversations are answered in parallel by a pool of processes, each of
+them in a new instance of the conversation class. The input is read as it is
+consumed, and the output is written in the same order as the input.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from time import monotonic
+from typing import TYPE_CHECKING, Any, TextIO
+
+from blab_chatbot_bot_client.conversation import iterate_answers
+from blab_chatbot_bot_client.data_structures import Message, MessageType
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    from blab_chatbot_bot_client.conversation import BotClientConversation
+    from blab_chatbot_bot_client.settings_format import BlabBotClientSettings
+
+
+@dataclass
+class BatchAnswerResult:
+    """Contains statistics about a batch of answered conversations."""
+
+    conversations: int = 0
+    """Number of conversations in the input"""
+
+    failed_conversations: int = 0
+    """Number of conversations where the bot raised an exception"""
+
+    messages: int = 0
+    """Number of user messages answered"""
+
+    elapsed_time: float = 0
+    """Duration of the processing (in seconds)"""
+
+    def report(self) -> str:
+        """Summarize the results.
+
+        Returns
+            a human-readable summary
+        """
+        elapsed_time = self.elapsed_time or 1
+        return "\n".join(
+            [
+                f"conversations: {self.conversations} "
+                f"({self.failed_conversations} failed)",
+                f"messages: {self.messages}",
+                f"elapsed time: {self.elapsed_time:.2f} s",
+                f"conversations per second: {self.conversations / elapsed_time:.2f}",
+                f"messages per second: {self.messages / elapsed_time:.2f}",
+            ]
+        )
+
+
+class _Worker:
+    """Answers conversations in a worker process."""
+
+    instance: _Worker | None = None
+    """The instance used by the current worker process"""
+
+    def __init__(
+        self,
+        client: type[BotClientConversation[Any]],
+        settings: BlabBotClientSettings,
+    ):
+        self._client = client
+        self._settings = settings
+        self._loop = asyncio.new_event_loop()
+
+    @classmethod
+    def initialize(
+        cls, client: type[BotClientConversation[Any]], config_path: str
+    ) -> None:
+        from blab_chatbot_bot_client.cli import BlabBotClientArgParser
+
+        settings = BlabBotClientArgParser._load_config(config_path)
+        client.ensure_warmed_up(settings)
+        cls.instance = _Worker(client, settings)
+
+    @classmethod
+    def answer_chunk(cls, lines: list[tuple[int, str]]) -> list[tuple[str, int, bool]]:
+        assert cls.instance  # noqa: S101
+        return [cls.instance.answer(n, line) for n, line in lines]
+
+    async def _create_bot(self, conversation_id: str) -> BotClientConversation[Any]:
+        return self._client(self._settings, conversation_id, "bot")
+
+    def answer(self, line_number: int, line: str) -> tuple[str, int, bool]:
+        """Answer a conversation.
+
+        Args:
+            line_number: number of the line in the input file
+            line: the line that describes the conversation
+
+        Returns:
+            the output line, the number of user messages and
+            whether the conversation was answered successfully
+        """
+        result: dict[str, Any] = {"id": line_number}
+        texts: list[str] = []
+        try:
+            record = json.loads(line)
+            result["id"] = record.get("id", line_number)
+            conversation_id = str(result["id"])
+            texts = record["messages"] if "messages" in record else [record["text"]]
+            bot = self._loop.run_until_complete(self._create_bot(conversation_id))
+            if self._client.bot_sends_first_message():
+                result["greeting"] = [
+                    m.to_dict()
+                    for m in iterate_answers(bot.generate_greeting(), self._loop)
+                ]
+            result["answers"] = []
+            for n, text in enumerate(texts, 1):
+                message = Message(
+                    type=MessageType.TEXT,
+                    text=text,
+                    sent_by_human=True,
+                    sender_id="user",
+                    time=datetime.now(),
+                    id=f"m{n}",
+                    local_id=f"user_m{n}",
+                )
+                answers = iterate_answers(bot.generate_answer(message), self._loop)
+                result["answers"].append([m.to_dict() for m in answers])
+        except Exception as e:  # noqa: BLE001
+            result = {"id": result["id"], "error": repr(e)}
+            return json.dumps(result), len(texts), False
+        return json.dumps(result), len(texts), True
+
+
+def _read_chunks(lines: Iterable[str], size: int) -> Iterator[list[tuple[int, str]]]:
+    numbered = ((n, line) for n, line in enumerate(lines, 1) if line.strip())
+    while chunk := list(islice(numbered, size)):
+        yield chunk
+
+
+def answer_batch(  # noqa: PLR0913
+    client: type[BotClientConversation[Any]],
+    config_path: str,
+    input_file: TextIO,
+    output_file: TextIO,
+    jobs: int,
+    chunk_size: int = 16,
+) -> BatchAnswerResult:
+    """Answer the conversations described in a file.
+
+    Args:
+        client: the conversation class
+        config_path: path to the settings file (loaded by each worker)
+        input_file: file with one conversation per line
+        output_file: file where the answers are written
+        jobs: number of worker processes (if it is 1 or less,
+            the conversations are answered in the current process)
+        chunk_size: number of conversations sent to a worker at once
+
+    Returns:
+        the statistics of the processing
+    """
+    result = BatchAnswerResult()
+    start = monotonic()
+
+    def write(chunk_results: list[tuple[str, int, bool]]) -> None:
+        for line, messages, ok in chunk_results:
+            output_file.write(line + "\n")
+            result.conversations += 1
+            result.messages += messages
+            result.failed_conversations += not ok
+
+    chunks = _read_chunks(input_file, chunk_size)
+    if jobs <= 1:
+        _Worker.initialize(client, config_path)
+        for chunk in chunks:
+            write(_Worker.answer_chunk(chunk))
+    else:
+        with ProcessPoolExecutor(
+            jobs, initializer=_Worker.initialize, initargs=(client, config_path)
+        ) as executor:
+            # at most a few chunks per worker are in memory at once
+            pending: deque[Future[list[tuple[str, int, bool]]]] = deque()
+            for chunk in chunks:
+                if len(pending) >= 4 * jobs:
+                    write(pending.popleft().result())
+                pending.append(executor.submit(_Worker.answer_chunk, chunk))
+            while pending:
+                write(pending.popleft().result())
+    result.elapsed_time = monotonic() - start
+    return result
+
+
+def answer_batch_files(  # noqa: PLR0913
+    client: type[BotClientConversation[Any]],
+    config_path: str,
+    input_path: str,
+    output_path: str,
+    jobs: int,
+    chunk_size: int = 16,
+) -> BatchAnswerResult:
+    """Answer the conversations described in a file and write them to another file.
+
+    Args:
+        client: the conversation class
+        config_path: path to the settings file (loaded by each worker)
+        input_path: path to the input file (``-`` for the standard input)
+        output_path: path to the output file (``-`` for the standard output)
+        jobs: number of worker processes
+        chunk_size: number of conversations sent to a worker at once
+
+    Returns:
+        the statistics of the processing
+    """
+    input_file = (
+        sys.stdin if input_path == "-" else Path(input_path).open(encoding="utf-8")
+    )
+    output_file = (
+        sys.stdout
+        if output_path == "-"
+        else Path(output_path).open("w", encoding="utf-8")
+    )
+    try:
+        return answer_batch(
+            client, config_path, input_file, output_file, jobs, chunk_size
+        )
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
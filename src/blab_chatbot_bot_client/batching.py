@@ -0,0 +1,138 @@
+"""Contains a class that groups messages from concurrent conversations.
+
+The messages are accumulated for a short time window (or until a maximum
+batch size is reached) and answered with a single call, so that bots backed
+by models that process batches efficiently can use them.
+"""
+
+from __future__ import annotations
+
+from logging import getLogger
+from threading import Condition, Thread
+from time import monotonic
+from typing import TYPE_CHECKING, Any
+
+from blab_chatbot_bot_client import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from blab_chatbot_bot_client.conversation import BotClientConversation
+    from blab_chatbot_bot_client.data_structures import (
+        CompactMessage,
+        Message,
+        OutgoingMessage,
+    )
+
+
+class AnswerBatcher:
+    """Groups messages and answers them in batches."""
+
+    def __init__(
+        self,
+        generate: Callable[
+            [list[tuple[BotClientConversation[Any], Message | CompactMessage]]],
+            list[list[OutgoingMessage]],
+        ],
+        window: float,
+        max_size: int,
+        registry: metrics.MetricsRegistry = metrics.registry,
+    ):
+        """Create an instance and start the thread that processes the batches.
+
+        Args:
+            generate: function that receives a batch and returns the answers
+                to each of its messages (in the same order)
+            window: maximum time (in seconds) that the first message of
+                a batch waits for other messages
+            max_size: maximum number of messages in a batch
+            registry: where the metrics are registered
+        """
+        self._generate = generate
+        self._window = window
+        self._max_size = max_size
+        self._pending: list[
+            tuple[BotClientConversation[Any], Message | CompactMessage]
+        ] = []
+        self._first_arrival = 0.0
+        self._condition = Condition()
+        registry.gauge(
+            "answer_batch_window_seconds", "Maximum time a message waits for a batch"
+        ).set(window)
+        registry.gauge(
+            "answer_batch_max_size", "Maximum number of messages in a batch"
+        ).set(max_size)
+        self._last_size_gauge = registry.gauge(
+            "answer_batch_last_size", "Number of messages in the last batch"
+        )
+        self._batches_counter = registry.counter(
+            "answer_batches_total", "Number of batches answered"
+        )
+        self._messages_counter = registry.counter(
+            "answer_batched_messages_total", "Number of messages answered in batches"
+        )
+        Thread(target=self._work, name="answer-batcher", daemon=True).start()
+
+    def submit(
+        self,
+        conversation: BotClientConversation[Any],
+        message: Message | CompactMessage,
+    ) -> None:
+        """Add a message to the next batch.
+
+        The answers are enqueued in the conversation when they are generated.
+
+        Args:
+            conversation: the conversation where the message was sent
+            message: the message to be answered
+        """
+        with self._condition:
+            if not self._pending:
+                self._first_arrival = monotonic()
+            self._pending.append((conversation, message))
+            self._condition.notify()
+
+    def _next_batch(
+        self,
+    ) -> list[tuple[BotClientConversation[Any], Message | CompactMessage]]:
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending)
+            self._condition.wait_for(
+                lambda: len(self._pending) >= self._max_size,
+                self._first_arrival + self._window - monotonic(),
+            )
+            batch = self._pending[: self._max_size]
+            del self._pending[: self._max_size]
+            if self._pending:
+                self._first_arrival = monotonic()
+            return batch
+
+    def _work(self) -> None:
+        while True:
+            batch = self._next_batch()
+            self._last_size_gauge.set(len(batch))
+            self._batches_counter.inc()
+            self._messages_counter.inc(len(batch))
+            try:
+                answers = list(self._generate(batch))
+            except Exception:  # noqa: BLE001
+                getLogger(__name__).exception("error while answering a batch")
+                continue
+            if len(answers) != len(batch):
+                getLogger(__name__).error(
+                    "%d lists of answers were generated for a batch of %d messages",
+                    len(answers),
+                    len(batch),
+                )
+                continue
+            # the lengths have been checked
+            for (conversation, _), conversation_answers in zip(  # noqa: B905
+                batch, answers
+            ):
+                try:
+                    conversation._enqueue_batched_answers(list(conversation_answers))
+                except Exception:  # noqa: BLE001
+                    getLogger(__name__).exception(
+                        "error while enqueuing the answers of conversation %s",
+                        conversation.conversation_id,
+                    )
@@ -0,0 +1,281 @@
+"""Contains micro-benchmarks of the hot paths of the library.
+
+Usage::
+
+    python -m blab_chatbot_bot_client.benchmark run --save baseline.json
+    python -m blab_chatbot_bot_client.benchmark run --save new.json
+    python -m blab_chatbot_bot_client.benchmark compare baseline.json new.json
+
+Each benchmark is executed several times, and the fastest time per operation
+is reported. ``compare`` exits with status 1 if any benchmark is slower than
+the baseline by more than the given threshold.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median
+from timeit import Timer
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any
+
+from blab_chatbot_bot_client.codec import CODECS
+from blab_chatbot_bot_client.conversation import BotClientConversation
+from blab_chatbot_bot_client.data_structures import (
+    Message,
+    MessageType,
+    OutgoingMessage,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+_TEXT_MESSAGE = {
+    "id": "5e0d9d4c-8f5b-4a4e-9d43-2b7a3a6f8e11",
+    "time": "2023-06-01T12:34:56.789012Z",
+    "type": "T",
+    "sent_by_human": True,
+    "text": "Qual é a profundidade média do oceano Atlântico? " * 3,
+    "sender_id": "0b8e5c3e-7f4c-4b41-8c7b-7d8e6f5a4b3c",
+    "local_id": "e2c1f1a0d4b34f7c9f1e2d3c4b5a6978",
+    "quoted_message_id": None,
+    "options": None,
+    "file": None,
+}
+
+_SYSTEM_MESSAGE = {
+    "id": "8a6f3b2c-1d4e-4f5a-9b8c-7d6e5f4a3b2c",
+    "time": "2023-06-01T12:34:50+00:00",
+    "type": "S",
+    "sent_by_human": False,
+    "event": "participant-joined",
+    "additional_metadata": {
+        "participant_id": "0b8e5c3e-7f4c-4b41-8c7b-7d8e6f5a4b3c",
+        "participant_name": "Maria",
+        "participants": [{"id": str(i), "name": f"user {i}"} for i in range(10)],
+    },
+}
+
+_OPTIONS_MESSAGE = {
+    **_TEXT_MESSAGE,
+    "sent_by_human": False,
+    "options": [f"Option number {i}" for i in range(100)],
+}
+
+_OUTGOING_TEXT = OutgoingMessage(
+    local_id="e2c1f1a0d4b34f7c9f1e2d3c4b5a6978",
+    type=MessageType.TEXT,
+    text="A profundidade média do oceano Atlântico é de 3646 metros.",
+)
+
+_OUTGOING_OPTIONS = OutgoingMessage(
+    local_id="e2c1f1a0d4b34f7c9f1e2d3c4b5a6978",
+    type=MessageType.TEXT,
+    text="Escolha uma opção:",
+    options=[f"Option number {i}" for i in range(100)],
+)
+
+
+def _settings() -> Any:
+    return SimpleNamespace(
+        BLAB_CONNECTION_SETTINGS={
+            "BOT_HTTP_SERVER_HOSTNAME": "127.0.0.1",
+            "BOT_HTTP_SERVER_PORT": 0,
+            "BLAB_CONTROLLER_WS_URL": "ws://127.0.0.1:0",
+        }
+    )
+
+
+def _enqueue_benchmark() -> Callable[[], None]:
+    conversation = BotClientConversation(_settings(), "c", "b")
+    outbox = conversation._outgoing_message_queue
+
+    def run() -> None:
+        conversation.enqueue_message(_OUTGOING_TEXT)
+        outbox.mark_sent(len(outbox.get_all() or ()))
+
+    return run
+
+
+def _dispatch_benchmark(frame: dict[str, Any]) -> Callable[[], None]:
+    from blab_chatbot_bot_client.conversation_websocket import (
+        WebSocketBotClientConversation,
+    )
+
+    conversation: WebSocketBotClientConversation[Any] = WebSocketBotClientConversation(
+        _settings(), "c", "b"
+    )
+    data = json.dumps(frame)
+    return lambda: conversation._on_message(None, data)  # type: ignore[arg-type]
+
+
+def _echo_benchmark() -> Callable[[], None]:
+    from blab_chatbot_bot_client.conversation_websocket import (
+        WebSocketBotClientConversation,
+    )
+
+    settings = _settings()
+    settings.BLAB_CONNECTION_SETTINGS["DELIVER_OWN_MESSAGES"] = False
+    conversation: WebSocketBotClientConversation[Any] = WebSocketBotClientConversation(
+        settings, "c", "b"
+    )
+    data = json.dumps(
+        {
+            "message": {
+                **_TEXT_MESSAGE,
+                "sent_by_human": False,
+                "local_id": _OUTGOING_TEXT.local_id,
+            }
+        }
+    )
+
+    def run() -> None:
+        conversation._track_outgoing_message(_OUTGOING_TEXT)
+        conversation._on_message(None, data)  # type: ignore[arg-type]
+
+    return run
+
+
+def _codec_benchmark(name: str, frame: dict[str, Any]) -> Callable[[], Any]:
+    codec = CODECS[name]()
+    data = json.dumps(frame).encode("utf-8")
+    return lambda: codec.decode_frame(data)
+
+
+def benchmarks() -> dict[str, Callable[[], Any]]:
+    """Create the benchmarks.
+
+    Returns
+        a dict that maps the name of each benchmark to a function
+        that executes the measured operation once
+    """
+    result: dict[str, Callable[[], Any]] = {
+        "Message.from_dict[text]": lambda: Message.from_dict(_TEXT_MESSAGE),
+        "Message.from_dict[system]": lambda: Message.from_dict(_SYSTEM_MESSAGE),
+        "Message.from_dict[options]": lambda: Message.from_dict(_OPTIONS_MESSAGE),
+        "OutgoingMessage.to_dict[text]": _OUTGOING_TEXT.to_dict,
+        "OutgoingMessage.to_dict[options]": _OUTGOING_OPTIONS.to_dict,
+        "generate_local_id": BotClientConversation.generate_local_id,
+        "enqueue_message": _enqueue_benchmark(),
+    }
+    # benchmarks that depend on optional packages are skipped if they are missing
+    for name in CODECS:
+        with contextlib.suppress(ImportError):
+            result[f"codec.decode_frame[{name}]"] = _codec_benchmark(
+                name, {"message": _TEXT_MESSAGE}
+            )
+    with contextlib.suppress(ImportError):
+        result["on_message[text]"] = _dispatch_benchmark({"message": _TEXT_MESSAGE})
+        result["on_message[system+state]"] = _dispatch_benchmark(
+            {"message": _SYSTEM_MESSAGE, "state": {"participants": ["a", "b"]}}
+        )
+        result["on_message[own message]"] = _echo_benchmark()
+    return result
+
+
+def run_benchmarks(
+    selected: str | None = None, repeat: int = 5, min_time: float = 0.2
+) -> dict[str, dict[str, float]]:
+    """Run the benchmarks.
+
+    Args:
+        selected: if given, only benchmarks whose names contain this string are run
+        repeat: number of measurements of each benchmark
+        min_time: minimum duration (in seconds) of each measurement
+
+    Returns:
+        a dict that maps the name of each benchmark to the fastest and
+        the median time per operation (in nanoseconds)
+    """
+    results = {}
+    for name, function in benchmarks().items():
+        if selected and selected not in name:
+            continue
+        timer = Timer(function)
+        number, elapsed = timer.autorange()
+        number = max(int(number * min_time / max(elapsed, 1e-9)), 1)
+        times = [t / number * 1e9 for t in timer.repeat(repeat, number)]
+        results[name] = {"min": min(times), "median": median(times)}
+        print(f"{name:40} {min(times):12.1f} ns/op", file=sys.stderr)
+    return results
+
+
+def save_results(path: Path, results: dict[str, dict[str, float]]) -> None:
+    """Save the results of the benchmarks as JSON.
+
+    Args:
+        path: path to the output file
+        results: the results returned by ``run_benchmarks``
+    """
+    data = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    path.write_text(json.dumps(data, indent=2))
+
+
+def compare_results(baseline: Path, current: Path, threshold: float) -> bool:
+    """Compare the results saved in two files.
+
+    Args:
+        baseline: path to the results used as reference
+        current: path to the results being evaluated
+        threshold: maximum tolerated slowdown (e.g. 0.1 for 10%)
+
+    Returns:
+        ``True`` if no benchmark got slower than the threshold
+    """
+    old = json.loads(baseline.read_text())["results"]
+    new = json.loads(current.read_text())["results"]
+    ok = True
+    for name in sorted(old.keys() & new.keys()):
+        ratio = new[name]["min"] / old[name]["min"]
+        regression = ratio > 1 + threshold
+        ok = ok and not regression
+        print(
+            f"{name:40} {old[name]['min']:12.1f} {new[name]['min']:12.1f} ns/op"
+            f" {ratio - 1:+8.1%}{'  REGRESSION' if regression else ''}"
+        )
+    return ok
+
+
+def main(arguments: list[str] | None = None) -> int:
+    """Run the command-line interface of the benchmarks.
+
+    Args:
+        arguments: the raw command-line arguments
+
+    Returns:
+        the exit status
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--save", type=Path, help="save the results as JSON")
+    run_parser.add_argument("--select", help="only run matching benchmarks")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    compare_parser = subparsers.add_parser("compare", help="compare two runs")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="tolerated slowdown"
+    )
+    args = parser.parse_args(arguments)
+    if args.command == "run":
+        results = run_benchmarks(args.select, args.repeat)
+        if args.save:
+            save_results(args.save, results)
+        return 0
+    return 0 if compare_results(args.baseline, args.current, args.threshold) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+"""Contains a class that signals that the generation of answers should stop.
+
+When the setting ``CANCEL_SUPERSEDED`` is enabled, the answers to a message
+sent by the user are no longer needed once the user sends a newer message.
+``enqueue_answer`` then stops enqueueing the answers to the older message
+(closing ``generate_answer`` if it is a generator), and long computations in
+``generate_answer`` can check the token returned by
+``BotClientConversation.cancellation_token`` to stop early.
+"""
+
+from __future__ import annotations
+
+from threading import Event
+
+
+class CancellationToken:
+    """Signals that a generation of answers should stop. It is thread-safe."""
+
+    def __init__(self) -> None:
+        """Create a token that has not been cancelled."""
+        self._event = Event()
+
+    def cancel(self) -> None:
+        """Request the cancellation."""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the cancellation has been requested."""
+        return self._event.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """Block until the cancellation is requested or the timeout expires.
+
+        Args:
+            timeout: maximum time to wait (in seconds)
+
+        Returns:
+            whether the cancellation has been requested
+        """
+        return self._event.wait(timeout)
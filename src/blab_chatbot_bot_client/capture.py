@@ -0,0 +1,140 @@
+"""Contains classes that record and read the frames of conversations.
+
+A capture file starts with an 8-byte signature (``SIGNATURE``), followed by
+records appended in the order the events happened. Each record has a 13-byte
+little-endian header (the direction as an unsigned byte, the value of
+``time.monotonic`` as a double and the length of the payload as an unsigned
+32-bit integer), followed by the payload (the frame, encoded as UTF-8).
+
+Captures are written when the setting ``CAPTURE_DIR`` is defined, with one file
+per conversation (named after its id). They are read with memory mapping,
+so large captures do not need to fit in memory.
+"""
+
+from __future__ import annotations
+
+import mmap
+import struct
+from dataclasses import dataclass
+from enum import IntEnum
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+SIGNATURE = b"BLABCAP\x01"
+"""Bytes at the beginning of every capture file"""
+
+_HEADER = struct.Struct("<BdI")
+
+
+class Direction(IntEnum):
+    """Represents the kind of event recorded in a capture."""
+
+    INCOMING = 0
+    """A frame received from the controller"""
+
+    OUTGOING = 1
+    """A frame sent to the controller"""
+
+    CONNECTED = 2
+    """The connection with the controller was established (no payload)"""
+
+
+@dataclass(frozen=True)
+class CaptureRecord:
+    """Represents an event recorded in a capture."""
+
+    direction: Direction
+    """Kind of event"""
+
+    time: float
+    """When the event happened (as returned by ``time.monotonic``)"""
+
+    payload: bytes
+    """The frame (encoded as UTF-8)"""
+
+
+class CaptureWriter:
+    """Appends records to a capture file. It can be used by several threads."""
+
+    def __init__(self, path: Path):
+        """Open a capture file, creating it if it does not exist.
+
+        Args:
+            path: path to the capture file
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = path.open("ab")
+        self._lock = Lock()
+        if self._file.tell() == 0:
+            self._file.write(SIGNATURE)
+
+    def write(self, direction: Direction, frame: str | bytes = b"") -> None:
+        """Append a record with the current time.
+
+        Args:
+            direction: kind of event
+            frame: the frame (text is encoded as UTF-8)
+        """
+        payload = frame.encode("utf-8") if isinstance(frame, str) else frame
+        header = _HEADER.pack(direction, monotonic(), len(payload))
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(header + payload)
+
+    def close(self) -> None:
+        """Close the capture file."""
+        with self._lock:
+            self._file.close()
+
+
+def capture_path(directory: str | Path, conversation_id: str) -> Path:
+    """Obtain the path to the capture file of a conversation.
+
+    Args:
+        directory: directory where captures are written
+        conversation_id: id of the conversation
+
+    Returns:
+        the path to the capture file
+    """
+    name = "".join(c if c.isalnum() or c in "-_" else "_" for c in conversation_id)
+    return Path(directory) / f"{name}.cap"
+
+
+def read_capture(path: Path) -> Iterator[CaptureRecord]:
+    """Read the records in a capture file, in the order they were written.
+
+    A truncated record at the end of the file (e.g. if the process was killed
+    while it was written) is ignored.
+
+    Args:
+        path: path to the capture file
+
+    Raises:
+        ValueError: if the file is not a capture
+
+    Yields:
+        the records
+    """
+    with path.open("rb") as f:
+        if path.stat().st_size < len(SIGNATURE):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[: len(SIGNATURE)] != SIGNATURE:
+                error = f"{path} is not a capture file"
+                raise ValueError(error)
+            offset = len(SIGNATURE)
+            while offset + _HEADER.size <= len(data):
+                direction, time, length = _HEADER.unpack_from(data, offset)
+                offset += _HEADER.size
+                if offset + length > len(data):
+                    return
+                yield CaptureRecord(
+                    Direction(direction), time, data[offset : offset + length]
+                )
+                offset += length
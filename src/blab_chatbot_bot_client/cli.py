@@ -3,22 +3,58 @@
 from __future__ import annotations
 
 import argparse
-from datetime import datetime
+import os
+import sys
 from importlib import util as import_util
 from pathlib import Path
-from typing import Any
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, cast
 
 from blab_chatbot_bot_client import make_path_absolute
-from blab_chatbot_bot_client.conversation import BotClientConversation
-from blab_chatbot_bot_client.conversation_websocket import (
-    WebSocketBotClientConversation,
+from blab_chatbot_bot_client.settings_format import (
+    BlabBotClientSettings,
+    BlabWebSocketBotClientSettings,
+    BlabWebSocketConnectionSettings,
 )
-from blab_chatbot_bot_client.data_structures import (
-    Message,
-    MessageType,
-    OutgoingMessage,
-)
-from blab_chatbot_bot_client.settings_format import BlabBotClientSettings
+
+# the modules needed by each command are only imported when it runs
+if TYPE_CHECKING:
+    from blab_chatbot_bot_client.conversation import BotClientConversation
+    from blab_chatbot_bot_client.conversation_websocket import (
+        WebSocketBotClientConversation,
+    )
+    from blab_chatbot_bot_client.conversation_websocket_async import (
+        AsyncWebSocketBotClientConversation,
+    )
+    from blab_chatbot_bot_client.data_structures import (
+        CompactMessage,
+        Message,
+        OutgoingMessage,
+    )
+
+
+def _replay_speed(value: str) -> float:
+    """Parse the speed factor of a replay.
+
+    Args:
+        value: a positive number, or ``max``
+
+    Returns:
+        the speed factor (0 for ``max``)
+
+    Raises:
+        ArgumentTypeError: if the value is invalid
+    """
+    if value == "max":
+        return 0
+    try:
+        speed = float(value)
+    except ValueError:
+        speed = 0
+    if not 0 < speed < float("inf"):
+        message = f"invalid speed: {value!r} (expected a positive number or max)"
+        raise argparse.ArgumentTypeError(message)
+    return speed
 
 
 def _is_interactive() -> bool:
@@ -49,8 +85,102 @@ class BlabBotClientArgParser:
         self.arg_parser = argparse.ArgumentParser()
         self.arg_parser.add_argument("--config", default="settings.py")
         self.subparsers = self.arg_parser.add_subparsers(help="command", dest="command")
-        self.subparsers.add_parser("startserver", help="start server")
-        self.subparsers.add_parser("answer", help="answer questions typed on terminal")
+        startserver_parser = self.subparsers.add_parser(
+            "startserver", help="start server"
+        )
+        startserver_parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="number of worker processes sharing the server socket",
+        )
+        answer_parser = self.subparsers.add_parser(
+            "answer", help="answer questions typed on terminal"
+        )
+        answer_parser.add_argument(
+            "--batch",
+            metavar="INPUT",
+            help="answer the conversations in a JSON Lines file (- for stdin)",
+        )
+        answer_parser.add_argument(
+            "--out",
+            default="-",
+            help="file where the answers to --batch are written (- for stdout)",
+        )
+        answer_parser.add_argument(
+            "--jobs",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="number of processes that answer the conversations in --batch",
+        )
+        loadtest_parser = self.subparsers.add_parser(
+            "loadtest", help="measure performance with a local fake controller"
+        )
+        self._add_load_test_arguments(loadtest_parser)
+        profile_parser = self.subparsers.add_parser(
+            "profile", help="profile the conversations in the terminal or a load test"
+        )
+        profile_parser.add_argument(
+            "target", choices=["answer", "loadtest"], help="what should be profiled"
+        )
+        profile_parser.add_argument(
+            "--profiler",
+            choices=["sampling", "cprofile"],
+            default="sampling",
+            help="write collapsed stacks (sampling) or pstats files (cprofile)",
+        )
+        profile_parser.add_argument(
+            "--output",
+            default="profiles",
+            help="directory where the profile of each conversation is written",
+        )
+        self._add_load_test_arguments(profile_parser)
+        replay_parser = self.subparsers.add_parser(
+            "replay", help="replay captured conversations against the bot"
+        )
+        replay_parser.add_argument(
+            "captures", nargs="+", help="capture files or directories with captures"
+        )
+        replay_parser.add_argument(
+            "--speed",
+            type=_replay_speed,
+            default="1",
+            help="speed factor (e.g. 1 or 10), or max to send frames without waiting",
+        )
+
+    @classmethod
+    def _add_load_test_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--users", type=int, default=10, help="number of simultaneous users"
+        )
+        parser.add_argument(
+            "--conversations",
+            type=int,
+            default=100,
+            help="total number of conversations",
+        )
+        parser.add_argument(
+            "--turns", type=int, default=5, help="messages sent by each user"
+        )
+        parser.add_argument(
+            "--think-time",
+            type=float,
+            default=1,
+            help="average time (in seconds) between an answer and the next message",
+        )
+        parser.add_argument(
+            "--answers-per-turn",
+            type=int,
+            default=0,
+            help="number of answers the bot sends to each message (0 if variable)",
+        )
+        parser.add_argument(
+            "--answer-idle-time",
+            type=float,
+            default=0.2,
+            help="time (in seconds) without answers after which a turn ends "
+            "(if the number of answers is variable)",
+        )
 
     @classmethod
     def _load_config(cls, path: str) -> BlabBotClientSettings:
@@ -96,16 +226,146 @@ class BlabBotClientArgParser:
             arguments: the parsed command-line arguments
             settings: the loaded configuration
         """
-        if arguments.command == "startserver":
-            if issubclass(self._client, WebSocketBotClientConversation):
-                self._client.start_http_server(settings)
+        websocket_commands = {
+            "startserver": self._start_server,
+            "loadtest": self._run_load_test,
+            "replay": self._replay,
+        }
+        if arguments.command in websocket_commands:
+            from blab_chatbot_bot_client.conversation_websocket import (
+                WebSocketBotClientConversation,
+            )
+            from blab_chatbot_bot_client.conversation_websocket_async import (
+                AsyncWebSocketBotClientConversation,
+            )
+
+            if issubclass(
+                self._client,
+                WebSocketBotClientConversation | AsyncWebSocketBotClientConversation,
+            ):
+                websocket_commands[arguments.command](settings, arguments)
         elif arguments.command == "answer":
-            if issubclass(self._client, BotClientConversation):
-                self._start_console_chat(settings)
+            if getattr(arguments, "batch", None):
+                self._answer_batch(arguments)
+            else:
+                from blab_chatbot_bot_client.conversation import BotClientConversation
+
+                if issubclass(self._client, BotClientConversation):
+                    self._start_console_chat(settings)
+        elif arguments.command == "profile":
+            self._profile(settings, arguments)
         else:
             return False
         return True
 
+    def _start_server(
+        self, settings: BlabBotClientSettings, arguments: argparse.Namespace
+    ) -> None:
+        if arguments.workers > 1:
+            self._start_prefork_server(settings, arguments.workers)
+        else:
+            cast(
+                "type[WebSocketBotClientConversation[Any]]"
+                " | type[AsyncWebSocketBotClientConversation[Any]]",
+                self._client,
+            ).start_http_server(settings)
+
+    def _start_prefork_server(
+        self, settings: BlabBotClientSettings, workers: int
+    ) -> None:
+        from blab_chatbot_bot_client.prefork import PreforkSupervisor
+
+        client = cast(
+            "type[WebSocketBotClientConversation[Any]]"
+            " | type[AsyncWebSocketBotClientConversation[Any]]",
+            self._client,
+        )
+        connection_settings = cast(
+            BlabWebSocketConnectionSettings, settings.BLAB_CONNECTION_SETTINGS
+        )
+        # the workers inherit the resources loaded by the warm-up
+        client.ensure_warmed_up(settings)
+        PreforkSupervisor(
+            lambda sock: client.start_http_server(settings, sock),
+            connection_settings["BOT_HTTP_SERVER_HOSTNAME"],
+            connection_settings["BOT_HTTP_SERVER_PORT"],
+            workers,
+        ).run()
+
+    def _run_load_test(
+        self, settings: BlabBotClientSettings, arguments: argparse.Namespace
+    ) -> None:
+        from blab_chatbot_bot_client.loadtest import run_load_test
+
+        result = run_load_test(
+            cast(
+                "type[WebSocketBotClientConversation[Any]]"
+                " | type[AsyncWebSocketBotClientConversation[Any]]",
+                self._client,
+            ),
+            cast(BlabWebSocketBotClientSettings, settings),
+            arguments.users,
+            arguments.conversations,
+            arguments.turns,
+            arguments.think_time,
+            arguments.answers_per_turn,
+            arguments.answer_idle_time,
+        )
+        print(result.report())
+
+    def _replay(
+        self, settings: BlabBotClientSettings, arguments: argparse.Namespace
+    ) -> None:
+        from blab_chatbot_bot_client.replay import run_replay
+
+        captures = []
+        for name in arguments.captures:
+            path = Path(name)
+            captures += sorted(path.glob("*.cap")) if path.is_dir() else [path]
+        result = run_replay(
+            cast(
+                "type[WebSocketBotClientConversation[Any]]"
+                " | type[AsyncWebSocketBotClientConversation[Any]]",
+                self._client,
+            ),
+            cast(BlabWebSocketBotClientSettings, settings),
+            captures,
+            arguments.speed,
+        )
+        print(result.report())
+
+    def _answer_batch(self, arguments: argparse.Namespace) -> None:
+        from blab_chatbot_bot_client.batch_answer import answer_batch_files
+
+        result = answer_batch_files(
+            self._client,
+            arguments.config,
+            arguments.batch,
+            arguments.out,
+            arguments.jobs,
+        )
+        print(result.report(), file=sys.stderr)
+
+    def _profile(
+        self, settings: BlabBotClientSettings, arguments: argparse.Namespace
+    ) -> None:
+        from blab_chatbot_bot_client.profiling import wait_for_profiles
+
+        profiled_settings = SimpleNamespace(
+            **{k: getattr(settings, k) for k in dir(settings) if not k.startswith("_")}
+        )
+        profiled_settings.BLAB_CONNECTION_SETTINGS = {
+            **settings.BLAB_CONNECTION_SETTINGS,
+            "PROFILE_SAMPLE_RATE": 1,
+            "PROFILE_DIR": arguments.output,
+            "PROFILER": arguments.profiler,
+        }
+        arguments.command = arguments.target
+        self.run(arguments, cast(BlabBotClientSettings, profiled_settings))
+        if not wait_for_profiles(30):
+            print("Some profiles could not be written")
+        print(f"Profiles written to {make_path_absolute(arguments.output)}")
+
     def get_user_message(self, nth: int) -> str:
         """Read a message from the user.
 
@@ -124,19 +384,35 @@ class BlabBotClientArgParser:
         return input()
 
     def _start_console_chat(self, settings: BlabBotClientSettings) -> None:
+        import asyncio
+        from datetime import datetime
+
         from colorama import init as init_colorama
 
+        from blab_chatbot_bot_client.conversation import iterate_answers
+        from blab_chatbot_bot_client.data_structures import Message, MessageType
+
         init_colorama()
         interactive = _is_interactive()
+        loop = asyncio.new_event_loop()
+
+        async def _create_bot() -> BotClientConversation[Any]:
+            return self._client(settings, "conv0", "part0")  # dummy ids
 
-        bot = self._client(settings, "conv0", "part0")  # dummy ids
+        bot = loop.run_until_complete(_create_bot())
+        if bot._profiler:
+            bot._profiler.start()
+
+        # coroutine hooks (e.g. in AsyncWebSocketBotClientConversation)
+        # are run by iterate_answers, and profiled while the loop runs them
+        _next = bot._profiler.wrap(next) if bot._profiler else next
 
         n = 1
         you_display = "YOU"
         bot_display = "BOT"
         while True:
             if n == 1 and self._client.bot_sends_first_message():
-                bot_messages = bot.generate_greeting()
+                bot_messages = iterate_answers(bot.generate_greeting(), loop)
             else:
                 try:
                     if interactive:
@@ -157,12 +433,16 @@ class BlabBotClientArgParser:
                     id=f"m{n}",
                     local_id=f"user_m{n}",
                 )
-                bot_messages = bot.generate_answer(user_message)
+                bot_messages = iterate_answers(bot.generate_answer(user_message), loop)
             n += 1
-            for a in bot_messages or []:
+            # each answer is displayed as soon as it is generated
+            while (a := _next(bot_messages, None)) is not None:
                 self._display_prompt_on_terminal(bot_display)
                 self._display_message_on_terminal(a)
                 n += 1
+        loop.close()
+        if bot._profiler:
+            bot._profiler.save()
 
     def _display_prompt_on_terminal(self, sender_name: str) -> None:
         from colorama import Style
@@ -175,11 +455,17 @@ class BlabBotClientArgParser:
 
     def _display_message_on_terminal(
         self,
-        message: Message | OutgoingMessage | str,
+        message: Message | CompactMessage | OutgoingMessage | str,
     ) -> None:
         from colorama import Fore, Style
 
-        if isinstance(message, Message | OutgoingMessage):
+        from blab_chatbot_bot_client.data_structures import (
+            CompactMessage,
+            Message,
+            OutgoingMessage,
+        )
+
+        if isinstance(message, Message | CompactMessage | OutgoingMessage):
             text = message.text
             options = message.options or []
         else:
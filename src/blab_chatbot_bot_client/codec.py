@@ -0,0 +1,250 @@
+"""Contains classes that convert frames exchanged with BLAB Controller.
+
+The codec is chosen by the setting ``MESSAGE_CODEC``. The default codec uses
+the standard ``json`` module; faster codecs based on the optional packages
+``orjson`` and ``msgspec`` are also available. All of them produce the same
+results as ``Message.from_dict`` and ``OutgoingMessage.to_dict``.
+
+If the setting ``COMPACT_MESSAGES`` is enabled, incoming messages are
+decoded as instances of ``CompactMessage`` (which has the same attributes
+as ``Message``).
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, cast
+
+from blab_chatbot_bot_client.data_structures import (
+    CompactMessage,
+    Message,
+    OutgoingMessage,
+)
+
+# frames are JSON objects; inside strings, quotes are escaped,
+# so these patterns only match keys
+_STATE_PATTERN = re.compile(r'"state"\s*:')
+_STATE_BYTES_PATTERN = re.compile(rb'"state"\s*:')
+# strings and brackets of a JSON document (strings followed by a colon are keys)
+_TOKEN_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+_COLON_PATTERN = re.compile(r"\s*:")
+# nesting level of the keys of the message in a frame ({"message": {...}})
+_MESSAGE_DEPTH = 2
+
+
+def _find_message_local_id(data: str) -> str | None:
+    """Find the local id of the message in a frame without decoding it.
+
+    Only the ``local_id`` key of the top-level ``message`` object is
+    considered, so ids nested in other values (e.g. in the state or in the
+    metadata of the message) are ignored.
+
+    Args:
+        data: the raw frame
+
+    Returns:
+        the local id (``None`` if absent)
+    """
+    depth = 0
+    key = None
+    in_message = False
+    for token in _TOKEN_PATTERN.finditer(data):
+        text = token.group()
+        if text in ("{", "["):
+            depth += 1
+            in_message = in_message or (depth == _MESSAGE_DEPTH and key == '"message"')
+        elif text in ("}", "]"):
+            depth -= 1
+            if in_message and depth == 1:
+                return None
+        elif _COLON_PATTERN.match(data, token.end()):
+            key = text
+            continue
+        elif in_message and depth == _MESSAGE_DEPTH and key == '"local_id"':
+            return cast(str, json.loads(text))
+        key = None
+    return None
+
+
+class MessageCodec:
+    """Converts frames using the standard ``json`` module."""
+
+    def __init__(self, *, compact: bool = False):
+        """Create an instance.
+
+        Args:
+            compact: whether messages should be decoded as ``CompactMessage``
+        """
+        self._message_class: type[Message] | type[CompactMessage] = (
+            CompactMessage if compact else Message
+        )
+
+    def loads(self, data: str | bytes) -> Any:
+        """Parse a JSON document.
+
+        Args:
+            data: the JSON document
+
+        Returns:
+            the parsed value
+        """
+        return json.loads(data)
+
+    def dumps(self, value: Any) -> str | bytes:
+        """Serialize a value as JSON.
+
+        Args:
+            value: the value to be serialized
+
+        Returns:
+            the JSON document
+        """
+        return json.dumps(value)
+
+    def decode_frame(
+        self, data: str | bytes
+    ) -> tuple[Message | CompactMessage | None, dict[str, Any] | None]:
+        """Decode a frame received from the controller.
+
+        Args:
+            data: the raw frame
+
+        Returns:
+            the message (a ``CompactMessage`` if ``compact`` is enabled)
+            and the state contained in the frame (``None`` if absent)
+        """
+        contents = self.loads(data)
+        message = contents.get("message")
+        return (
+            self._message_class.from_dict(message) if message is not None else None,
+            contents.get("state"),
+        )
+
+    def find_local_id(self, data: str | bytes) -> str | None:
+        """Find the local id of the message in a frame without decoding it.
+
+        Ids nested in other values (e.g. in the state) are ignored.
+
+        Args:
+            data: the raw frame
+
+        Returns:
+            the local id (``None`` if absent)
+        """
+        if isinstance(data, bytes):
+            if b'"local_id"' not in data:
+                return None
+            data = data.decode("utf-8")
+        elif '"local_id"' not in data:
+            return None
+        return _find_message_local_id(data)
+
+    def decode_state(self, data: str | bytes) -> dict[str, Any] | None:
+        """Decode only the state contained in a frame.
+
+        Args:
+            data: the raw frame
+
+        Returns:
+            the state (``None`` if absent)
+        """
+        if isinstance(data, str):
+            if not _STATE_PATTERN.search(data):
+                return None
+        elif not _STATE_BYTES_PATTERN.search(data):
+            return None
+        return cast("dict[str, Any] | None", self.loads(data).get("state"))
+
+    def encode_message(self, message: OutgoingMessage) -> str | bytes:
+        """Encode a message to be sent to the controller.
+
+        Args:
+            message: the outgoing message
+
+        Returns:
+            the raw frame (text encoded as UTF-8 if it is ``bytes``)
+        """
+        return self.dumps(message.to_dict())
+
+
+class OrjsonMessageCodec(MessageCodec):
+    """Converts frames using the ``orjson`` package."""
+
+    def __init__(self, *, compact: bool = False):  # noqa: D107
+        import orjson
+
+        super().__init__(compact=compact)
+        self._orjson = orjson
+
+    def loads(self, data: str | bytes) -> Any:  # noqa: D102
+        return self._orjson.loads(data)
+
+    def dumps(self, value: Any) -> str | bytes:  # noqa: D102
+        return self._orjson.dumps(value)
+
+
+class MsgspecMessageCodec(MessageCodec):
+    """Converts frames using the ``msgspec`` package.
+
+    Incoming frames are decoded directly into ``Message`` instances. Frames that
+    do not match the expected schema (e.g. with values of unexpected types) are
+    decoded by ``Message.from_dict`` instead. Compact messages are always
+    decoded by ``CompactMessage.from_dict``, so that their time is parsed lazily.
+    """
+
+    def __init__(self, *, compact: bool = False):  # noqa: D107
+        import msgspec
+
+        super().__init__(compact=compact)
+        self._compact = compact
+
+        class Frame(msgspec.Struct):
+            message: Message | None = None
+            state: dict[str, Any] | None = None
+
+        self._frame_decoder = msgspec.json.Decoder(Frame)
+        self._decoder = msgspec.json.Decoder()
+        self._encoder = msgspec.json.Encoder()
+        self._errors = (msgspec.ValidationError, TypeError, ValueError)
+
+    def loads(self, data: str | bytes) -> Any:  # noqa: D102
+        return self._decoder.decode(data)
+
+    def dumps(self, value: Any) -> str | bytes:  # noqa: D102
+        return self._encoder.encode(value)
+
+    def decode_frame(  # noqa: D102
+        self, data: str | bytes
+    ) -> tuple[Message | CompactMessage | None, dict[str, Any] | None]:
+        if self._compact:
+            return super().decode_frame(data)
+        try:
+            frame = self._frame_decoder.decode(data)
+        except self._errors:
+            return super().decode_frame(data)
+        return frame.message, frame.state
+
+
+CODECS: dict[str, type[MessageCodec]] = {
+    "json": MessageCodec,
+    "orjson": OrjsonMessageCodec,
+    "msgspec": MsgspecMessageCodec,
+}
+"""Available codecs, indexed by their names in the settings"""
+
+
+def create_codec(name: str, *, compact: bool = False) -> MessageCodec:
+    """Create a codec.
+
+    Args:
+        name: name of the codec (one of the keys in ``CODECS``)
+        compact: whether messages should be decoded as ``CompactMessage``
+
+    Returns:
+        the codec
+    """
+    if name not in CODECS:
+        error = f"Unknown codec: {name}"
+        raise ValueError(error)
+    return CODECS[name](compact=compact)
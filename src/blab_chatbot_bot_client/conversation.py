@@ -6,18 +6,115 @@ The actual behaviour is implemented in subclasses
 
 from __future__ import annotations
 
-from queue import Queue
-from typing import TYPE_CHECKING, Any, Generic, TypeVar
+import json
+from collections import OrderedDict
+from collections.abc import Generator
+from inspect import isawaitable
+from logging import getLogger
+from threading import Lock
+from time import monotonic
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, ClassVar, Generic, TypeVar, cast
 from uuid import uuid4
 
 if TYPE_CHECKING:
-    from blab_chatbot_bot_client.data_structures import Message, OutgoingMessage
-
-from blab_chatbot_bot_client.settings_format import BlabBotClientSettings
+    import asyncio
+    from collections.abc import Callable, Iterable, Iterator
+
+    from blab_chatbot_bot_client.answer_cache import AnswerCache
+    from blab_chatbot_bot_client.attachments import AttachmentFetcher, Blob
+    from blab_chatbot_bot_client.batching import AnswerBatcher
+    from blab_chatbot_bot_client.data_structures import (
+        CompactMessage,
+        Message,
+        OutgoingMessage,
+    )
+    from blab_chatbot_bot_client.reconnection import UnacknowledgedMessages
+
+from blab_chatbot_bot_client import metrics
+from blab_chatbot_bot_client.cancellation import CancellationToken
+from blab_chatbot_bot_client.data_structures import MessageType
+from blab_chatbot_bot_client.history import ConversationHistory, HistorySpill
+from blab_chatbot_bot_client.outbox import Outbox, OutboxPolicy
+from blab_chatbot_bot_client.profiling import create_conversation_profiler
+from blab_chatbot_bot_client.settings_format import (
+    BlabBotClientSettings,
+    BlabConnectionSettings,
+)
+from blab_chatbot_bot_client.state import ConversationState
 
 SettingsType = TypeVar("SettingsType", bound=BlabBotClientSettings)
 
 
+def iterate_answers(
+    answers: Any, loop: asyncio.AbstractEventLoop
+) -> Iterator[OutgoingMessage]:
+    """Iterate over the value returned by ``generate_answer`` or ``generate_greeting``.
+
+    The value can be an iterable (such as a list or a generator),
+    an async iterable, or an awaitable that returns an iterable.
+    Each answer is obtained only when it is needed.
+
+    Args:
+        answers: the value returned by the method
+        loop: event loop (not running) used to await coroutines
+
+    Yields:
+        the answers
+    """
+    if isawaitable(answers):
+        answers = loop.run_until_complete(answers)
+    if hasattr(answers, "__anext__"):
+        while True:
+            try:
+                yield loop.run_until_complete(answers.__anext__())
+            except StopAsyncIteration:
+                return
+    else:
+        yield from answers or []
+
+
+_generate_answer_seconds = metrics.registry.histogram(
+    "generate_answer_seconds", "Time spent by generate_answer"
+)
+_first_message_seconds = metrics.registry.histogram(
+    "answer_first_message_seconds",
+    "Time from the start of the generation of answers until the first one is ready",
+)
+_send_latency = metrics.registry.histogram(
+    "send_latency_seconds", "Time from enqueue_message until the message is sent"
+)
+_delivery_latency = metrics.registry.histogram(
+    "delivery_latency_seconds",
+    "Time from enqueue_message until the message is delivered back to the bot",
+)
+_cancelled_generations = metrics.registry.counter(
+    "answer_generations_cancelled_total",
+    "Number of generations of answers stopped because a newer message arrived",
+)
+_warm_up_seconds = metrics.registry.gauge(
+    "warm_up_seconds", "Time spent by warm_up before the first conversation"
+)
+_dropped_generations = metrics.registry.counter(
+    "answer_generations_dropped_total",
+    "Number of messages not answered because a newer message arrived first",
+)
+
+MAX_PENDING_LOCAL_IDS = 1024
+"""Maximum number of sent messages per conversation awaiting delivery
+
+When the limit is reached, the oldest messages are forgotten
+(and ``on_delivered`` is not called for them).
+"""
+
+MAX_SUPERSEDED_MESSAGE_IDS = 1024
+"""Maximum number of superseded messages remembered per conversation
+
+When the limit is reached, the oldest messages are forgotten (and they
+can be answered, if ``enqueue_answer`` is called for them).
+"""
+
+
 # noinspection PyMethodMayBeStatic
 class BotClientConversation(Generic[SettingsType]):
     """Represents a conversation on the client."""
@@ -35,53 +132,523 @@ class BotClientConversation(Generic[SettingsType]):
             conversation_id: id of the conversation
             bot_participant_id: id of the participant correspondent to the bot
         """
+        type(self).ensure_warmed_up(settings)
         self.settings = settings
         self.conversation_id = conversation_id
         self.bot_participant_id = bot_participant_id
-        self._outgoing_message_queue: Queue[OutgoingMessage] = Queue()
-        self.state: dict[str, Any] = {}
+        connection_settings = cast(
+            BlabConnectionSettings, settings.BLAB_CONNECTION_SETTINGS
+        )
+        self._metrics_enabled = connection_settings.get("METRICS_ENABLED", False)
+        self._outgoing_message_queue: Outbox[OutgoingMessage] = Outbox(
+            connection_settings.get("OUTBOX_HIGH_WATERMARK", 0),
+            connection_settings.get("OUTBOX_LOW_WATERMARK"),
+            OutboxPolicy(connection_settings.get("OUTBOX_FULL_POLICY", "block")),
+            _send_latency if self._metrics_enabled else None,
+        )
+        self.state = ConversationState()
+        """State of the conversation received from the controller"""
+        self._pending_local_ids: OrderedDict[str, float] = OrderedDict()
+        self._pending_local_ids_lock = Lock()
+        self._unacknowledged: UnacknowledgedMessages | None = None
+        self._cancel_superseded = connection_settings.get("CANCEL_SUPERSEDED", False)
+        self._answer_debounce = (
+            connection_settings.get("ANSWER_DEBOUNCE", 0)
+            if self._cancel_superseded
+            else 0
+        )
+        self._latest_message_id: str | None = None
+        self._superseded_message_ids: OrderedDict[str, None] = OrderedDict()
+        self._latest_token = CancellationToken()
+        self._latest_token_lock = Lock()
+        self.history: ConversationHistory | None = None
+        """Recent messages of the conversation (see ``HISTORY_MAX_MESSAGES``)"""
+        max_messages = connection_settings.get("HISTORY_MAX_MESSAGES", 0)
+        max_characters = connection_settings.get("HISTORY_MAX_CHARACTERS", 0)
+        if max_messages or max_characters:
+            self.history = ConversationHistory(
+                max_messages,
+                max_characters,
+                self._get_history_spill(),
+                conversation_id,
+            )
+        if self._metrics_enabled:
+            self.generate_answer = metrics.timed(  # type: ignore[method-assign]
+                _generate_answer_seconds, self.generate_answer
+            )
+        if connection_settings.get("ANSWER_CACHE_SIZE", 0) > 0:
+            cache = self._get_answer_cache()
+            self.generate_answer = cache.wrap(  # type: ignore[method-assign]
+                self, self.generate_answer
+            )
+        self._profiler = create_conversation_profiler(settings, conversation_id)
+        if self._profiler:
+            for name in (
+                "on_connect",
+                "on_disconnect",
+                "on_receive_message",
+                "on_receive_state",
+                "on_delivered",
+                "generate_answer",
+                "generate_greeting",
+            ):
+                setattr(self, name, self._profiler.wrap(getattr(self, name)))
+
+    _shared_resources: ClassVar[Any] = None
+    _warmed_up: ClassVar[bool] = False
+    _warm_up_lock: ClassVar[Lock] = Lock()
+
+    @classmethod
+    def warm_up(cls, settings: BlabBotClientSettings) -> Any:  # noqa: ARG003
+        """Load the resources shared by all the conversations of this class.
+
+        It is called once per process, before the first conversation is
+        created (with ``startserver --workers``, before the worker processes
+        are created, so that they share the loaded resources). Subclasses
+        should override it to load models, indexes, etc., instead of
+        loading them in each conversation or in module globals.
+
+        This method returns ``None``.
+
+        Args:
+            settings: bot settings
+
+        Returns:
+            the resources, which conversations obtain from ``self.resources``
+            (a dict is made read-only)
+        """
+        return None
+
+    @classmethod
+    def ensure_warmed_up(cls, settings: BlabBotClientSettings) -> None:
+        """Call ``warm_up`` if it has not been called yet for this class.
+
+        Other threads that call this method wait until the warm-up finishes.
+
+        Args:
+            settings: bot settings
+        """
+        with cls._warm_up_lock:
+            if cls.__dict__.get("_warmed_up"):
+                return
+            started = monotonic()
+            resources = cls.warm_up(settings)
+            if isinstance(resources, dict):
+                resources = MappingProxyType(resources)
+            cls._shared_resources = resources
+            cls._warmed_up = True
+        elapsed = monotonic() - started
+        _warm_up_seconds.set(elapsed)
+        getLogger(__name__).info("%s warmed up in %.2f s", cls.__name__, elapsed)
+
+    @property
+    def resources(self) -> Any:
+        """Read-only resources shared by the conversations (see ``warm_up``)."""
+        return self._shared_resources
+
+    _answer_batcher: ClassVar[AnswerBatcher | None] = None
+    _answer_batcher_lock: ClassVar[Lock] = Lock()
+    _answer_cache: ClassVar[AnswerCache | None] = None
+    _answer_cache_lock: ClassVar[Lock] = Lock()
+
+    def _get_answer_cache(self) -> AnswerCache:
+        """Obtain the answer cache shared by the conversations of this class.
+
+        Returns
+            the answer cache, created when it is first needed
+        """
+        from blab_chatbot_bot_client.answer_cache import AnswerCache
+
+        cls = type(self)
+        with cls._answer_cache_lock:
+            if cls._answer_cache is None:
+                connection_settings = cast(
+                    BlabConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+                )
+                cls._answer_cache = AnswerCache(
+                    connection_settings["ANSWER_CACHE_SIZE"],
+                    connection_settings.get("ANSWER_CACHE_TTL", 0),
+                    connection_settings.get("ANSWER_CACHE_PATH"),
+                    connection_settings.get("ANSWER_CACHE_DISK_SIZE", 0),
+                )
+            return cls._answer_cache
+
+    _history_spill: ClassVar[HistorySpill | None] = None
+    _history_spill_lock: ClassVar[Lock] = Lock()
+
+    def _get_history_spill(self) -> HistorySpill | None:
+        """Obtain the history spill shared by the conversations of this class.
+
+        Returns
+            the spill, created when it is first needed,
+            or ``None`` if ``HISTORY_SPILL_PATH`` is not defined
+        """
+        connection_settings = cast(
+            BlabConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+        )
+        path = connection_settings.get("HISTORY_SPILL_PATH")
+        if not path:
+            return None
+        cls = type(self)
+        with cls._history_spill_lock:
+            if cls._history_spill is None:
+                cls._history_spill = HistorySpill(path)
+            return cls._history_spill
+
+    _attachment_fetcher: ClassVar[AttachmentFetcher | None] = None
+    _attachment_fetcher_lock: ClassVar[Lock] = Lock()
+
+    def _get_attachment_fetcher(self) -> AttachmentFetcher:
+        """Obtain the attachment fetcher shared by the conversations of this class.
+
+        Returns
+            the fetcher, created when it is first needed
+        """
+        from blab_chatbot_bot_client.attachments import AttachmentFetcher
+
+        cls = type(self)
+        with cls._attachment_fetcher_lock:
+            if cls._attachment_fetcher is None:
+                cls._attachment_fetcher = AttachmentFetcher.from_settings(
+                    cast(BlabConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS)
+                )
+            return cls._attachment_fetcher
+
+    def stream_attachment(
+        self, message: Message | CompactMessage, chunk_size: int = 64 * 1024
+    ) -> Iterator[bytes]:
+        """Read the file attached to a message in chunks.
+
+        Nothing is downloaded until the first chunk is requested, and the
+        file is never held in memory as a whole. If ``ATTACHMENT_CACHE_DIR``
+        is defined, the file is read from (or stored in) the cache.
+
+        Args:
+            message: the message with the file
+            chunk_size: maximum size of each chunk (in bytes)
+
+        Raises:
+            ValueError: if the message has no file
+
+        Returns:
+            an iterator over the chunks, which raises ``AttachmentError``
+            if the file cannot be downloaded
+        """
+        from blab_chatbot_bot_client.attachments import attachment_url
+
+        url = attachment_url(message)
+        if not url:
+            error = "the message has no attached file"
+            raise ValueError(error)
+        return self._get_attachment_fetcher().stream(url, chunk_size)
+
+    def fetch_attachment(self, message: Message | CompactMessage) -> Blob:
+        """Obtain the file attached to a message from the cache.
+
+        The file is downloaded if it is not cached. Its contents can then be
+        read in chunks or mapped into memory (``Blob.mmap``). The setting
+        ``ATTACHMENT_CACHE_DIR`` must be defined.
+
+        Args:
+            message: the message with the file
+
+        Raises:
+            ValueError: if the message has no file or if there is no cache
+            AttachmentError: if the file cannot be downloaded
+
+        Returns:
+            the cached file
+        """
+        from blab_chatbot_bot_client.attachments import attachment_url
+
+        url = attachment_url(message)
+        if not url:
+            error = "the message has no attached file"
+            raise ValueError(error)
+        return self._get_attachment_fetcher().fetch(url)
+
+    def answer_cache_key(self, message: Message | CompactMessage) -> str | None:
+        """Compute the key under which the answers to a message are cached.
+
+        It is only used if the setting ``ANSWER_CACHE_SIZE`` is positive.
+        By default, the key contains the text of the message (case-folded and
+        with normalized whitespace) and the values of the keys of the state
+        listed in ``ANSWER_CACHE_STATE_KEYS``. Subclasses may override this
+        method to define which messages are equivalent.
+
+        Args:
+            message: the message to be answered
+
+        Returns:
+            the key, or ``None`` if the answers to the message must not be cached
+            (by default, if it is not a text message)
+        """
+        if message.type != MessageType.TEXT or not message.text:
+            return None
+        key = " ".join(message.text.casefold().split())
+        connection_settings = cast(
+            BlabConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+        )
+        state_keys = connection_settings.get("ANSWER_CACHE_STATE_KEYS")
+        if state_keys:
+            state = self.state.snapshot()
+            state_values = [state.get(k) for k in state_keys]
+            key += "\0" + json.dumps(state_values, sort_keys=True, default=str)
+        return key
+
+    def enqueue_answer(self, message: Message | CompactMessage) -> None:
+        """Generate answers to a message and enqueue them.
+
+        If ``generate_answer`` is a generator, each answer is enqueued
+        (and sent) as soon as it is yielded.
+
+        If the setting ``CANCEL_SUPERSEDED`` is enabled, the message is not
+        answered if a newer message is sent by the user before (or during
+        ``ANSWER_DEBOUNCE`` seconds after) this method is called, and no more
+        answers are enqueued after the newer message arrives.
+
+        Args:
+            message: the message which should be answered
+        """
+        token = self.cancellation_token(message)
+        if self._answer_debounce and not token.cancelled:
+            self._debounce_answer(message, token)
+        else:
+            self._answer_unless_cancelled(message, token)
+
+    def _debounce_answer(
+        self, message: Message | CompactMessage, token: CancellationToken
+    ) -> None:
+        """Answer a message after ``ANSWER_DEBOUNCE`` seconds, unless it is superseded.
+
+        This implementation waits in the calling thread. Subclasses that run
+        handlers on a pool of threads schedule the answer instead.
+
+        Args:
+            message: the message which should be answered
+            token: the cancellation token of the message
+        """
+        token.wait(self._answer_debounce)
+        self._answer_unless_cancelled(message, token)
+
+    def _answer_unless_cancelled(
+        self, message: Message | CompactMessage, token: CancellationToken
+    ) -> None:
+        """Generate answers to a message and enqueue them, unless it is superseded.
+
+        Args:
+            message: the message which should be answered
+            token: the cancellation token of the message
+        """
+        if token.cancelled:
+            _dropped_generations.inc()
+            return
+        self._enqueue_generated(self.generate_answer, message, token=token)
+
+    def cancellation_token(
+        self, message: Message | CompactMessage
+    ) -> CancellationToken:
+        """Obtain the token that signals that a message no longer needs answers.
+
+        The token is cancelled when the user sends a newer message, if the
+        setting ``CANCEL_SUPERSEDED`` is enabled (otherwise, it is never
+        cancelled). Long computations in ``generate_answer`` may check it
+        to stop early. Messages not sent by the user are never superseded.
+
+        Args:
+            message: the message
+
+        Returns:
+            the token
+        """
+        token = CancellationToken()
+        with self._latest_token_lock:
+            if message.id == self._latest_message_id:
+                return self._latest_token
+            if message.id in self._superseded_message_ids:
+                token.cancel()
+        return token
+
+    def _supersede(self, message: Message | CompactMessage) -> None:
+        """Cancel the generation of answers to older messages, if enabled.
+
+        It is called as soon as a message arrives, before it is handled.
+
+        Args:
+            message: the incoming message
+        """
+        if not self._cancel_superseded or not message.sent_by_human:
+            return
+        with self._latest_token_lock:
+            self._latest_token.cancel()
+            if self._latest_message_id is not None:
+                self._superseded_message_ids[self._latest_message_id] = None
+                if len(self._superseded_message_ids) > MAX_SUPERSEDED_MESSAGE_IDS:
+                    self._superseded_message_ids.popitem(last=False)
+            self._latest_token = CancellationToken()
+            self._latest_message_id = message.id
+
+    def enqueue_greeting(self) -> None:
+        """Generate greetings to the user and enqueue them.
+
+        If ``generate_greeting`` is a generator, each greeting is enqueued
+        (and sent) as soon as it is yielded.
+        """
+        self._enqueue_generated(self.generate_greeting)
+
+    def _enqueue_generated(
+        self,
+        generate: Callable[..., Iterable[OutgoingMessage]],
+        *args: Any,
+        token: CancellationToken | None = None,
+    ) -> None:
+        """Enqueue the messages generated by a method as they are produced.
+
+        Args:
+            generate: the method that generates the messages
+            args: the arguments of the method
+            token: if it is cancelled, the remaining messages are discarded
+                (and the generator, if any, is closed)
+        """
+        started = monotonic()
+        first = True
+        messages = generate(*args)
+        for message in messages:
+            if token and token.cancelled:
+                _cancelled_generations.inc()
+                if isinstance(messages, Generator):
+                    messages.close()
+                return
+            if first and self._metrics_enabled:
+                _first_message_seconds.observe(monotonic() - started)
+            first = False
+            self.enqueue_message(message)
 
     def enqueue_message(self, message: OutgoingMessage) -> None:
         """Enqueue a message to be sent to the controller.
 
+        If the outbox is full (see the setting ``OUTBOX_HIGH_WATERMARK``),
+        this method blocks until there is room, drops the message or
+        raises ``OutboxFullError``, depending on ``OUTBOX_FULL_POLICY``.
+
         Args:
             message: the message to be sent
         """
+        self._track_outgoing_message(message)
         self._outgoing_message_queue.put(message)
 
+    def _track_outgoing_message(self, message: OutgoingMessage) -> None:
+        """Remember when a message was enqueued, until it is delivered.
+
+        The message is also recorded in the history, if it is enabled.
+
+        Args:
+            message: the enqueued message
+        """
+        with self._pending_local_ids_lock:
+            self._pending_local_ids[message.local_id] = monotonic()
+            if len(self._pending_local_ids) > MAX_PENDING_LOCAL_IDS:
+                self._pending_local_ids.popitem(last=False)
+        if self.history is not None:
+            self.history.add_outgoing_message(message, self.bot_participant_id)
+
+    def _record_incoming_message(self, message: Message | CompactMessage) -> None:
+        """Record a received message in the history, if it is enabled.
+
+        The bot's own messages are not recorded again.
+
+        Args:
+            message: the received message
+        """
+        if self.history is not None and (
+            message.sent_by_human or message.sender_id != self.bot_participant_id
+        ):
+            self.history.add_message(message)
+
+    def _pop_delivered(
+        self, local_id: str | None, received: float
+    ) -> tuple[str, float] | None:
+        """Recognize the delivery of a message sent by the bot.
+
+        Args:
+            local_id: the local id of a received message (if any)
+            received: when the message arrived (as returned by ``time.monotonic``)
+
+        Returns:
+            the local id and the time (in seconds) since the message was
+            enqueued, or ``None`` if it was not sent by this conversation
+        """
+        if local_id is None:
+            return None
+        if self._unacknowledged is not None:
+            self._unacknowledged.acknowledge(local_id)
+        with self._pending_local_ids_lock:
+            enqueued = self._pending_local_ids.pop(local_id, None)
+        if enqueued is None:
+            return None
+        latency = received - enqueued
+        if self._metrics_enabled:
+            _delivery_latency.observe(latency)
+        return local_id, latency
+
     def on_connect(self) -> None:
         """Handle the successful connection with the controller.
 
         This method does nothing. The behaviour is defined by subclasses.
         """
 
-    def on_receive_message(self, message: Message) -> None:
+    def on_disconnect(self) -> None:
+        """Handle the end of the connection with the controller.
+
+        This method does nothing. The behaviour is defined by subclasses.
+        """
+
+    def on_receive_message(self, message: Message | CompactMessage) -> None:
         """Handle the arrival of a new message.
 
         This method does nothing. The behaviour is defined by subclasses.
 
         Note that this method is also called when the bot's own messages
-        are delivered.
+        are delivered, unless the setting ``DELIVER_OWN_MESSAGES`` is ``False``.
+        If ``COMPACT_MESSAGES`` is enabled, the message is a ``CompactMessage``.
 
         Args:
             message: the incoming message
         """
 
+    def on_delivered(self, local_id: str, latency: float) -> None:
+        """Handle the delivery of a message sent by the bot.
+
+        It is called before ``on_receive_message`` receives the message
+        (if it does). This method does nothing. The behaviour is defined
+        by subclasses.
+
+        Args:
+            local_id: the local id of the message
+            latency: time (in seconds) from ``enqueue_message``
+                until the delivery
+        """
+
     def on_receive_state(self, event: dict[str, Any]) -> None:
         """Handle the arrival of a new event message describing the current state.
 
-        This method updates the internal cached state.
+        This method merges the event into ``self.state``, creating a new version
+        (and notifying its subscribers) if any value has changed.
 
         Args:
             event: the event data
         """
         self.state.update(event)
 
-    def generate_answer(self, message: Message) -> list[OutgoingMessage]:
+    def generate_answer(
+        self, message: Message | CompactMessage
+    ) -> Iterable[OutgoingMessage]:
         """Generate zero or more answers to a given message.
 
         This method returns an empty list.
-        Subclasses should implement the desired behaviour.
+        Subclasses should implement the desired behaviour. They may also
+        implement it as a generator, so that ``enqueue_answer`` sends each
+        answer as soon as it is yielded.
 
         Args:
             message: the message which should be answered
@@ -91,11 +658,85 @@ class BotClientConversation(Generic[SettingsType]):
         """
         return []
 
-    def generate_greeting(self) -> list[OutgoingMessage]:
+    @classmethod
+    def generate_answers_batch(
+        cls, items: list[tuple[BotClientConversation[Any], Message | CompactMessage]]
+    ) -> list[list[OutgoingMessage]]:
+        """Generate answers to messages sent in several conversations.
+
+        This method is called with the messages passed to
+        ``enqueue_batched_answer``. By default, it calls ``generate_answer``
+        for each message (if it fails, the error is logged and the message
+        is not answered). Subclasses whose models process batches more
+        efficiently than individual messages should override it.
+
+        Args:
+            items: a list of pairs (conversation, message)
+
+        Returns:
+            a list with the answers to each message, in the same order
+        """
+        answers: list[list[OutgoingMessage]] = []
+        for conversation, message in items:
+            try:
+                answers.append(list(conversation.generate_answer(message)))
+            except Exception:  # noqa: BLE001
+                getLogger(__name__).exception(
+                    "error while answering a message of conversation %s",
+                    conversation.conversation_id,
+                )
+                answers.append([])
+        return answers
+
+    def enqueue_batched_answer(self, message: Message | CompactMessage) -> None:
+        """Generate answers to a message in a batch and enqueue them.
+
+        The message is grouped with messages from other conversations and
+        answered by ``generate_answers_batch``. This method returns
+        immediately; the answers are enqueued when they are generated.
+
+        The maximum time a message waits for a batch and the maximum size
+        of a batch are defined by the settings ``ANSWER_BATCH_WINDOW``
+        and ``ANSWER_BATCH_MAX_SIZE``.
+
+        Args:
+            message: the message which should be answered
+        """
+        from blab_chatbot_bot_client.batching import AnswerBatcher
+
+        cls = type(self)
+        with cls._answer_batcher_lock:
+            if cls._answer_batcher is None:
+                connection_settings = cast(
+                    BlabConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+                )
+                cls._answer_batcher = AnswerBatcher(
+                    cls.generate_answers_batch,
+                    connection_settings.get("ANSWER_BATCH_WINDOW", 0.02),
+                    connection_settings.get("ANSWER_BATCH_MAX_SIZE", 32),
+                )
+        cls._answer_batcher.submit(self, message)
+
+    def _enqueue_batched_answers(self, answers: list[OutgoingMessage]) -> None:
+        """Enqueue the answers to a message that was answered in a batch.
+
+        It is called by the thread that generates the batches, which is shared
+        by all conversations, so subclasses override it to hand the answers
+        off to the threads (or the event loop) of the conversation.
+
+        Args:
+            answers: the answers to the message
+        """
+        for answer in answers:
+            self.enqueue_message(answer)
+
+    def generate_greeting(self) -> Iterable[OutgoingMessage]:
         """Generate zero or more greetings to the user.
 
         This method returns an empty list.
-        Subclasses should implement the desired behaviour.
+        Subclasses should implement the desired behaviour. They may also
+        implement it as a generator, so that ``enqueue_greeting`` sends each
+        greeting as soon as it is yielded.
 
         Returns
             a list with the greetings
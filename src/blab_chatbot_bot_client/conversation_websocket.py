@@ -5,21 +5,73 @@ Bots should implement subclasses of WebSocketBotClientConversation.
 
 from __future__ import annotations
 
-import json
+import os
+import threading
 from logging import getLogger
-from queue import Queue
-from threading import Thread
-from typing import Any, Generic, TypeVar, cast
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import TYPE_CHECKING, Any, ClassVar, Generic, TypeVar, cast
 
-from blab_chatbot_bot_client.conversation import BotClientConversation
-from blab_chatbot_bot_client.data_structures import Message, OutgoingMessage
+from blab_chatbot_bot_client import metrics
+from blab_chatbot_bot_client.admission import AdmissionController
+from blab_chatbot_bot_client.capture import CaptureWriter, Direction, capture_path
+from blab_chatbot_bot_client.codec import MessageCodec, create_codec
+from blab_chatbot_bot_client.conversation import (
+    MAX_PENDING_LOCAL_IDS,
+    BotClientConversation,
+)
+from blab_chatbot_bot_client.dispatcher import ConversationDispatcher
+from blab_chatbot_bot_client.reconnection import (
+    ReconnectionPolicy,
+    UnacknowledgedMessages,
+    is_refusal,
+)
 from blab_chatbot_bot_client.settings_format import (
     BlabWebSocketBotClientSettings,
     BlabWebSocketConnectionSettings,
 )
 
+if TYPE_CHECKING:
+    import socket
+    from collections.abc import Callable
+
+    from websocket import WebSocketApp
+
+    from blab_chatbot_bot_client.cancellation import CancellationToken
+    from blab_chatbot_bot_client.data_structures import (
+        CompactMessage,
+        Message,
+        OutgoingMessage,
+    )
+
 SettingsType = TypeVar("SettingsType", bound=BlabWebSocketBotClientSettings)
 
+_active_conversations = metrics.registry.gauge(
+    "active_conversations", "Number of conversations connected to the controller"
+)
+_threads = metrics.registry.gauge("threads", "Number of live threads")
+_outbox_depth = metrics.registry.gauge(
+    "outbox_pending_messages", "Number of messages waiting in the outboxes"
+)
+_history_bytes = metrics.registry.gauge(
+    "history_bytes", "Estimated memory used by the histories of the conversations"
+)
+_receive_latency = metrics.registry.histogram(
+    "receive_latency_seconds",
+    "Time from the arrival of a message until on_receive_message returns",
+)
+_reconnections = metrics.registry.counter(
+    "reconnections_total", "Number of conversations reconnected after a lost connection"
+)
+_resent_messages = metrics.registry.counter(
+    "resent_messages_total",
+    "Number of undelivered messages sent again after a reconnection",
+)
+_downtime = metrics.registry.histogram(
+    "reconnection_downtime_seconds",
+    "Time from the loss of the connection of a conversation until it reconnects",
+)
+
 
 class WebSocketBotClientConversation(
     BotClientConversation[SettingsType], Generic[SettingsType]
@@ -29,88 +81,541 @@ class WebSocketBotClientConversation(
     def __init__(self, *args: Any, **kwargs: Any):
         """Create an instance. Arguments are forwarded to the parent class."""
         super().__init__(*args, **kwargs)
-        self._outgoing_message_queue: Queue[OutgoingMessage] = Queue()
+        self._ws_app: WebSocketApp | None = None
+        self._last_activity = monotonic()
+        self._capture: CaptureWriter | None = None
+        connection_settings = cast(
+            BlabWebSocketConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+        )
+        self._deliver_own_messages = connection_settings.get(
+            "DELIVER_OWN_MESSAGES", True
+        )
+        self._reconnection = ReconnectionPolicy.from_settings(connection_settings)
+        if self._reconnection.attempts:
+            self._unacknowledged = UnacknowledgedMessages(MAX_PENDING_LOCAL_IDS)
+        self._sender: Thread | None = None
+        self._connected = Event()
+        self._closing = Event()
+        self._close_code: int | None = None
+        self._send_failed = False
+        self._rejected = False
+        self._disconnected_at: float | None = None
+
+    _instances: ClassVar[dict[str, WebSocketBotClientConversation[Any]]] = {}
+    _instances_lock: ClassVar[Lock] = Lock()
+    _reservations: ClassVar[set[str]] = set()
+    """Ids of the accepted conversations that have not been created yet"""
+    _dispatcher: ClassVar[ConversationDispatcher | None] = None
+    _admission: ClassVar[AdmissionController | None] = None
+    _codec: ClassVar[MessageCodec] = MessageCodec()
+
+    def close(self) -> None:
+        """Close the connection with the controller.
+
+        The conversation is terminated (without reconnecting),
+        and ``on_disconnect`` is called.
+        """
+        self._closing.set()
+        if self._ws_app:
+            self._ws_app.close()
+
+    def _submit(self, function: Callable[..., Any], *args: Any) -> None:
+        """Run a handler of this conversation using the dispatcher, if any.
+
+        Args:
+            function: the handler
+            args: the arguments of the handler
+        """
+        if self._dispatcher:
+            self._dispatcher.submit(self.conversation_id, function, *args)
+        else:
+            function(*args)
+
+    def _debounce_answer(
+        self, message: Message | CompactMessage, token: CancellationToken
+    ) -> None:
+        """Answer a message after ``ANSWER_DEBOUNCE`` seconds, unless it is superseded.
+
+        The answer is submitted to the dispatcher after the delay, so that
+        no worker is occupied while waiting.
+
+        Args:
+            message: the message which should be answered
+            token: the cancellation token of the message
+        """
+        if self._dispatcher:
+            self._dispatcher.submit_later(
+                self._answer_debounce,
+                self.conversation_id,
+                self._answer_unless_cancelled,
+                message,
+                token,
+            )
+        else:
+            super()._debounce_answer(message, token)
+
+    def _enqueue_batched_answers(self, answers: list[OutgoingMessage]) -> None:
+        """Enqueue the answers to a message that was answered in a batch.
+
+        They are enqueued by the dispatcher, so that a full outbox does not
+        block the batches of the other conversations.
 
-    _instances: dict[str, WebSocketBotClientConversation[SettingsType]] = {}
+        Args:
+            answers: the answers to the message
+        """
+        self._submit(super()._enqueue_batched_answers, answers)
+
+    def _on_open(self, ws_app: WebSocketApp) -> None:
+        """Handle the successful WebSocket connection.
+
+        ``on_connect`` is only called on the first connection. After a
+        reconnection, the undelivered messages are sent again.
+
+        Args:
+            ws_app: the WebSocket app
+        """
+        if self._capture:
+            self._capture.write(Direction.CONNECTED)
+        if self._sender:
+            self._resend_unacknowledged(ws_app)
+            self._connected.set()
+            return
+        self._connected.set()
+        self.on_connect()
+        self._sender = Thread(
+            target=self._process_outgoing_messages,
+            name=f"sender-{self.conversation_id}",
+        )
+        self._sender.start()
+
+    def _resend_unacknowledged(self, ws_app: WebSocketApp) -> None:
+        """Send again the messages that were not delivered before reconnecting.
+
+        Args:
+            ws_app: the WebSocket app
+        """
+        _reconnections.inc()
+        if self._metrics_enabled and self._disconnected_at is not None:
+            _downtime.observe(monotonic() - self._disconnected_at)
+        if self._unacknowledged is None:
+            return
+        for message in self._unacknowledged.messages():
+            frame = self._codec.encode_message(message)
+            ws_app.send(frame)
+            if self._capture:
+                self._capture.write(Direction.OUTGOING, frame)
+            _resent_messages.inc()
+
+    def _process_outgoing_messages(self) -> None:
+        """Send the enqueued messages until the conversation is finished.
+
+        If sending stops because of an unexpected error, the outbox is
+        closed (so that ``enqueue_message`` does not block) and the
+        conversation is closed.
+        """
+        try:
+            self._send_outgoing_messages()
+        except Exception:  # noqa: BLE001
+            getLogger(__name__).exception(
+                "error while sending the messages of conversation %s",
+                self.conversation_id,
+            )
+            self._outgoing_message_queue.close()
+            self.close()
+
+    def _send_outgoing_messages(self) -> None:
+        """Send the enqueued messages until the outbox is closed.
+
+        All the messages waiting in the outbox are serialized at once
+        (messages that cannot be serialized are logged and skipped).
+        While the conversation is reconnecting, they wait for the new connection.
+        """
+        from websocket import WebSocketException
+
+        outbox = self._outgoing_message_queue
+        while (messages := outbox.get_all()) is not None:
+            for frame in self._encode_messages(messages):
+                self._connected.wait()
+                if outbox.closed:
+                    return  # the conversation has finished
+                ws_app = cast("WebSocketApp", self._ws_app)
+                try:
+                    ws_app.send(frame)
+                except (WebSocketException, OSError) as e:
+                    # the connection is lost (the frame is sent again after
+                    # reconnecting, if the unacknowledged messages are kept)
+                    getLogger(__name__).info(
+                        "could not send a message of conversation %s: %r",
+                        self.conversation_id,
+                        e,
+                    )
+                    self._send_failed = True
+                    ws_app.close()
+                    if self._unacknowledged is None:
+                        outbox.close()
+                        return
+                else:
+                    if self._capture:
+                        self._capture.write(Direction.OUTGOING, frame)
+                outbox.mark_sent()
+            self._last_activity = monotonic()
+
+    def _encode_messages(self, messages: list[OutgoingMessage]) -> list[str | bytes]:
+        """Serialize messages taken from the outbox.
+
+        Messages that cannot be serialized are logged and skipped. The others
+        are kept until they are delivered, if reconnection is enabled.
+
+        Args:
+            messages: the messages
+
+        Returns:
+            the frames
+        """
+        frames = []
+        for message in messages:
+            try:
+                frames.append(self._codec.encode_message(message))
+            except Exception:  # noqa: BLE001
+                getLogger(__name__).exception(
+                    "could not encode a message of conversation %s",
+                    self.conversation_id,
+                )
+                self._outgoing_message_queue.mark_sent()
+                continue
+            if self._unacknowledged is not None:
+                self._unacknowledged.add(message)
+        return frames
+
+    def _on_message(self, _ws_app: WebSocketApp, m: str) -> None:
+        """Handle a new incoming message.
+
+        The handlers are executed by the dispatcher, in the order
+        the messages arrive.
+
+        Args:
+            ws_app: the WebSocket app
+            m: the raw message data
+        """
+        received = self._last_activity = monotonic()
+        if self._capture:
+            self._capture.write(Direction.INCOMING, m)
+        # the bot's own messages are recognized before they are decoded
+        delivered = self._pop_delivered(
+            self._codec.find_local_id(m) if self._pending_local_ids else None, received
+        )
+        if delivered:
+            self._submit(self.on_delivered, *delivered)
+            if not self._deliver_own_messages:
+                state = self._codec.decode_state(m)
+                if state is not None:
+                    self._submit(self.on_receive_state, state)
+                return
+        message, state = self._codec.decode_frame(m)
+        if message is not None:
+            # before the handler runs, since it may wait for older handlers
+            self._supersede(message)
+            self._submit(self._handle_message, message, received)
+        if state is not None:
+            self._submit(self.on_receive_state, state)
+
+    def _handle_message(
+        self, message: Message | CompactMessage, received: float
+    ) -> None:
+        """Call ``on_receive_message``, recording its latency.
+
+        Args:
+            message: the incoming message
+            received: when the frame that contains the message arrived
+                (as returned by ``time.monotonic``)
+        """
+        self._record_incoming_message(message)
+        self.on_receive_message(message)
+        latency = monotonic() - received
+        if self._metrics_enabled:
+            _receive_latency.observe(latency)
+        if self._admission:
+            self._admission.record_latency(latency)
+
+    def _on_error(self, _ws_app: WebSocketApp, error: Exception) -> None:
+        """Handle a WebSocket error.
+
+        Args:
+            ws_app: the WebSocket app
+            error: the exception
+        """
+        from websocket import (
+            WebSocketBadStatusException,
+            WebSocketConnectionClosedException,
+        )
+
+        if isinstance(error, WebSocketConnectionClosedException):
+            return  # handled by on_disconnect
+        if isinstance(error, WebSocketBadStatusException) and is_refusal(
+            error.status_code
+        ):
+            # the controller refused the connection, so it is not retried
+            self._rejected = True
+        getLogger(__name__).warning(
+            "error in conversation %s: %r", self.conversation_id, error
+        )
+
+    def _on_close(
+        self, _ws_app: WebSocketApp, code: int | None, _reason: str | None
+    ) -> None:
+        """Handle the end of a WebSocket connection.
+
+        Args:
+            ws_app: the WebSocket app
+            code: the code of the close frame, or ``None`` if there was none
+            reason: the reason in the close frame
+        """
+        # if sending failed, the connection was closed by the bot itself,
+        # but it is handled as if it had been lost
+        self._close_code = None if self._send_failed else code
+
+    def _connect(self, url: str, session: str) -> bool:
+        """Connect to the controller and process messages until disconnection.
+
+        Args:
+            url: WebSocket URL of the conversation
+            session: session id sent by the controller
+
+        Returns:
+            whether the connection was established
+        """
+        from websocket import WebSocketApp
+
+        connection_settings = cast(
+            BlabWebSocketConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+        )
+        self._ws_app = WebSocketApp(
+            url,
+            cookie="sessionid=" + session,
+            on_open=self._on_open,
+            on_message=self._on_message,
+            on_error=self._on_error,
+            on_close=self._on_close,
+        )
+        self._close_code = None
+        self._send_failed = False
+        ping_interval = connection_settings.get("PING_INTERVAL", 30)
+        ping_timeout = connection_settings.get("PING_TIMEOUT", 10)
+        try:
+            self._ws_app.run_forever(
+                ping_interval=ping_interval,
+                ping_timeout=(ping_timeout or None) if ping_interval else None,
+            )
+        finally:
+            connected = self._connected.is_set()
+            self._connected.clear()
+        return connected
+
+    def _wait_to_reconnect(self, failed_attempts: int) -> bool:
+        """Wait before reconnecting, if the conversation should reconnect.
+
+        Args:
+            failed_attempts: number of consecutive attempts that have failed
+
+        Returns:
+            whether the conversation should reconnect now
+        """
+        if (
+            self._closing.is_set()
+            or self._rejected
+            or not self._reconnection.should_reconnect(
+                self._close_code, failed_attempts
+            )
+        ):
+            return False
+        delay = self._reconnection.delay(failed_attempts)
+        getLogger(__name__).info(
+            "reconnecting conversation %s in %.2f s", self.conversation_id, delay
+        )
+        return not self._closing.wait(delay)
+
+    def _run(self, url: str, session: str) -> None:
+        """Process messages until disconnection, reconnecting if enabled.
+
+        Args:
+            url: WebSocket URL of the conversation
+            session: session id sent by the controller
+        """
+        capture_dir = cast(
+            BlabWebSocketConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+        ).get("CAPTURE_DIR")
+        if capture_dir:
+            self._capture = CaptureWriter(
+                capture_path(capture_dir, self.conversation_id)
+            )
+        failed_attempts = 0
+        _active_conversations.inc()
+        if self._profiler:
+            self._profiler.start()
+        try:
+            while True:
+                if self._connect(url, session):
+                    self._disconnected_at = monotonic()
+                    failed_attempts = 0
+                if not self._wait_to_reconnect(failed_attempts):
+                    break
+                failed_attempts += 1
+        finally:
+            _active_conversations.dec()
+            with self._instances_lock:
+                if self._instances.get(self.conversation_id) is self:
+                    del self._instances[self.conversation_id]
+            self._outgoing_message_queue.close()  # stops the sender
+            self._connected.set()  # if the sender is waiting for a connection
+            if self._capture:
+                self._capture.close()
+            self._submit(self.on_disconnect)
+            if self.history is not None:
+                # the spilled messages of the conversation are no longer needed
+                self._submit(self.history.discard)
+            if self._profiler:
+                self._submit(self._profiler.save)
+
+    @classmethod
+    def _reserve(cls, conversation_id: str, max_conversations: int) -> bool:
+        """Reserve a slot for a conversation that will be created.
+
+        Args:
+            conversation_id: id of the conversation
+            max_conversations: maximum number of conversations (0 for no limit)
+
+        Returns:
+            whether there was a free slot (a conversation with the same id
+            that is active or reserved is not replaced)
+        """
+        with cls._instances_lock:
+            if (
+                conversation_id in cls._instances
+                or conversation_id in cls._reservations
+            ):
+                getLogger(__name__).warning(
+                    "conversation %s has already been started", conversation_id
+                )
+                return False
+            if max_conversations and cls._count() >= max_conversations:
+                return False
+            cls._reservations.add(conversation_id)
+            return True
+
+    @classmethod
+    def _count(cls) -> int:
+        """Count the active and the reserved conversations.
+
+        Returns
+            the number of conversations
+        """
+        return len(cls._instances) + len(cls._reservations)
 
-    # noinspection PyPackageRequirements
     @classmethod
-    def start_http_server(cls, settings: SettingsType) -> None:
+    def _close_idle_conversations(cls, idle_timeout: float, stop: Event) -> None:
+        """Periodically close conversations without recent activity.
+
+        Args:
+            idle_timeout: maximum time (in seconds) without incoming or
+                outgoing messages
+            stop: event that finishes this loop when it is set
+        """
+        while not stop.wait(min(idle_timeout / 2, 10)):
+            limit = monotonic() - idle_timeout
+            with cls._instances_lock:
+                idle = [c for c in cls._instances.values() if c._last_activity < limit]
+            for conversation in idle:
+                getLogger(__name__).info(
+                    "closing idle conversation %s", conversation.conversation_id
+                )
+                conversation.close()
+
+    @classmethod
+    def _collect_metrics(cls) -> None:
+        """Update the gauges that are only computed when metrics are read."""
+        _threads.set(threading.active_count())
+        with cls._instances_lock:
+            conversations = list(cls._instances.values())
+        _outbox_depth.set(sum(len(c._outgoing_message_queue) for c in conversations))
+        _history_bytes.set(
+            sum(c.history.nbytes for c in conversations if c.history is not None)
+        )
+
+    @classmethod
+    def start_http_server(
+        cls, settings: SettingsType, sock: socket.socket | None = None
+    ) -> None:
         """Start an HTTP server, called when there is a new conversation.
 
+        The server is chosen by the setting ``HTTP_SERVER``. It only accepts
+        conversations after ``warm_up`` finishes.
+
         Args:
             settings: the bot settings
+            sock: an existing listening socket to be used by the server
+                (by default, the address in the settings is used)
         """
-        from flask import Flask, request
-        from waitress import serve
-        from websocket import WebSocketApp
+        from blab_chatbot_bot_client.intake import serve_intake
 
-        app = Flask(__name__)
+        cls.ensure_warmed_up(settings)
         connection_settings = cast(
             BlabWebSocketConnectionSettings, settings.BLAB_CONNECTION_SETTINGS
         )
         ws_url = connection_settings["BLAB_CONTROLLER_WS_URL"]
+        cls._codec = create_codec(
+            connection_settings.get("MESSAGE_CODEC", "json"),
+            compact=connection_settings.get("COMPACT_MESSAGES", False),
+        )
+        max_conversations = connection_settings.get("MAX_CONVERSATIONS", 0)
+        dispatcher = cls._dispatcher = ConversationDispatcher(
+            connection_settings.get(
+                "HANDLER_WORKERS", min(32, (os.cpu_count() or 1) + 4)
+            ),
+            connection_settings.get("HANDLER_QUEUE_SIZE", 0),
+        )
+        admission = cls._admission = AdmissionController.from_settings(
+            connection_settings,
+            cls._count,
+            lambda: dispatcher.queue_depth,
+        )
+        if connection_settings.get("METRICS_ENABLED", False):
+            metrics.registry.add_collector(cls._collect_metrics)
 
-        @app.route("/", methods=["POST"])
-        def conversation_start() -> str:
-            """Handle the start of a new conversation."""
-            if not isinstance(request.json, dict):
-                return ""
-            conversation_id = request.json["conversation_id"]
-            bot_participant_id = request.json["bot_participant_id"]
-            conversation = cls(settings, conversation_id, bot_participant_id)
-
-            def on_open(
-                ws_app: WebSocketApp,
-                conv: WebSocketBotClientConversation[SettingsType] = conversation,
-            ) -> None:
-                """Handle the successful WebSocket connection.
-
-                Args:
-                    ws_app: the WebSocket app
-                    conv: instance of the conversation client
-                """
-                conv.on_connect()
-
-                def _process_outgoing_messages() -> None:
-                    while True:
-                        message = conv._outgoing_message_queue.get()
-                        ws_app.send(json.dumps(message.to_dict()))
-
-                Thread(target=_process_outgoing_messages).start()
-
-            def on_message(
-                _ws_app: WebSocketApp,
-                m: str,
-                conv: WebSocketBotClientConversation[SettingsType] = conversation,
-            ) -> None:
-                """Handle a new incoming message.
-
-                Args:
-                    ws_app: the WebSocket app
-                    m: the raw message data
-                    conv: instance of the conversation client
-                """
-                contents = json.loads(m)
-                if "message" in contents:
-                    message = Message.from_dict(contents["message"])
-                    conv.on_receive_message(message)
-                if "state" in contents:
-                    conv.on_receive_state(contents["state"])
-
-            ws = WebSocketApp(
-                ws_url + "/ws/chat/" + conversation_id + "/",
-                cookie="sessionid=" + request.json["session"],
-                on_open=on_open,
-                on_message=on_message,
-            )
-            Thread(target=ws.run_forever).start()
-            return ""
+        idle_timeout = connection_settings.get("IDLE_TIMEOUT", 0)
+        stop_idle_check = Event()
+        if idle_timeout:
+            Thread(
+                target=cls._close_idle_conversations,
+                args=(idle_timeout, stop_idle_check),
+                daemon=True,
+            ).start()
 
-        getLogger("waitress").setLevel("INFO")
+        def start_conversation(payload: dict[str, Any]) -> bool:
+            # the slot is reserved before the conversation is created,
+            # so that refused conversations are not constructed
+            conversation_id = payload["conversation_id"]
+            if not cls._reserve(conversation_id, max_conversations):
+                return False
+            try:
+                session = payload["session"]
+                conversation = cls(
+                    settings, conversation_id, payload["bot_participant_id"]
+                )
+            except BaseException:
+                with cls._instances_lock:
+                    cls._reservations.discard(conversation_id)
+                raise
+            with cls._instances_lock:
+                cls._reservations.discard(conversation_id)
+                cls._instances[conversation_id] = conversation
+            Thread(
+                target=conversation._run,
+                args=(ws_url + "/ws/chat/" + conversation_id + "/", session),
+                name=f"conversation-{conversation_id}",
+            ).start()
+            return True
 
-        serve(
-            app,
-            host=connection_settings["BOT_HTTP_SERVER_HOSTNAME"],
-            port=connection_settings["BOT_HTTP_SERVER_PORT"],
-        )
+        try:
+            serve_intake(start_conversation, admission, connection_settings, sock)
+        finally:
+            stop_idle_check.set()
@@ -0,0 +1,827 @@
+"""Contains a class that connects with BLAB Controller via WebSocket using asyncio.
+
+Bots whose handlers are coroutines should implement subclasses of
+AsyncWebSocketBotClientConversation. All the conversations handled by the
+server share a single event loop (instead of two threads per conversation).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import deque
+from contextlib import suppress
+from inspect import isawaitable
+from logging import getLogger
+from threading import Lock, Thread
+from time import monotonic
+from typing import TYPE_CHECKING, Any, ClassVar, Generic, TypeVar, cast
+
+from blab_chatbot_bot_client import metrics
+from blab_chatbot_bot_client.admission import AdmissionController
+from blab_chatbot_bot_client.capture import CaptureWriter, Direction, capture_path
+from blab_chatbot_bot_client.codec import MessageCodec, create_codec
+from blab_chatbot_bot_client.conversation import (
+    MAX_PENDING_LOCAL_IDS,
+    BotClientConversation,
+)
+from blab_chatbot_bot_client.outbox import OutboxFullError, OutboxPolicy
+from blab_chatbot_bot_client.reconnection import (
+    ReconnectionPolicy,
+    UnacknowledgedMessages,
+    is_refusal,
+)
+from blab_chatbot_bot_client.settings_format import (
+    BlabWebSocketBotClientSettings,
+    BlabWebSocketConnectionSettings,
+)
+
+if TYPE_CHECKING:
+    import socket
+    from collections.abc import Callable
+    from concurrent.futures import Future
+
+    from websockets.asyncio.client import ClientConnection
+
+    from blab_chatbot_bot_client.data_structures import (
+        CompactMessage,
+        Message,
+        OutgoingMessage,
+    )
+
+SettingsType = TypeVar("SettingsType", bound=BlabWebSocketBotClientSettings)
+
+_active_conversations = metrics.registry.gauge(
+    "active_conversations", "Number of conversations connected to the controller"
+)
+_dropped_messages = metrics.registry.counter(
+    "outbox_dropped_messages_total", "Number of messages dropped by full outboxes"
+)
+_threads = metrics.registry.gauge("threads", "Number of live threads")
+_outbox_depth = metrics.registry.gauge(
+    "outbox_pending_messages", "Number of messages waiting in the outboxes"
+)
+_history_bytes = metrics.registry.gauge(
+    "history_bytes", "Estimated memory used by the histories of the conversations"
+)
+_receive_latency = metrics.registry.histogram(
+    "receive_latency_seconds",
+    "Time from the arrival of a message until on_receive_message returns",
+)
+_cancelled_generations = metrics.registry.counter(
+    "answer_generations_cancelled_total",
+    "Number of generations of answers stopped because a newer message arrived",
+)
+_dropped_generations = metrics.registry.counter(
+    "answer_generations_dropped_total",
+    "Number of messages not answered because a newer message arrived first",
+)
+_first_message_seconds = metrics.registry.histogram(
+    "answer_first_message_seconds",
+    "Time from the start of the generation of answers until the first one is ready",
+)
+_send_latency = metrics.registry.histogram(
+    "send_latency_seconds", "Time from enqueue_message until the message is sent"
+)
+_reconnections = metrics.registry.counter(
+    "reconnections_total", "Number of conversations reconnected after a lost connection"
+)
+_resent_messages = metrics.registry.counter(
+    "resent_messages_total",
+    "Number of undelivered messages sent again after a reconnection",
+)
+_downtime = metrics.registry.histogram(
+    "reconnection_downtime_seconds",
+    "Time from the loss of the connection of a conversation until it reconnects",
+)
+
+
+# noinspection PyMethodMayBeStatic
+class AsyncWebSocketBotClientConversation(
+    BotClientConversation[SettingsType], Generic[SettingsType]
+):
+    """Represents a conversation on the client, using WebSocket and asyncio.
+
+    The hooks ``on_connect``, ``on_receive_message``, ``generate_answer`` and
+    ``enqueue_message`` are coroutines in this class. They are awaited on the
+    event loop shared by all conversations, so they must not block.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        """Create an instance. Arguments are forwarded to the parent class.
+
+        Instances should be created while the event loop is running.
+        The outbox is limited by ``OUTBOX_HIGH_WATERMARK`` (the low watermark
+        is not used by this class).
+        """
+        super().__init__(*args, **kwargs)
+        connection_settings = cast(
+            BlabWebSocketConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+        )
+        self._outbox_policy = OutboxPolicy(
+            connection_settings.get("OUTBOX_FULL_POLICY", "block")
+        )
+        self._async_outgoing_message_queue: asyncio.Queue[
+            OutgoingMessage
+        ] = asyncio.Queue(connection_settings.get("OUTBOX_HIGH_WATERMARK", 0))
+        self._enqueue_times: deque[float] = deque()
+        self._ws: ClientConnection | None = None
+        self._last_activity = monotonic()
+        self._capture: CaptureWriter | None = None
+        self._deliver_own_messages = connection_settings.get(
+            "DELIVER_OWN_MESSAGES", True
+        )
+        self._generation_task: asyncio.Task[None] | None = None
+        self._reconnection = ReconnectionPolicy.from_settings(connection_settings)
+        if self._reconnection.attempts:
+            self._unacknowledged = UnacknowledgedMessages(MAX_PENDING_LOCAL_IDS)
+        self._connected_before = False
+        self._closing = asyncio.Event()
+        self._disconnected_at: float | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    _instances: ClassVar[dict[str, AsyncWebSocketBotClientConversation[Any]]] = {}
+    _codec: ClassVar[MessageCodec] = MessageCodec()
+    _instances_lock: ClassVar[Lock] = Lock()
+    _reservations: ClassVar[set[str]] = set()
+    """Ids of the accepted conversations that have not been created yet"""
+    _admission: ClassVar[AdmissionController | None] = None
+
+    async def close(self) -> None:
+        """Close the connection with the controller.
+
+        The conversation is terminated (without reconnecting),
+        and ``on_disconnect`` is called.
+        """
+        self._closing.set()
+        if self._ws:
+            await self._ws.close()
+
+    async def enqueue_message(  # type: ignore[override]
+        self, message: OutgoingMessage
+    ) -> None:
+        """Enqueue a message to be sent to the controller.
+
+        If the outbox is full (see the setting ``OUTBOX_HIGH_WATERMARK``),
+        this method waits until there is room, drops the message or
+        raises ``OutboxFullError``, depending on ``OUTBOX_FULL_POLICY``.
+
+        Args:
+            message: the message to be sent
+        """
+        if self._outbox_policy == OutboxPolicy.BLOCK:
+            await self._async_outgoing_message_queue.put(message)
+        else:
+            try:
+                self._async_outgoing_message_queue.put_nowait(message)
+            except asyncio.QueueFull:
+                if self._outbox_policy == OutboxPolicy.RAISE:
+                    error = "The outbox is full"
+                    raise OutboxFullError(error) from None
+                _dropped_messages.inc()
+                return
+        self._track_outgoing_message(message)
+        if self._metrics_enabled:
+            self._enqueue_times.append(monotonic())
+
+    @classmethod
+    def generate_answers_batch(
+        cls, items: list[tuple[BotClientConversation[Any], Message | CompactMessage]]
+    ) -> list[list[OutgoingMessage]]:
+        """Generate answers to messages sent in several conversations.
+
+        By default, ``generate_answer`` is awaited for each message on the
+        event loop of its conversation (the messages are answered
+        concurrently). If it fails, the error is logged and the message is
+        not answered. Subclasses whose models process batches more
+        efficiently than individual messages should override it.
+
+        Args:
+            items: a list of pairs (conversation, message)
+
+        Returns:
+            a list with the answers to each message, in the same order
+        """
+        futures: list[Future[list[OutgoingMessage]] | None] = []
+        for conversation, message in items:
+            bot = cast(AsyncWebSocketBotClientConversation[Any], conversation)
+            futures.append(
+                asyncio.run_coroutine_threadsafe(
+                    bot._collect_answers(message), bot._loop
+                )
+                if bot._loop
+                else None
+            )
+        answers: list[list[OutgoingMessage]] = []
+        for (conversation, _), future in zip(items, futures):  # noqa: B905
+            try:
+                if not future:
+                    error = "the conversation is not running"
+                    raise RuntimeError(error)  # noqa: TRY301
+                answers.append(future.result())
+            except Exception:  # noqa: BLE001
+                getLogger(__name__).exception(
+                    "error while answering a message of conversation %s",
+                    conversation.conversation_id,
+                )
+                answers.append([])
+        return answers
+
+    async def _collect_answers(
+        self, message: Message | CompactMessage
+    ) -> list[OutgoingMessage]:
+        """Generate all the answers to a message.
+
+        Args:
+            message: the message which should be answered
+
+        Returns:
+            the answers
+        """
+        answers: Any = self.generate_answer(message)
+        if isawaitable(answers):
+            answers = await answers
+        if hasattr(answers, "__aiter__"):
+            return [answer async for answer in answers]
+        return list(answers or [])
+
+    def _enqueue_batched_answers(self, answers: list[OutgoingMessage]) -> None:
+        """Enqueue the answers to a message that was answered in a batch.
+
+        It is called by the batching thread, so the answers are enqueued
+        on the event loop of the conversation.
+
+        Args:
+            answers: the answers to the message
+        """
+        if not self._loop:
+            error = "the conversation is not running"
+            raise RuntimeError(error)
+        asyncio.run_coroutine_threadsafe(
+            self._enqueue_messages(answers), self._loop
+        ).add_done_callback(self._log_enqueue_error)
+
+    async def _enqueue_messages(self, messages: list[OutgoingMessage]) -> None:
+        for message in messages:
+            await self.enqueue_message(message)
+
+    def _log_enqueue_error(self, future: Future[None]) -> None:
+        if not future.cancelled() and future.exception():
+            getLogger(__name__).error(
+                "error while enqueuing the answers of conversation %s",
+                self.conversation_id,
+                exc_info=future.exception(),
+            )
+
+    async def enqueue_answer(  # type: ignore[override]
+        self, message: Message | CompactMessage
+    ) -> None:
+        """Generate answers to a message and enqueue them.
+
+        If ``generate_answer`` is an async generator, each answer is enqueued
+        (and sent) as soon as it is yielded.
+
+        If the setting ``CANCEL_SUPERSEDED`` is enabled, the answers are
+        generated in a task and this method returns immediately. The task is
+        cancelled when the user sends a newer message (it first waits for
+        ``ANSWER_DEBOUNCE`` seconds, so that quick messages are not answered).
+
+        Args:
+            message: the message which should be answered
+        """
+        if self._cancel_superseded:
+            self._generation_task = asyncio.create_task(
+                self._enqueue_answer_until_superseded(message)
+            )
+            self._generation_task.add_done_callback(self._log_generation_error)
+        else:
+            await self._enqueue_generated(self.generate_answer, message)
+
+    async def _enqueue_answer_until_superseded(
+        self, message: Message | CompactMessage
+    ) -> None:
+        """Generate answers to a message and enqueue them, unless cancelled.
+
+        Args:
+            message: the message which should be answered
+        """
+        started = False
+        try:
+            if self._answer_debounce:
+                await asyncio.sleep(self._answer_debounce)
+            started = True
+            await self._enqueue_generated(self.generate_answer, message)
+        except asyncio.CancelledError:
+            (_cancelled_generations if started else _dropped_generations).inc()
+            raise
+
+    def _log_generation_error(self, task: asyncio.Task[None]) -> None:
+        if not task.cancelled() and task.exception():
+            getLogger(__name__).error(
+                "error while answering a message in conversation %s",
+                self.conversation_id,
+                exc_info=task.exception(),
+            )
+
+    def _supersede(self, message: Message | CompactMessage) -> None:
+        """Cancel the generation of answers to older messages, if enabled.
+
+        Args:
+            message: the incoming message
+        """
+        super()._supersede(message)
+        task = self._generation_task
+        if task and message.sent_by_human and not task.done():
+            task.cancel()
+
+    async def enqueue_greeting(self) -> None:  # type: ignore[override]
+        """Generate greetings to the user and enqueue them.
+
+        If ``generate_greeting`` is a generator or an async generator,
+        each greeting is enqueued (and sent) as soon as it is yielded.
+        """
+        await self._enqueue_generated(self.generate_greeting)
+
+    async def _enqueue_generated(  # type: ignore[override]
+        self, generate: Callable[..., Any], *args: Any
+    ) -> None:
+        """Enqueue the messages generated by a method as they are produced.
+
+        Args:
+            generate: the method that generates the messages (a coroutine
+                function, an async generator function or a regular function)
+            args: the arguments of the method
+        """
+        started = monotonic()
+        first = True
+
+        async def enqueue(message: OutgoingMessage) -> None:
+            nonlocal first
+            if first and self._metrics_enabled:
+                _first_message_seconds.observe(monotonic() - started)
+            first = False
+            await self.enqueue_message(message)
+
+        messages = generate(*args)
+        if isawaitable(messages):
+            messages = await messages
+        if hasattr(messages, "__aiter__"):
+            async for message in messages:
+                await enqueue(message)
+        else:
+            for message in messages or []:
+                await enqueue(message)
+
+    async def on_connect(self) -> None:  # type: ignore[override]
+        """Handle the successful connection with the controller.
+
+        This method does nothing. The behaviour is defined by subclasses.
+        """
+
+    async def on_receive_message(  # type: ignore[override]
+        self, message: Message | CompactMessage
+    ) -> None:
+        """Handle the arrival of a new message.
+
+        This method does nothing. The behaviour is defined by subclasses.
+
+        Note that this method is also called when the bot's own messages
+        are delivered.
+
+        Args:
+            message: the incoming message
+        """
+
+    async def generate_answer(  # type: ignore[override]
+        self, message: Message | CompactMessage
+    ) -> list[OutgoingMessage]:
+        """Generate zero or more answers to a given message.
+
+        This method returns an empty list.
+        Subclasses should implement the desired behaviour. They may also
+        implement it as an async generator, so that ``enqueue_answer`` sends
+        each answer as soon as it is yielded.
+
+        Args:
+            message: the message which should be answered
+
+        Returns:
+            a list with the answers
+        """
+        return []
+
+    async def _process_outgoing_messages(self, ws: ClientConnection) -> None:
+        """Send the enqueued messages to the controller until cancelled.
+
+        All the messages waiting in the outbox are serialized at once
+        (messages that cannot be serialized are logged and skipped).
+
+        Args:
+            ws: the WebSocket connection
+        """
+        queue = self._async_outgoing_message_queue
+        while True:
+            messages = [await queue.get()]
+            while not queue.empty():
+                messages.append(queue.get_nowait())
+            frames = []
+            for message in messages:
+                try:
+                    frames.append(self._codec.encode_message(message))
+                except Exception:  # noqa: BLE001
+                    getLogger(__name__).exception(
+                        "could not encode a message of conversation %s",
+                        self.conversation_id,
+                    )
+                    if self._enqueue_times:
+                        self._enqueue_times.popleft()
+                    continue
+                if self._unacknowledged is not None:
+                    # if the connection is lost, it is sent again after reconnecting
+                    self._unacknowledged.add(message)
+            for frame in frames:
+                await ws.send(frame, text=True)
+                if self._capture:
+                    self._capture.write(Direction.OUTGOING, frame)
+                if self._enqueue_times:
+                    _send_latency.observe(monotonic() - self._enqueue_times.popleft())
+            self._last_activity = monotonic()
+
+    async def _process_incoming_frame(self, m: str | bytes) -> None:
+        """Handle a new incoming frame.
+
+        Args:
+            m: the raw message data
+        """
+        received = self._last_activity = monotonic()
+        if self._capture:
+            self._capture.write(Direction.INCOMING, m)
+        # the bot's own messages are recognized before they are decoded
+        delivered = self._pop_delivered(
+            self._codec.find_local_id(m) if self._pending_local_ids else None, received
+        )
+        if delivered:
+            self.on_delivered(*delivered)
+            if not self._deliver_own_messages:
+                state = self._codec.decode_state(m)
+                if state is not None:
+                    self.on_receive_state(state)
+                return
+        message, state = self._codec.decode_frame(m)
+        if message is not None:
+            self._supersede(message)
+            self._record_incoming_message(message)
+            await self.on_receive_message(message)
+            latency = monotonic() - received
+            if self._metrics_enabled:
+                _receive_latency.observe(latency)
+            if self._admission:
+                self._admission.record_latency(latency)
+        if state is not None:
+            self.on_receive_state(state)
+
+    async def _resend_unacknowledged(self, ws: ClientConnection) -> None:
+        """Send again the messages that were not delivered before reconnecting.
+
+        Args:
+            ws: the WebSocket connection
+        """
+        _reconnections.inc()
+        if self._metrics_enabled and self._disconnected_at is not None:
+            _downtime.observe(monotonic() - self._disconnected_at)
+        if self._unacknowledged is None:
+            return
+        for message in self._unacknowledged.messages():
+            frame = self._codec.encode_message(message)
+            await ws.send(frame, text=True)
+            if self._capture:
+                self._capture.write(Direction.OUTGOING, frame)
+            _resent_messages.inc()
+
+    async def _connect(self, url: str, session: str) -> int | None:
+        """Connect to the controller and process messages until disconnection.
+
+        ``on_connect`` is only called on the first connection. After a
+        reconnection, the undelivered messages are sent again.
+
+        Args:
+            url: WebSocket URL of the conversation
+            session: session id sent by the controller
+
+        Returns:
+            the code of the close frame received from the controller
+            (or 1006 if the connection was lost)
+        """
+        from websockets.asyncio.client import connect
+        from websockets.exceptions import ConnectionClosed
+
+        connection_settings = cast(
+            BlabWebSocketConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+        )
+        async with connect(
+            url,
+            additional_headers={"Cookie": "sessionid=" + session},
+            ping_interval=connection_settings.get("PING_INTERVAL", 30) or None,
+            ping_timeout=connection_settings.get("PING_TIMEOUT", 10) or None,
+        ) as self._ws:
+            if self._capture:
+                self._capture.write(Direction.CONNECTED)
+            sender: asyncio.Task[None] | None = None
+            receiver: asyncio.Task[None] | None = None
+            try:
+                if self._connected_before:
+                    await self._resend_unacknowledged(self._ws)
+                sender = asyncio.create_task(self._process_outgoing_messages(self._ws))
+                if not self._connected_before:
+                    self._connected_before = True
+                    await self.on_connect()
+                receiver = asyncio.create_task(self._process_incoming_frames(self._ws))
+                await asyncio.wait(
+                    {sender, receiver}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not receiver.done():
+                    # the messages can no longer be sent, so the connection is
+                    # closed (and established again, if reconnection is enabled)
+                    error = sender.exception()
+                    if not isinstance(error, ConnectionClosed):
+                        getLogger(__name__).error(
+                            "error while sending the messages of conversation %s",
+                            self.conversation_id,
+                            exc_info=error,
+                        )
+                    await self._ws.close()
+                    return None
+                await receiver
+            except ConnectionClosed:
+                if not self._reconnection.attempts:
+                    raise
+            finally:
+                self._stop_tasks(sender, receiver)
+            return self._ws.close_code
+
+    @classmethod
+    def _stop_tasks(cls, *tasks: asyncio.Task[None] | None) -> None:
+        """Cancel the tasks of a connection that are still running.
+
+        Args:
+            tasks: the tasks (``None`` for tasks that were not created)
+        """
+        for task in tasks:
+            if task and not task.done():
+                task.cancel()
+            elif task and not task.cancelled():
+                task.exception()  # it has already been handled (or it is None)
+
+    async def _process_incoming_frames(self, ws: ClientConnection) -> None:
+        """Handle the frames received from the controller until disconnection.
+
+        Args:
+            ws: the WebSocket connection
+        """
+        async for m in ws:
+            await self._process_incoming_frame(m)
+
+    async def _wait_to_reconnect(
+        self, close_code: int | None, failed_attempts: int
+    ) -> bool:
+        """Wait before reconnecting, if the conversation should reconnect.
+
+        Args:
+            close_code: the code of the close frame received from the
+                controller, or ``None`` if the connection failed
+            failed_attempts: number of consecutive attempts that have failed
+
+        Returns:
+            whether the conversation should reconnect now
+        """
+        if self._closing.is_set() or not self._reconnection.should_reconnect(
+            close_code, failed_attempts
+        ):
+            return False
+        delay = self._reconnection.delay(failed_attempts)
+        getLogger(__name__).info(
+            "reconnecting conversation %s in %.2f s", self.conversation_id, delay
+        )
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._closing.wait(), delay)
+        return not self._closing.is_set()
+
+    async def run(self, url: str, session: str) -> None:
+        """Process messages until disconnection, reconnecting if enabled.
+
+        Args:
+            url: WebSocket URL of the conversation
+            session: session id sent by the controller
+        """
+        from websockets.exceptions import InvalidHandshake, InvalidStatus
+
+        capture_dir = cast(
+            BlabWebSocketConnectionSettings, self.settings.BLAB_CONNECTION_SETTINGS
+        ).get("CAPTURE_DIR")
+        if capture_dir:
+            self._capture = CaptureWriter(
+                capture_path(capture_dir, self.conversation_id)
+            )
+        self._loop = asyncio.get_running_loop()
+        failed_attempts = 0
+        _active_conversations.inc()
+        if self._profiler:
+            self._profiler.start()
+        try:
+            while True:
+                close_code: int | None = None
+                try:
+                    close_code = await self._connect(url, session)
+                except (OSError, InvalidHandshake) as error:
+                    if not self._reconnection.attempts or (
+                        isinstance(error, InvalidStatus)
+                        and is_refusal(error.response.status_code)
+                    ):
+                        raise
+                else:
+                    self._disconnected_at = monotonic()
+                    failed_attempts = 0
+                if not await self._wait_to_reconnect(close_code, failed_attempts):
+                    break
+                failed_attempts += 1
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        """Release the resources of the conversation when it ends."""
+        _active_conversations.dec()
+        if self._generation_task:
+            self._generation_task.cancel()
+        with self._instances_lock:
+            if self._instances.get(self.conversation_id) is self:
+                del self._instances[self.conversation_id]
+        if self._capture:
+            self._capture.close()
+        self.on_disconnect()
+        if self.history is not None:
+            # the spilled messages of the conversation are no longer needed
+            self.history.discard()
+        if self._profiler:
+            self._profiler.save()
+
+    @classmethod
+    async def _start_conversation(
+        cls, settings: SettingsType, ws_url: str, payload: dict[str, Any]
+    ) -> None:
+        """Create a conversation on the event loop and run it.
+
+        A slot must have been reserved with ``_reserve``.
+
+        Args:
+            settings: the bot settings
+            ws_url: base URL of the controller for WebSocket connections
+            payload: data sent by the controller when the conversation started
+        """
+        conversation_id = payload["conversation_id"]
+        try:
+            session = payload["session"]
+            conversation = cls(settings, conversation_id, payload["bot_participant_id"])
+        except BaseException:
+            with cls._instances_lock:
+                cls._reservations.discard(conversation_id)
+            raise
+        with cls._instances_lock:
+            cls._reservations.discard(conversation_id)
+            cls._instances[conversation_id] = conversation
+        await conversation.run(ws_url + "/ws/chat/" + conversation_id + "/", session)
+
+    @classmethod
+    def _reserve(cls, conversation_id: str, max_conversations: int) -> bool:
+        """Reserve a slot for a conversation that will be created on the event loop.
+
+        Args:
+            conversation_id: id of the conversation
+            max_conversations: maximum number of conversations (0 for no limit)
+
+        Returns:
+            whether there was a free slot (a conversation with the same id
+            that is active or reserved is not replaced)
+        """
+        with cls._instances_lock:
+            if (
+                conversation_id in cls._instances
+                or conversation_id in cls._reservations
+            ):
+                getLogger(__name__).warning(
+                    "conversation %s has already been started", conversation_id
+                )
+                return False
+            if max_conversations and cls._count() >= max_conversations:
+                return False
+            cls._reservations.add(conversation_id)
+            return True
+
+    @classmethod
+    def _count(cls) -> int:
+        """Count the active and the reserved conversations.
+
+        Returns
+            the number of conversations
+        """
+        return len(cls._instances) + len(cls._reservations)
+
+    @classmethod
+    async def _close_idle_conversations(cls, idle_timeout: float) -> None:
+        """Periodically close conversations without recent activity.
+
+        Args:
+            idle_timeout: maximum time (in seconds) without incoming or
+                outgoing messages
+        """
+        while True:
+            await asyncio.sleep(min(idle_timeout / 2, 10))
+            limit = monotonic() - idle_timeout
+            with cls._instances_lock:
+                idle = [c for c in cls._instances.values() if c._last_activity < limit]
+            for conversation in idle:
+                getLogger(__name__).info(
+                    "closing idle conversation %s", conversation.conversation_id
+                )
+                await conversation.close()
+
+    @classmethod
+    def _log_conversation_error(cls, future: Future[None]) -> None:
+        """Log the exception that terminated a conversation, if any.
+
+        Args:
+            future: the future associated with the conversation
+        """
+        if not future.cancelled() and future.exception():
+            getLogger(__name__).error(
+                "conversation terminated with an error", exc_info=future.exception()
+            )
+
+    @classmethod
+    def _collect_metrics(cls) -> None:
+        """Update the gauges that are only computed when metrics are read."""
+        _threads.set(threading.active_count())
+        with cls._instances_lock:
+            conversations = list(cls._instances.values())
+        _outbox_depth.set(
+            sum(c._async_outgoing_message_queue.qsize() for c in conversations)
+        )
+        _history_bytes.set(
+            sum(c.history.nbytes for c in conversations if c.history is not None)
+        )
+
+    @classmethod
+    def start_http_server(
+        cls, settings: SettingsType, sock: socket.socket | None = None
+    ) -> None:
+        """Start an HTTP server, called when there is a new conversation.
+
+        The server is chosen by the setting ``HTTP_SERVER``, and it only
+        accepts conversations after ``warm_up`` finishes. The WebSocket
+        connections of all conversations run on one event loop, executed
+        by a single background thread.
+
+        Args:
+            settings: the bot settings
+            sock: an existing listening socket to be used by the server
+                (by default, the address in the settings is used)
+        """
+        from blab_chatbot_bot_client.intake import serve_intake
+
+        cls.ensure_warmed_up(settings)
+        loop = asyncio.new_event_loop()
+        Thread(target=loop.run_forever, daemon=True).start()
+
+        connection_settings = cast(
+            BlabWebSocketConnectionSettings, settings.BLAB_CONNECTION_SETTINGS
+        )
+        ws_url = connection_settings["BLAB_CONTROLLER_WS_URL"]
+        cls._codec = create_codec(
+            connection_settings.get("MESSAGE_CODEC", "json"),
+            compact=connection_settings.get("COMPACT_MESSAGES", False),
+        )
+        # handlers run on the event loop, so there is no queue of handler calls
+        admission = cls._admission = AdmissionController.from_settings(
+            connection_settings, cls._count
+        )
+        idle_timeout = connection_settings.get("IDLE_TIMEOUT", 0)
+        if connection_settings.get("METRICS_ENABLED", False):
+            metrics.registry.add_collector(cls._collect_metrics)
+
+        if idle_timeout:
+            asyncio.run_coroutine_threadsafe(
+                cls._close_idle_conversations(idle_timeout), loop
+            )
+
+        max_conversations = connection_settings.get("MAX_CONVERSATIONS", 0)
+
+        def start_conversation(payload: dict[str, Any]) -> bool:
+            # the slot is reserved now, so that the controller is told
+            # (with status 503) if the conversation is refused
+            if not cls._reserve(payload["conversation_id"], max_conversations):
+                return False
+            asyncio.run_coroutine_threadsafe(
+                cls._start_conversation(settings, ws_url, payload), loop
+            ).add_done_callback(cls._log_conversation_error)
+            return True
+
+        serve_intake(start_conversation, admission, connection_settings, sock)
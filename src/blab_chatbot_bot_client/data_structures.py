@@ -34,6 +34,23 @@ class MessageType(Enum):
     """Message with arbitrary attachment"""
 
 
+_MESSAGE_TYPES = {t.value: t for t in MessageType}
+"""Message types indexed by their values"""
+
+
+def _parse_message_type(value: str | MessageType) -> MessageType:
+    if isinstance(value, MessageType):
+        return value
+    t = _MESSAGE_TYPES.get(value)
+    return t if t is not None else MessageType(value)  # (raises ValueError)
+
+
+def _parse_time(value: str | datetime) -> datetime:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+
 @dataclass
 class Message:
     """Represents a message with data received from BLAB Controller."""
@@ -71,12 +88,24 @@ class Message:
     quoted_message_id: str | None = None
     """Id of the quoted message, if any"""
 
+    file_url: str | None = None
+    """URL of the file uploaded with the message (possibly relative), if any"""
+
+    external_file_url: str | None = None
+    """URL of the external file attached to the message, if any"""
+
+    file_name: str | None = None
+    """Name of the attached file, if any"""
+
+    file_size: int | None = None
+    """Size (in bytes) of the attached file, if known"""
+
+    mime_type: str | None = None
+    """MIME type of the attached file, if known"""
+
     def __post_init__(self) -> None:
-        if isinstance(self.time, str):  # type: ignore[unreachable]
-            t = self.time.replace("Z", "+00:00")  # type: ignore[unreachable]
-            self.time = datetime.fromisoformat(t)
-        if isinstance(self.type, str):
-            self.type = MessageType(self.type)
+        self.time = _parse_time(self.time)
+        self.type = _parse_message_type(self.type)
 
     @classmethod
     def from_dict(cls, d: dict[str, Any]) -> Message:
@@ -90,10 +119,146 @@ class Message:
         Returns:
             an instance with the provided data
         """
-        supported_fields = set(map(attrgetter("name"), fields(cls)))
+        supported_fields = (
+            _MESSAGE_FIELD_NAMES
+            if cls is Message
+            else frozenset(map(attrgetter("name"), fields(cls)))
+        )
         return Message(**{k: v for k, v in d.items() if k in supported_fields})
 
 
+_MESSAGE_FIELD_NAMES = frozenset(map(attrgetter("name"), fields(Message)))
+"""Names of the fields of ``Message``"""
+
+
+class CompactMessage:
+    """Represents a message with data received from BLAB Controller.
+
+    This class has the same attributes as ``Message``, but its instances
+    use less memory because they have no ``__dict__``. Besides, ``time``
+    is only parsed when it is read for the first time.
+    """
+
+    __slots__ = (
+        "id",
+        "_time",
+        "type",
+        "sent_by_human",
+        "options",
+        "local_id",
+        "text",
+        "sender_id",
+        "additional_metadata",
+        "event",
+        "quoted_message_id",
+        "file_url",
+        "external_file_url",
+        "file_name",
+        "file_size",
+        "mime_type",
+    )
+
+    def __init__(  # noqa: PLR0913
+        self,
+        id: str,  # noqa: A002
+        time: datetime | str,
+        type: MessageType | str,  # noqa: A002
+        sent_by_human: bool,  # noqa: FBT001
+        options: list[str] | None = None,
+        local_id: str | None = None,
+        text: str | None = None,
+        sender_id: str | None = None,
+        additional_metadata: dict[str, Any] | None = None,
+        event: str | None = None,
+        quoted_message_id: str | None = None,
+        file_url: str | None = None,
+        external_file_url: str | None = None,
+        file_name: str | None = None,
+        file_size: int | None = None,
+        mime_type: str | None = None,
+    ):
+        """Create an instance.
+
+        The arguments are the same as those of ``Message``.
+        """
+        self.id = id
+        self._time = time
+        self.type = _parse_message_type(type)
+        self.sent_by_human = sent_by_human
+        self.options = options
+        self.local_id = local_id
+        self.text = text
+        self.sender_id = sender_id
+        self.additional_metadata = additional_metadata
+        self.event = event
+        self.quoted_message_id = quoted_message_id
+        self.file_url = file_url
+        self.external_file_url = external_file_url
+        self.file_name = file_name
+        self.file_size = file_size
+        self.mime_type = mime_type
+
+    @property
+    def time(self) -> datetime:
+        """When the message was sent."""
+        if isinstance(self._time, str):
+            self._time = _parse_time(self._time)
+        return self._time
+
+    @time.setter
+    def time(self, value: datetime | str) -> None:
+        self._time = value
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CompactMessage | Message):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name) for name in _MESSAGE_FIELD_NAMES
+        )
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        values = ", ".join(
+            f"{f.name}={getattr(self, f.name)!r}" for f in fields(Message)
+        )
+        return f"{type(self).__name__}({values})"
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any]) -> CompactMessage:
+        """Create an instance using data from a dict.
+
+        Unknown or unsupported fields are ignored.
+
+        Args:
+            d: dictionary with the message data
+
+        Returns:
+            an instance with the provided data
+        """
+        return cls(**{k: v for k, v in d.items() if k in _MESSAGE_FIELD_NAMES})
+
+    @classmethod
+    def from_message(cls, message: Message) -> CompactMessage:
+        """Create an instance with the same data as a ``Message``.
+
+        Args:
+            message: the original message
+
+        Returns:
+            an instance with the provided data
+        """
+        return cls(**{name: getattr(message, name) for name in _MESSAGE_FIELD_NAMES})
+
+    def to_message(self) -> Message:
+        """Create a ``Message`` with the same data as this instance.
+
+        Returns
+            an instance of ``Message``
+        """
+        return Message(**{name: getattr(self, name) for name in _MESSAGE_FIELD_NAMES})
+
+
 @dataclass
 class OutgoingMessage:
     """Represents a message that the bot will send to BLAB Controller."""
@@ -136,15 +301,17 @@ class OutgoingMessage:
             d["quoted_message_id"] = self.quoted_message_id
         if self.command:
             d["command"] = self.command
-        if (
-            self.type
-            in {
-                MessageType.IMAGE,
-                MessageType.VIDEO,
-                MessageType.AUDIO,
-                MessageType.ATTACHMENT,
-            }
-            and self.external_file_url
-        ):
+        if self.type in _MEDIA_MESSAGE_TYPES and self.external_file_url:
             d["external_file_url"] = self.external_file_url
         return d
+
+
+_MEDIA_MESSAGE_TYPES = frozenset(
+    {
+        MessageType.IMAGE,
+        MessageType.VIDEO,
+        MessageType.AUDIO,
+        MessageType.ATTACHMENT,
+    }
+)
+"""Types of messages that may have an external file"""
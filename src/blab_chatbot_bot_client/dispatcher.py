@@ -0,0 +1,217 @@
+"""Contains a dispatcher that runs the handlers of conversations on worker threads.
+
+Handlers of the same conversation are executed one at a time, in the order
+they were submitted. Conversations with pending handlers are served in
+round-robin order, so that a busy conversation cannot starve the others.
+Calls can also be submitted after a delay (see ``submit_later``) without
+occupying a worker while they wait.
+"""
+
+from __future__ import annotations
+
+import heapq
+from collections import deque
+from dataclasses import dataclass
+from itertools import count
+from logging import getLogger
+from threading import Condition, Thread
+from time import monotonic
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+from blab_chatbot_bot_client import metrics
+
+
+@dataclass
+class _Task:
+    function: Callable[..., Any]
+    args: tuple[Any, ...]
+    submitted_at: float
+
+
+class ConversationDispatcher:
+    """Runs handler calls on a bounded pool of worker threads."""
+
+    def __init__(
+        self,
+        workers: int,
+        max_queue_size: int = 0,
+        registry: metrics.MetricsRegistry = metrics.registry,
+    ):
+        """Create an instance and start the worker threads.
+
+        Args:
+            workers: number of worker threads (if it is zero, calls are
+                executed synchronously by the thread that submits them)
+            max_queue_size: maximum number of pending calls (summing all
+                conversations) before ``submit`` blocks, or zero for no limit
+            registry: where the metrics are registered
+        """
+        self._max_queue_size = max_queue_size
+        self._pending: dict[str, deque[_Task]] = {}
+        self._ready: deque[str] = deque()
+        self._running: set[str] = set()
+        self._queue_depth = 0
+        self._shutting_down = False
+        self._condition = Condition()
+        # (due time, sequence number, key, function, arguments)
+        self._delayed: list[tuple[float, int, str, Callable[..., Any], Any]] = []
+        self._delayed_sequence = count()
+        self._delayed_condition = Condition()
+        self._queue_depth_gauge = registry.gauge(
+            "dispatcher_queue_depth", "Number of handler calls waiting for a worker"
+        )
+        self._busy_workers_gauge = registry.gauge(
+            "dispatcher_busy_workers", "Number of workers running handler calls"
+        )
+        self._tasks_counter = registry.counter(
+            "dispatcher_tasks_total", "Number of handler calls started"
+        )
+        self._wait_counter = registry.counter(
+            "dispatcher_wait_seconds_total",
+            "Total time spent by handler calls waiting for a worker",
+        )
+        self._threads = [
+            Thread(target=self._work, name=f"dispatcher-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+        Thread(
+            target=self._release_delayed, name="dispatcher-timer", daemon=True
+        ).start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of handler calls waiting for a worker."""
+        return self._queue_depth
+
+    def submit(self, key: str, function: Callable[..., Any], *args: Any) -> None:
+        """Schedule a handler call.
+
+        Args:
+            key: identifies the conversation (calls with the same key
+                are executed sequentially)
+            function: the function to be called
+            args: the arguments of the function
+        """
+        task = _Task(function, args, monotonic())
+        if not self._threads:
+            self._run(task)
+            return
+        with self._condition:
+            self._condition.wait_for(
+                lambda: not self._max_queue_size
+                or self._queue_depth < self._max_queue_size
+            )
+            queue = self._pending.setdefault(key, deque())
+            queue.append(task)
+            if len(queue) == 1 and key not in self._running:
+                self._ready.append(key)
+            self._queue_depth += 1
+            self._queue_depth_gauge.inc()
+            self._condition.notify_all()
+
+    def submit_later(
+        self, delay: float, key: str, function: Callable[..., Any], *args: Any
+    ) -> None:
+        """Schedule a handler call after a delay.
+
+        When the delay expires, the call is submitted (see ``submit``)
+        by a timer thread, so no worker is occupied while it waits.
+
+        Args:
+            delay: the delay (in seconds)
+            key: identifies the conversation (calls with the same key
+                are executed sequentially)
+            function: the function to be called
+            args: the arguments of the function
+        """
+        with self._delayed_condition:
+            heapq.heappush(
+                self._delayed,
+                (
+                    monotonic() + delay,
+                    next(self._delayed_sequence),
+                    key,
+                    function,
+                    args,
+                ),
+            )
+            self._delayed_condition.notify()
+
+    def shutdown(self, wait: bool = True) -> None:  # noqa: FBT001,FBT002
+        """Stop the workers after the pending calls are executed.
+
+        Delayed calls that have not been submitted yet are submitted
+        immediately.
+
+        Args:
+            wait: whether this method should wait until the workers finish
+        """
+        with self._delayed_condition:
+            delayed = sorted(self._delayed)
+            self._delayed.clear()
+        for _, _, key, function, args in delayed:
+            self.submit(key, function, *args)
+        with self._condition:
+            self._shutting_down = True
+            self._condition.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def _release_delayed(self) -> None:
+        """Submit the delayed calls when they are due (run by the timer thread)."""
+        while True:
+            with self._delayed_condition:
+                while not self._delayed or self._delayed[0][0] > monotonic():
+                    self._delayed_condition.wait(
+                        self._delayed[0][0] - monotonic() if self._delayed else None
+                    )
+                _, _, key, function, args = heapq.heappop(self._delayed)
+            self.submit(key, function, *args)
+
+    def _next_task(self) -> tuple[str, _Task] | None:
+        with self._condition:
+            self._condition.wait_for(lambda: self._ready or self._shutting_down)
+            if not self._ready:
+                return None
+            key = self._ready.popleft()
+            task = self._pending[key].popleft()
+            self._running.add(key)
+            self._queue_depth -= 1
+            self._queue_depth_gauge.dec()
+            self._condition.notify_all()
+            return key, task
+
+    def _finish(self, key: str) -> None:
+        with self._condition:
+            self._running.discard(key)
+            if self._pending[key]:
+                # the conversation goes to the end of the line
+                self._ready.append(key)
+                self._condition.notify()
+            else:
+                del self._pending[key]
+
+    def _run(self, task: _Task) -> None:
+        self._tasks_counter.inc()
+        self._wait_counter.inc(monotonic() - task.submitted_at)
+        self._busy_workers_gauge.inc()
+        try:
+            task.function(*task.args)
+        except Exception:  # noqa: BLE001
+            getLogger(__name__).exception("error in handler")
+        finally:
+            self._busy_workers_gauge.dec()
+
+    def _work(self) -> None:
+        while (item := self._next_task()) is not None:
+            key, task = item
+            try:
+                self._run(task)
+            finally:
+                self._finish(key)
@@ -0,0 +1,488 @@
+"""Contains a memory-bounded store of the messages exchanged in a conversation.
+
+The history is enabled by the settings ``HISTORY_MAX_MESSAGES`` and/or
+``HISTORY_MAX_CHARACTERS``, which limit the number of messages and the total
+length of their texts. When a limit is exceeded, the oldest messages are
+removed from memory. If ``HISTORY_SPILL_PATH`` is defined, they are moved to
+an SQLite database instead (shared by all the conversations of the process),
+from which they can still be read. The database is written by a background
+thread, so that recording a message never waits for the disk.
+
+Incoming messages are recorded before ``on_receive_message`` is called, and
+the bot's own messages are recorded when they are passed to
+``enqueue_message`` (their deliveries are not recorded again).
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+from collections import deque
+from itertools import islice
+from logging import getLogger
+from threading import Condition, Lock, Thread
+from time import time
+from typing import TYPE_CHECKING, Any
+
+from blab_chatbot_bot_client.data_structures import MessageType
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from blab_chatbot_bot_client.data_structures import (
+        CompactMessage,
+        Message,
+        OutgoingMessage,
+    )
+
+_REFERENCE_SIZE = 8
+"""Memory (in bytes) used by the reference to an entry in the history"""
+
+_OPTIONS_INDEX = 8
+"""Position of the options in the serialized entries of the spill"""
+
+
+class HistoryEntry:
+    """Represents a message stored in a conversation history."""
+
+    __slots__ = (
+        "id",
+        "time",
+        "type",
+        "sent_by_human",
+        "sender_id",
+        "text",
+        "quoted_message_id",
+        "event",
+        "options",
+        "file_url",
+        "additional_metadata",
+    )
+
+    def __init__(  # noqa: PLR0913
+        self,
+        id: str | None,  # noqa: A002
+        time: float,
+        type: MessageType,  # noqa: A002
+        sent_by_human: bool,  # noqa: FBT001
+        sender_id: str | None = None,
+        text: str | None = None,
+        quoted_message_id: str | None = None,
+        event: str | None = None,
+        options: tuple[str, ...] | None = None,
+        file_url: str | None = None,
+        additional_metadata: dict[str, Any] | None = None,
+    ):
+        """Create an instance.
+
+        Args:
+            id: id of the message (the local id for messages sent by the bot)
+            time: when the message was sent (as a POSIX timestamp)
+            type: type of the message
+            sent_by_human: whether the message was sent by a human user
+            sender_id: id of the message sender, if any
+            text: text of the message, if any
+            quoted_message_id: id of the quoted message, if any
+            event: event described by the message (for system messages), if any
+            options: options offered to the user, if any
+            file_url: URL of the file attached to the message, if any
+            additional_metadata: additional data of the message, if any
+        """
+        self.id = id
+        self.time = time
+        self.type = type
+        self.sent_by_human = sent_by_human
+        self.sender_id = sender_id
+        self.text = text
+        self.quoted_message_id = quoted_message_id
+        self.event = event
+        self.options = options
+        self.file_url = file_url
+        self.additional_metadata = additional_metadata
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+    @classmethod
+    def from_message(cls, message: Message | CompactMessage) -> HistoryEntry:
+        """Create an instance with the data of a received message.
+
+        Args:
+            message: the message
+
+        Returns:
+            the entry
+        """
+        return cls(
+            message.id,
+            message.time.timestamp(),
+            message.type,
+            message.sent_by_human,
+            message.sender_id,
+            message.text,
+            message.quoted_message_id,
+            message.event,
+            tuple(message.options) if message.options else None,
+            message.file_url or message.external_file_url,
+            message.additional_metadata,
+        )
+
+    @classmethod
+    def from_outgoing_message(
+        cls, message: OutgoingMessage, sender_id: str
+    ) -> HistoryEntry:
+        """Create an instance with the data of a message sent by the bot.
+
+        Args:
+            message: the message
+            sender_id: id of the participant correspondent to the bot
+
+        Returns:
+            the entry
+        """
+        return cls(
+            message.local_id,
+            time(),
+            message.type,
+            False,  # noqa: FBT003
+            sender_id,
+            message.text,
+            message.quoted_message_id,
+            options=tuple(message.options) if message.options else None,
+            file_url=message.external_file_url,
+        )
+
+    def size(self) -> int:
+        """Estimate the memory used by this instance.
+
+        Returns
+            the size (in bytes), including the strings it references
+            and the reference in the history
+        """
+        return (
+            _REFERENCE_SIZE
+            + sys.getsizeof(self)
+            + sum(
+                sys.getsizeof(value)
+                for value in (
+                    self.id,
+                    self.sender_id,
+                    self.text,
+                    self.quoted_message_id,
+                    self.event,
+                    self.file_url,
+                    self.additional_metadata,
+                )
+                if value is not None
+            )
+            + (
+                sys.getsizeof(self.options) + sum(map(sys.getsizeof, self.options))
+                if self.options
+                else 0
+            )
+        )
+
+    def _to_json(self) -> str:
+        return json.dumps(
+            [
+                self.id,
+                self.time,
+                self.type.value,
+                self.sent_by_human,
+                self.sender_id,
+                self.text,
+                self.quoted_message_id,
+                self.event,
+                self.options,
+                self.file_url,
+                self.additional_metadata,
+            ]
+        )
+
+    @classmethod
+    def _from_json(cls, data: str) -> HistoryEntry:
+        # rows written by older versions only have the first 7 values
+        values = json.loads(data)
+        values[2] = MessageType(values[2])
+        if len(values) > _OPTIONS_INDEX and values[_OPTIONS_INDEX] is not None:
+            values[_OPTIONS_INDEX] = tuple(values[_OPTIONS_INDEX])
+        return cls(*values)
+
+
+class HistorySpill:
+    """Stores the oldest entries of conversation histories in an SQLite database.
+
+    It can be shared by several conversations and threads. Writes and
+    deletions are queued and applied in batches by a background thread
+    (reads apply the queued operations first).
+    """
+
+    def __init__(self, path: str):
+        """Open the database, creating it if it does not exist.
+
+        Args:
+            path: path to the database
+        """
+        import sqlite3
+
+        self._lock = Lock()
+        self._database = sqlite3.connect(
+            path, timeout=5, check_same_thread=False, isolation_level=None
+        )
+        self._database.execute("PRAGMA journal_mode=WAL")
+        self._database.execute(
+            "CREATE TABLE IF NOT EXISTS history (conversation_id TEXT, seq INTEGER,"
+            " data TEXT, PRIMARY KEY (conversation_id, seq))"
+        )
+        # (conversation id, first sequence number, entries or None to delete)
+        self._pending: list[tuple[str, int, list[HistoryEntry] | None]] = []
+        self._condition = Condition()
+        Thread(target=self._work, name="history-spill", daemon=True).start()
+
+    def write(
+        self, conversation_id: str, first_seq: int, entries: list[HistoryEntry]
+    ) -> None:
+        """Store entries of a conversation.
+
+        Args:
+            conversation_id: id of the conversation
+            first_seq: sequence number of the first entry
+                (the others are numbered consecutively)
+            entries: the entries, in chronological order
+        """
+        with self._condition:
+            self._pending.append((conversation_id, first_seq, entries))
+            self._condition.notify()
+
+    def read(
+        self, conversation_id: str, limit: int, offset: int = 0
+    ) -> list[HistoryEntry]:
+        """Read the most recent entries stored for a conversation.
+
+        Args:
+            conversation_id: id of the conversation
+            limit: maximum number of entries
+            offset: number of most recent entries that are skipped
+
+        Returns:
+            the entries, in chronological order
+        """
+        with self._lock:
+            self._apply_pending()
+            rows = self._database.execute(
+                "SELECT data FROM history WHERE conversation_id = ?"
+                " ORDER BY seq DESC LIMIT ? OFFSET ?",
+                (conversation_id, limit, offset),
+            ).fetchall()
+        return [HistoryEntry._from_json(data) for data, in reversed(rows)]
+
+    def delete(self, conversation_id: str) -> None:
+        """Remove the entries stored for a conversation.
+
+        Args:
+            conversation_id: id of the conversation
+        """
+        with self._condition:
+            self._pending.append((conversation_id, 0, None))
+            self._condition.notify()
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+            try:
+                with self._lock:
+                    self._apply_pending()
+            except Exception:  # noqa: BLE001
+                getLogger(__name__).exception("error while writing the history spill")
+
+    def _apply_pending(self) -> None:
+        """Apply the queued operations in a single transaction.
+
+        It must be called with ``_lock`` held.
+        """
+        with self._condition:
+            operations = self._pending
+            self._pending = []
+        if not operations:
+            return
+        self._database.execute("BEGIN")
+        try:
+            for conversation_id, first_seq, entries in operations:
+                if entries is None:
+                    self._database.execute(
+                        "DELETE FROM history WHERE conversation_id = ?",
+                        (conversation_id,),
+                    )
+                else:
+                    self._database.executemany(
+                        "INSERT OR REPLACE INTO history VALUES (?, ?, ?)",
+                        (
+                            (conversation_id, seq, entry._to_json())
+                            for seq, entry in enumerate(entries, first_seq)
+                        ),
+                    )
+        except BaseException:
+            self._database.execute("ROLLBACK")
+            raise
+        self._database.execute("COMMIT")
+
+
+class ConversationHistory:
+    """Keeps the most recent messages of a conversation within a budget.
+
+    It can be used by several threads.
+    """
+
+    def __init__(
+        self,
+        max_messages: int = 0,
+        max_characters: int = 0,
+        spill: HistorySpill | None = None,
+        conversation_id: str = "",
+    ):
+        """Create an empty history.
+
+        Args:
+            max_messages: maximum number of messages kept in memory
+                (0 for no limit)
+            max_characters: maximum total length of the texts of the messages
+                kept in memory (0 for no limit); the most recent message is
+                always kept
+            spill: where the messages removed from memory are moved
+                (by default, they are discarded)
+            conversation_id: id of the conversation (used in the spill)
+        """
+        self._max_messages = max_messages
+        self._max_characters = max_characters
+        self._spill = spill
+        self._conversation_id = conversation_id
+        self._entries: deque[HistoryEntry] = deque()
+        self._characters = 0
+        self._nbytes = 0
+        self._spilled = 0
+        self._lock = Lock()
+
+    def add_message(self, message: Message | CompactMessage) -> None:
+        """Record a received message.
+
+        Args:
+            message: the message
+        """
+        self.append(HistoryEntry.from_message(message))
+
+    def add_outgoing_message(self, message: OutgoingMessage, sender_id: str) -> None:
+        """Record a message sent by the bot.
+
+        Args:
+            message: the message
+            sender_id: id of the participant correspondent to the bot
+        """
+        self.append(HistoryEntry.from_outgoing_message(message, sender_id))
+
+    def append(self, entry: HistoryEntry) -> None:
+        """Record an entry, removing the oldest ones if the budget is exceeded.
+
+        Args:
+            entry: the entry
+        """
+        with self._lock:
+            self._entries.append(entry)
+            self._characters += len(entry.text or "")
+            self._nbytes += entry.size()
+            removed = []
+            while (self._max_messages and len(self._entries) > self._max_messages) or (
+                self._max_characters
+                and self._characters > self._max_characters
+                and len(self._entries) > 1
+            ):
+                oldest = self._entries.popleft()
+                removed.append(oldest)
+                self._characters -= len(oldest.text or "")
+                self._nbytes -= oldest.size()
+            if removed and self._spill:
+                self._spill.write(self._conversation_id, self._spilled, removed)
+                self._spilled += len(removed)
+
+    def last(self, n: int) -> list[HistoryEntry]:
+        """Obtain the most recent entries in memory.
+
+        Args:
+            n: maximum number of entries
+
+        Returns:
+            the entries, in chronological order
+        """
+        with self._lock:
+            result = list(islice(reversed(self._entries), n))
+        result.reverse()
+        return result
+
+    def last_human(self, n: int | None = None) -> list[HistoryEntry]:
+        """Obtain the most recent entries in memory sent by human users.
+
+        Args:
+            n: maximum number of entries (by default, all of them)
+
+        Returns:
+            the entries, in chronological order
+        """
+        with self._lock:
+            humans = (e for e in reversed(self._entries) if e.sent_by_human)
+            result = list(islice(humans, n))
+        result.reverse()
+        return result
+
+    def older(self, n: int, offset: int = 0) -> list[HistoryEntry]:
+        """Obtain the most recent entries removed from memory.
+
+        Older entries can be read page by page, e.g. ``older(10)``,
+        ``older(10, offset=10)``, ``older(10, offset=20)``...
+
+        Args:
+            n: maximum number of entries
+            offset: number of most recent removed entries that are skipped
+
+        Returns:
+            the entries, in chronological order (empty if there is no spill)
+        """
+        if not self._spill or not self._spilled:
+            return []
+        return self._spill.read(self._conversation_id, n, offset)
+
+    def discard(self) -> None:
+        """Remove all the entries, including those in the spill."""
+        with self._lock:
+            self._entries.clear()
+            self._characters = self._nbytes = 0
+            if self._spill and self._spilled:
+                self._spill.delete(self._conversation_id)
+            self._spilled = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated memory (in bytes) used by the entries kept in memory."""
+        return self._nbytes
+
+    @property
+    def spilled(self) -> int:
+        """Number of entries moved to the spill."""
+        return self._spilled
+
+    def __len__(self) -> int:
+        """Obtain the number of entries in memory.
+
+        Returns
+            the number of entries
+        """
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[HistoryEntry]:
+        """Iterate over the entries in memory, in chronological order.
+
+        Returns
+            an iterator over a copy of the entries
+        """
+        with self._lock:
+            return iter(list(self._entries))
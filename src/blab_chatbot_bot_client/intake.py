@@ -0,0 +1,293 @@
+"""Contains the HTTP servers that accept the start of new conversations.
+
+BLAB Controller starts a conversation by sending a small JSON object in a POST
+request to ``/``. If metrics are enabled, they are also exposed at
+``GET /metrics``. The transport is chosen by the setting ``HTTP_SERVER``:
+
+- ``"waitress"`` (the default) serves a Flask application with waitress;
+- ``"asyncio"`` uses a minimal HTTP/1.1 server based on ``asyncio`` streams,
+  which has no dependencies, handles each request on an event loop instead
+  of a small pool of threads and starts faster.
+
+Both transports have the same request contract.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from http import HTTPStatus
+from logging import getLogger
+from typing import TYPE_CHECKING, Any
+
+from blab_chatbot_bot_client import metrics
+
+if TYPE_CHECKING:
+    import socket
+    from collections.abc import Callable
+
+    from blab_chatbot_bot_client.admission import AdmissionController
+    from blab_chatbot_bot_client.settings_format import (
+        BlabWebSocketConnectionSettings,
+    )
+
+MAX_HEADERS = 100
+"""Maximum number of header lines in a request"""
+
+MAX_BODY_SIZE = 1024 * 1024
+"""Maximum size (in bytes) of the body of a request"""
+
+Response = tuple[int, dict[str, str], bytes]
+
+
+def _metrics_response() -> Response:
+    from blab_chatbot_bot_client.prefork import aggregate_metrics
+
+    return (
+        200,
+        {"Content-Type": metrics.PROMETHEUS_CONTENT_TYPE},
+        metrics.registry.render(aggregate_metrics()).encode("utf-8"),
+    )
+
+
+class AsyncioIntakeServer:
+    """Minimal HTTP/1.1 server that accepts the start of new conversations."""
+
+    def __init__(
+        self,
+        start_conversation: Callable[[dict[str, Any]], bool],
+        admission: AdmissionController,
+        *,
+        expose_metrics: bool = False,
+    ):
+        """Create an instance.
+
+        Args:
+            start_conversation: function that starts a conversation with the
+                data sent by the controller, returning ``False`` if it was
+                refused (it is called in a worker thread, so that slow
+                constructors do not delay other requests)
+            admission: decides whether there is capacity for new conversations
+            expose_metrics: whether the metrics are exposed at ``/metrics``
+        """
+        self._start_conversation = start_conversation
+        self._admission = admission
+        self._expose_metrics = expose_metrics
+
+    def serve(self, host: str, port: int, sock: socket.socket | None = None) -> None:
+        """Run the server until the process is terminated.
+
+        Args:
+            host: address where the server listens
+            port: port where the server listens
+            sock: an existing listening socket to be used instead
+        """
+        asyncio.run(self._serve(host, port, sock))
+
+    async def _serve(self, host: str, port: int, sock: socket.socket | None) -> None:
+        if sock:
+            server = await asyncio.start_server(self._handle_connection, sock=sock)
+        else:
+            server = await asyncio.start_server(self._handle_connection, host, port)
+        for s in server.sockets:
+            address = s.getsockname()
+            getLogger(__name__).info("Serving on http://%s:%s", *address[:2])
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (
+            ConnectionError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ValueError,  # e.g. an invalid Content-Length
+        ):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bool:
+        """Read a request and write its response.
+
+        Args:
+            reader: stream from which the request is read
+            writer: stream to which the response is written
+
+        Returns:
+            whether the connection should be kept open
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            await self._write(writer, (400, {}, b""), keep_alive=False)
+            return False
+        headers: dict[str, str] = {}
+        for _ in range(MAX_HEADERS):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            await self._write(writer, (431, {}, b""), keep_alive=False)
+            return False
+        connection = headers.get("connection", "").lower()
+        keep_alive = (
+            connection == "keep-alive"
+            if version == "HTTP/1.0"
+            else connection != "close"
+        )
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            await self._write(writer, (411, {}, b""), keep_alive=False)
+            return False
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY_SIZE:
+            await self._write(writer, (413, {}, b""), keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+        response = await self._route(method, target.split("?", 1)[0], body)
+        await self._write(writer, response, keep_alive=keep_alive)
+        return keep_alive
+
+    async def _route(self, method: str, path: str, body: bytes) -> Response:
+        if path == "/":
+            if method != "POST":
+                return 405, {"Allow": "POST"}, b""
+            return await self._conversation_start(body)
+        if path == "/metrics" and self._expose_metrics:
+            if method != "GET":
+                return 405, {"Allow": "GET"}, b""
+            return _metrics_response()
+        return 404, {}, b""
+
+    async def _conversation_start(self, body: bytes) -> Response:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, {}, b""
+        if not isinstance(payload, dict):
+            return 200, {}, b""
+        if not await self._admission.admit_async():
+            _, status, headers = self._admission.refusal()
+            return status, headers, b""
+        try:
+            started = await asyncio.get_running_loop().run_in_executor(
+                None, self._start_conversation, payload
+            )
+        except Exception:  # noqa: BLE001
+            # e.g. a missing field (the same status returned by waitress)
+            getLogger(__name__).exception("error while starting a conversation")
+            return 500, {}, b""
+        if not started:
+            _, status, headers = self._admission.refusal()
+            return status, headers, b""
+        return 200, {}, b""
+
+    @classmethod
+    async def _write(
+        cls, writer: asyncio.StreamWriter, response: Response, *, keep_alive: bool
+    ) -> None:
+        status, headers, body = response
+        lines = [
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+            f"Content-Length: {len(body)}",
+            *(f"{name}: {value}" for name, value in headers.items()),
+        ]
+        if not keep_alive:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+# noinspection PyPackageRequirements
+def _serve_waitress(
+    start_conversation: Callable[[dict[str, Any]], bool],
+    admission: AdmissionController,
+    connection_settings: BlabWebSocketConnectionSettings,
+    sock: socket.socket | None,
+) -> None:
+    """Serve a Flask application with waitress.
+
+    Args:
+        start_conversation: function that starts a conversation with the
+            data sent by the controller, returning ``False`` if it was refused
+        admission: decides whether there is capacity for new conversations
+        connection_settings: the connection settings
+        sock: an existing listening socket to be used by the server
+    """
+    from flask import Flask, request
+    from waitress import serve
+
+    app = Flask(__name__)
+
+    if connection_settings.get("METRICS_ENABLED", False):
+
+        @app.route("/metrics", methods=["GET"])
+        def metrics_page() -> tuple[bytes, int, dict[str, str]]:
+            """Expose the metrics in Prometheus text format."""
+            status, headers, body = _metrics_response()
+            return body, status, headers
+
+    @app.route("/", methods=["POST"])
+    def conversation_start() -> tuple[str, int] | tuple[str, int, dict[str, str]]:
+        """Handle the start of a new conversation."""
+        if not isinstance(request.json, dict):
+            return "", 200
+        if not admission.admit() or not start_conversation(request.json):
+            return admission.refusal()
+        return "", 200
+
+    getLogger("waitress").setLevel("INFO")
+
+    if sock:
+        serve(app, sockets=[sock])
+    else:
+        serve(
+            app,
+            host=connection_settings["BOT_HTTP_SERVER_HOSTNAME"],
+            port=connection_settings["BOT_HTTP_SERVER_PORT"],
+        )
+
+
+def serve_intake(
+    start_conversation: Callable[[dict[str, Any]], bool],
+    admission: AdmissionController,
+    connection_settings: BlabWebSocketConnectionSettings,
+    sock: socket.socket | None = None,
+) -> None:
+    """Run the HTTP server chosen in the settings until the process is terminated.
+
+    Args:
+        start_conversation: function that starts a conversation with the
+            data sent by the controller, returning ``False`` if it was refused
+        admission: decides whether there is capacity for new conversations
+        connection_settings: the connection settings
+        sock: an existing listening socket to be used by the server
+            (by default, the address in the settings is used)
+    """
+    transport = connection_settings.get("HTTP_SERVER", "waitress")
+    if transport == "waitress":
+        _serve_waitress(start_conversation, admission, connection_settings, sock)
+    elif transport == "asyncio":
+        AsyncioIntakeServer(
+            start_conversation,
+            admission,
+            expose_metrics=connection_settings.get("METRICS_ENABLED", False),
+        ).serve(
+            connection_settings["BOT_HTTP_SERVER_HOSTNAME"],
+            connection_settings["BOT_HTTP_SERVER_PORT"],
+            sock,
+        )
+    else:
+        error = f"Unknown HTTP server: {transport}"
+        raise ValueError(error)
@@ -0,0 +1,355 @@
+"""Contains a load-testing tool that imitates BLAB Controller on localhost.
+
+The bot server is started in the same process. A fake controller (see
+``local_controller``) starts conversations by sending requests to the bot
+server and simulates users that send messages and wait for the answers.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import quantiles
+from time import monotonic
+from typing import TYPE_CHECKING, Any
+from urllib.request import Request, urlopen
+from uuid import uuid4
+
+from blab_chatbot_bot_client.local_controller import (
+    ServerWebSocket,
+    WebSocketClosedError,
+    accept_websocket,
+    start_bot_server,
+)
+
+if TYPE_CHECKING:
+    from blab_chatbot_bot_client.conversation_websocket import (
+        WebSocketBotClientConversation,
+    )
+    from blab_chatbot_bot_client.conversation_websocket_async import (
+        AsyncWebSocketBotClientConversation,
+    )
+    from blab_chatbot_bot_client.settings_format import (
+        BlabWebSocketBotClientSettings,
+    )
+
+
+@dataclass
+class LoadTestResult:
+    """Contains the results of a load test."""
+
+    conversations: int = 0
+    """Number of completed conversations"""
+
+    failed_conversations: int = 0
+    """Number of conversations that could not be started or timed out"""
+
+    elapsed_time: float = 0
+    """Duration of the test (in seconds)"""
+
+    latencies: list[float] = field(default_factory=list)
+    """Time (in seconds) between each user message and the first answer"""
+
+    max_threads: int = 0
+    """Maximum number of threads observed in the process"""
+
+    max_rss: int = 0
+    """Maximum resident set size observed in the process (in bytes)"""
+
+    def report(self) -> str:
+        """Summarize the results.
+
+        Returns
+            a human-readable summary
+        """
+        lines = [
+            f"conversations: {self.conversations} completed, "
+            f"{self.failed_conversations} failed",
+            f"elapsed time: {self.elapsed_time:.2f} s",
+            "conversations per second: "
+            f"{self.conversations / (self.elapsed_time or 1):.2f}",
+        ]
+        if len(self.latencies) > 1:
+            percentiles = quantiles(self.latencies, n=100, method="inclusive")
+            lines.append(
+                "answer latency: "
+                + ", ".join(
+                    f"p{p}={percentiles[p - 1] * 1000:.1f} ms" for p in (50, 95, 99)
+                )
+            )
+        lines += [
+            f"max threads: {self.max_threads}",
+            f"max RSS: {self.max_rss / 2**20:.1f} MiB",
+        ]
+        return "\n".join(lines)
+
+
+def _current_rss() -> int:
+    """Obtain the resident set size of the process.
+
+    Returns
+        the RSS in bytes (or the maximum RSS if the current value is unavailable)
+    """
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class FakeController:
+    """Imitates BLAB Controller, starting conversations with simulated users."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        bot_url: str,
+        users: int,
+        conversations: int,
+        turns: int,
+        think_time: float,
+        greeting: bool = False,  # noqa: FBT001,FBT002
+        message: str = "Hello",
+        timeout: float = 30,
+        answers_per_turn: int = 0,
+        answer_idle_time: float = 0.2,
+    ):
+        """Create an instance.
+
+        Args:
+            bot_url: address of the bot's HTTP server
+            users: number of simultaneous conversations
+            conversations: total number of conversations
+            turns: number of user messages in each conversation
+            think_time: average time (in seconds) a user waits after receiving
+                an answer before sending the next message
+            greeting: whether the bot sends the first message
+            message: text of the messages sent by users
+            timeout: maximum time (in seconds) to wait for each answer
+            answers_per_turn: number of answers the bot sends to each message
+                (0 if it is not fixed)
+            answer_idle_time: if ``answers_per_turn`` is 0, the answers to
+                a message are considered complete when no other answer
+                arrives within this time (in seconds)
+        """
+        self._bot_url = bot_url
+        self._users = users
+        self._conversations = conversations
+        self._turns = turns
+        self._think_time = think_time
+        self._greeting = greeting
+        self._message = message
+        self._timeout = timeout
+        self._answers_per_turn = answers_per_turn
+        self._answer_idle_time = answer_idle_time
+        self._finished: dict[str, asyncio.Future[bool]] = {}
+        self._result = LoadTestResult()
+
+    async def run(self, port: int) -> LoadTestResult:
+        """Run the load test.
+
+        Args:
+            port: port where the fake controller accepts WebSocket connections
+
+        Returns:
+            the results
+        """
+        server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        semaphore = asyncio.Semaphore(self._users)
+        started_at = monotonic()
+        sampler = asyncio.create_task(self._sample_resources())
+
+        async def conversation() -> None:
+            async with semaphore:
+                await self._run_conversation()
+
+        await asyncio.gather(*(conversation() for _ in range(self._conversations)))
+        self._result.elapsed_time = monotonic() - started_at
+        sampler.cancel()
+        server.close()
+        return self._result
+
+    async def _sample_resources(self) -> None:
+        while True:
+            self._result.max_threads = max(
+                self._result.max_threads, threading.active_count()
+            )
+            self._result.max_rss = max(self._result.max_rss, _current_rss())
+            await asyncio.sleep(0.1)
+
+    async def _run_conversation(self) -> None:
+        conversation_id = str(uuid4())
+        finished = self._finished[
+            conversation_id
+        ] = asyncio.get_running_loop().create_future()
+        payload = json.dumps(
+            {
+                "conversation_id": conversation_id,
+                "bot_participant_id": "bot",
+                "session": conversation_id,
+            }
+        ).encode("utf-8")
+        request = Request(
+            self._bot_url,
+            data=payload,
+            headers={"Content-Type": "application/json"},
+        )
+
+        def post() -> None:
+            with urlopen(request, timeout=self._timeout):  # noqa: S310
+                pass
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, post)
+            success = await asyncio.wait_for(
+                finished, self._timeout * (self._turns + 1)
+            )
+        except (OSError, asyncio.TimeoutError):
+            success = False
+        del self._finished[conversation_id]
+        if success:
+            self._result.conversations += 1
+        else:
+            self._result.failed_conversations += 1
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        conversation_id, ws = await accept_websocket(reader, writer)
+        finished = self._finished.get(conversation_id)
+        try:
+            success = await self._simulate_user(ws)
+        except (WebSocketClosedError, ConnectionError, asyncio.IncompleteReadError):
+            success = False
+        finally:
+            await ws.close()
+        if finished and not finished.done():
+            finished.set_result(success)
+
+    async def _simulate_user(self, ws: ServerWebSocket) -> bool:
+        await ws.send(json.dumps({"state": {"participants": ["user", "bot"]}}))
+        if self._greeting and not await self._receive_answers(ws):
+            return False
+        for turn in range(self._turns):
+            if turn and self._think_time:
+                await asyncio.sleep(random.expovariate(1 / self._think_time))
+            sent_at = monotonic()
+            await ws.send(
+                json.dumps(
+                    {
+                        "message": self._message_data(
+                            text=self._message, sent_by_human=True, sender_id="user"
+                        )
+                    }
+                )
+            )
+            if not await self._receive_answers(ws, sent_at):
+                return False
+        return True
+
+    async def _receive_answers(
+        self, ws: ServerWebSocket, sent_at: float | None = None
+    ) -> bool:
+        """Receive all the answers to a message (or the greetings).
+
+        The next message is only sent after the turn ends, so that late
+        answers are not taken as answers to it.
+
+        Args:
+            ws: the connection with the bot
+            sent_at: when the message was sent (the latency of the first
+                answer is recorded), or ``None`` for greetings
+
+        Returns:
+            whether the answers arrived in time
+        """
+        received = 0
+        while not self._answers_per_turn or received < self._answers_per_turn:
+            data = await ws.receive_within(
+                self._answer_idle_time
+                if received and not self._answers_per_turn
+                else self._timeout
+            )
+            if data is None:
+                # after the first answer, a pause ends the turn
+                return bool(received) and not self._answers_per_turn
+            answer = json.loads(data)
+            if not received and sent_at is not None:
+                self._result.latencies.append(monotonic() - sent_at)
+            received += 1
+            # the controller delivers the bot's messages back to it
+            await ws.send(
+                json.dumps(
+                    {
+                        "message": self._message_data(
+                            text=answer.get("text"),
+                            sent_by_human=False,
+                            sender_id="bot",
+                            local_id=answer.get("local_id"),
+                        )
+                    }
+                )
+            )
+        return True
+
+    @classmethod
+    def _message_data(cls, **kwargs: Any) -> dict[str, Any]:
+        return {
+            "id": str(uuid4()),
+            "time": datetime.now(timezone.utc).isoformat(),
+            "type": "T",
+            **kwargs,
+        }
+
+
+def run_load_test(  # noqa: PLR0913
+    client: type[WebSocketBotClientConversation[Any]]
+    | type[AsyncWebSocketBotClientConversation[Any]],
+    settings: BlabWebSocketBotClientSettings,
+    users: int,
+    conversations: int,
+    turns: int,
+    think_time: float,
+    answers_per_turn: int = 0,
+    answer_idle_time: float = 0.2,
+) -> LoadTestResult:
+    """Start the bot server and run a load test against it.
+
+    Args:
+        client: the conversation class of the bot
+        settings: bot settings (the connection settings are replaced
+            with local addresses)
+        users: number of simultaneous conversations
+        conversations: total number of conversations
+        turns: number of user messages in each conversation
+        think_time: average time (in seconds) a user waits after receiving
+            an answer before sending the next message
+        answers_per_turn: number of answers the bot sends to each message
+            (0 if it is not fixed)
+        answer_idle_time: if ``answers_per_turn`` is 0, the answers to
+            a message are considered complete when no other answer
+            arrives within this time (in seconds)
+
+    Returns:
+        the results
+    """
+    bot_port, controller_port = start_bot_server(client, settings)
+    controller = FakeController(
+        f"http://127.0.0.1:{bot_port}/",
+        users,
+        conversations,
+        turns,
+        think_time,
+        client.bot_sends_first_message(),
+        answers_per_turn=answers_per_turn,
+        answer_idle_time=answer_idle_time,
+    )
+    return asyncio.run(controller.run(controller_port))
@@ -0,0 +1,225 @@
+"""Contains a local imitation of the WebSocket side of BLAB Controller.
+
+It implements just enough of the WebSocket protocol (RFC 6455) to exchange
+messages with a bot, and it starts the bot server in the same process,
+connected to local ports. It is used by the load tests (see ``loadtest``)
+and by the replays of captured conversations (see ``replay``).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import socket
+import struct
+import threading
+from base64 import b64encode
+from contextlib import suppress
+from hashlib import sha1
+from time import sleep
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, cast
+
+if TYPE_CHECKING:
+    from blab_chatbot_bot_client.conversation_websocket import (
+        WebSocketBotClientConversation,
+    )
+    from blab_chatbot_bot_client.conversation_websocket_async import (
+        AsyncWebSocketBotClientConversation,
+    )
+    from blab_chatbot_bot_client.settings_format import (
+        BlabWebSocketBotClientSettings,
+        BlabWebSocketConnectionSettings,
+    )
+
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_OPCODE_CONTINUATION = 0x0
+_OPCODE_TEXT = 0x1
+_OPCODE_BINARY = 0x2
+_OPCODE_CLOSE = 0x8
+_OPCODE_PING = 0x9
+
+_SMALL_PAYLOAD = 125
+_MEDIUM_PAYLOAD = 0xFFFF
+
+
+class WebSocketClosedError(Exception):
+    """Raised when the bot closes a WebSocket connection."""
+
+
+class ServerWebSocket:
+    """Implements the server side of a WebSocket connection (RFC 6455)."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Create an instance for a connection that has been accepted.
+
+        Args:
+            reader: the stream of the connection
+            writer: the stream of the connection
+        """
+        self._reader = reader
+        self._writer = writer
+        self._pending: asyncio.Future[str] | None = None
+
+    async def receive_within(self, timeout: float) -> str | None:
+        """Receive a message if one arrives within a time limit.
+
+        A message that is partially received when the time is over
+        is kept, and it is returned by the next call.
+
+        Args:
+            timeout: maximum time (in seconds) to wait
+
+        Returns:
+            the message, or ``None`` if it has not arrived
+        """
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self.receive())
+        done, _ = await asyncio.wait({self._pending}, timeout=timeout)
+        if not done:
+            return None
+        pending, self._pending = self._pending, None
+        return pending.result()
+
+    async def receive(self) -> str:
+        """Receive a message, answering pings.
+
+        ``WebSocketClosedError`` is raised if the bot closes the connection.
+
+        Returns
+            the message
+        """
+        fragments: list[bytes] = []
+        while True:
+            header = await self._reader.readexactly(2)
+            fin, opcode = header[0] & 0x80, header[0] & 0x0F
+            length = header[1] & 0x7F
+            if length == _SMALL_PAYLOAD + 1:
+                (length,) = struct.unpack("!H", await self._reader.readexactly(2))
+            elif length == _SMALL_PAYLOAD + 2:
+                (length,) = struct.unpack("!Q", await self._reader.readexactly(8))
+            mask = await self._reader.readexactly(4) if header[1] & 0x80 else b""
+            payload = await self._reader.readexactly(length)
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            if opcode == _OPCODE_CLOSE:
+                raise WebSocketClosedError
+            if opcode == _OPCODE_PING:
+                await self._send_frame(_OPCODE_PING + 1, payload)
+            elif opcode in (_OPCODE_TEXT, _OPCODE_BINARY, _OPCODE_CONTINUATION):
+                fragments.append(payload)
+                if fin:
+                    return b"".join(fragments).decode("utf-8")
+
+    async def send(self, text: str) -> None:
+        """Send a text message.
+
+        Args:
+            text: the message
+        """
+        await self._send_frame(_OPCODE_TEXT, text.encode("utf-8"))
+
+    async def close(self) -> None:
+        """Close the connection."""
+        if self._pending:
+            self._pending.cancel()
+        with suppress(ConnectionError):
+            await self._send_frame(_OPCODE_CLOSE, struct.pack("!H", 1000))
+        self._writer.close()
+
+    async def _send_frame(self, opcode: int, payload: bytes) -> None:
+        length = len(payload)
+        if length <= _SMALL_PAYLOAD:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length <= _MEDIUM_PAYLOAD:
+            header = struct.pack("!BBH", 0x80 | opcode, _SMALL_PAYLOAD + 1, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, _SMALL_PAYLOAD + 2, length)
+        self._writer.write(header + payload)
+        await self._writer.drain()
+
+
+async def accept_websocket(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> tuple[str, ServerWebSocket]:
+    """Perform the opening handshake of a WebSocket connection from the bot.
+
+    Args:
+        reader: the stream of the incoming connection
+        writer: the stream of the incoming connection
+
+    Returns:
+        the conversation id in the URL and the WebSocket
+    """
+    request_line, *header_lines = (
+        (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    )
+    headers = {
+        k.strip().lower(): v.strip()
+        for k, _, v in (line.partition(":") for line in header_lines if line)
+    }
+    conversation_id = request_line.split()[1].strip("/").split("/")[-1]
+    accept = b64encode(
+        sha1(  # noqa: S324
+            (headers.get("sec-websocket-key", "") + _WEBSOCKET_GUID).encode()
+        ).digest()
+    ).decode()
+    writer.write(
+        (
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode("latin-1")
+    )
+    return conversation_id, ServerWebSocket(reader, writer)
+
+
+def start_bot_server(
+    client: type[WebSocketBotClientConversation[Any]]
+    | type[AsyncWebSocketBotClientConversation[Any]],
+    settings: BlabWebSocketBotClientSettings,
+) -> tuple[int, int]:
+    """Start the bot server in a background thread, connected to local ports.
+
+    Args:
+        client: the conversation class of the bot
+        settings: bot settings (the connection settings are replaced
+            with local addresses)
+
+    Returns:
+        the port of the bot server and the port where the fake
+        controller must accept WebSocket connections
+    """
+    bot_port, controller_port = _free_port(), _free_port()
+    test_settings = SimpleNamespace(
+        **{k: getattr(settings, k) for k in dir(settings) if not k.startswith("_")}
+    )
+    connection_settings = cast(
+        "BlabWebSocketConnectionSettings",
+        {
+            **settings.BLAB_CONNECTION_SETTINGS,
+            "BOT_HTTP_SERVER_HOSTNAME": "127.0.0.1",
+            "BOT_HTTP_SERVER_PORT": bot_port,
+            "BLAB_CONTROLLER_WS_URL": f"ws://127.0.0.1:{controller_port}",
+        },
+    )
+    test_settings.BLAB_CONNECTION_SETTINGS = connection_settings
+    # the server only opens its port after the warm-up
+    client.ensure_warmed_up(test_settings)
+    threading.Thread(
+        target=client.start_http_server, args=(test_settings,), daemon=True
+    ).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", bot_port), timeout=1).close()
+            break
+        except OSError:
+            sleep(0.1)
+    return bot_port, controller_port
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return cast(int, s.getsockname()[1])
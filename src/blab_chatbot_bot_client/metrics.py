@@ -0,0 +1,366 @@
+"""Contains simple thread-safe metrics collected by the library.
+
+All the metrics are registered in ``registry``, which can be
+inspected by bots and by the server (in Prometheus text format).
+"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import wraps
+from inspect import isasyncgenfunction, iscoroutinefunction, isgeneratorfunction
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, ClassVar, TypeVar
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+"""Default upper bounds (in seconds) of the buckets of histograms"""
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+"""Content type of metrics rendered in Prometheus text format"""
+
+
+class Metric(ABC):
+    """Represents a named metric."""
+
+    kind: ClassVar[str] = "untyped"
+    """Type of the metric in Prometheus text format"""
+
+    def __init__(self, name: str, description: str):
+        """Create an instance.
+
+        Args:
+            name: name of the metric
+            description: human-readable description of the metric
+        """
+        self.name = name
+        self.description = description
+        self._lock = Lock()
+
+    @abstractmethod
+    def samples(self) -> dict[str, float]:
+        """Obtain the current values of the metric.
+
+        Returns
+            a dict that maps the name of each sample (including its labels,
+            as in Prometheus text format) to its value
+        """
+
+
+class Counter(Metric):
+    """Represents a value that can only increase."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        """Create an instance.
+
+        Args:
+            name: name of the metric
+            description: human-readable description of the metric
+        """
+        super().__init__(name, description)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        """Increase the value.
+
+        Args:
+            amount: how much the value should be increased
+        """
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        """Current value of the metric."""
+        return self._value
+
+    def samples(self) -> dict[str, float]:  # noqa: D102
+        return {self.name: self._value}
+
+
+class Gauge(Counter):
+    """Represents a value that can increase or decrease."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1) -> None:
+        """Decrease the value.
+
+        Args:
+            amount: how much the value should be decreased
+        """
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        """Replace the value.
+
+        Args:
+            value: the new value
+        """
+        with self._lock:
+            self._value = value
+
+
+class Histogram(Metric):
+    """Represents the distribution of observed values (such as durations)."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, description: str, buckets: Iterable[float] = DEFAULT_BUCKETS
+    ):
+        """Create an instance.
+
+        Args:
+            name: name of the metric
+            description: human-readable description of the metric
+            buckets: upper bounds of the buckets
+        """
+        super().__init__(name, description)
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record a value.
+
+        Args:
+            value: the observed value
+        """
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def samples(self) -> dict[str, float]:  # noqa: D102
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        result: dict[str, float] = {}
+        cumulative = 0
+        for i, count in enumerate(counts):
+            cumulative += count
+            label = repr(float(self.buckets[i])) if i < len(self.buckets) else "+Inf"
+            result[f'{self.name}_bucket{{le="{label}"}}'] = cumulative
+        result[f"{self.name}_sum"] = total
+        result[f"{self.name}_count"] = cumulative
+        return result
+
+
+FunctionType = TypeVar("FunctionType", bound="Callable[..., Any]")
+
+
+def timed(histogram: Histogram, function: FunctionType) -> FunctionType:
+    """Wrap a function so that the duration of its calls is recorded.
+
+    Args:
+        histogram: where the durations (in seconds) are recorded
+        function: the function (which can also be a coroutine function,
+            a generator function or an async generator function, in which
+            case the duration includes all the iterations)
+
+    Returns:
+        the wrapped function
+    """
+    if isasyncgenfunction(function):
+
+        @wraps(function)
+        async def async_generator_wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = perf_counter()
+            try:
+                async for item in function(*args, **kwargs):
+                    yield item
+            finally:
+                histogram.observe(perf_counter() - start)
+
+        return async_generator_wrapper  # type: ignore[return-value]
+
+    if isgeneratorfunction(function):
+
+        @wraps(function)
+        def generator_wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = perf_counter()
+            try:
+                yield from function(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+
+        return generator_wrapper  # type: ignore[return-value]
+
+    if iscoroutinefunction(function):
+
+        @wraps(function)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+
+        return async_wrapper  # type: ignore[return-value]
+
+    @wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start)
+
+    return wrapper  # type: ignore[return-value]
+
+
+MetricType = TypeVar("MetricType", bound=Metric)
+
+
+class MetricsRegistry:
+    """Contains a set of named metrics."""
+
+    def __init__(self) -> None:
+        """Create an empty registry."""
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: list[Callable[[], Any]] = []
+        self._lock = Lock()
+
+    def counter(self, name: str, description: str) -> Counter:
+        """Obtain a counter, creating it if it does not exist.
+
+        Args:
+            name: name of the metric
+            description: human-readable description of the metric
+
+        Returns:
+            the counter with the given name
+        """
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        """Obtain a gauge, creating it if it does not exist.
+
+        Args:
+            name: name of the metric
+            description: human-readable description of the metric
+
+        Returns:
+            the gauge with the given name
+        """
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(
+        self, name: str, description: str, buckets: Iterable[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """Obtain a histogram, creating it if it does not exist.
+
+        Args:
+            name: name of the metric
+            description: human-readable description of the metric
+            buckets: upper bounds of the buckets (if the histogram is created)
+
+        Returns:
+            the histogram with the given name
+        """
+        return self._get_or_create(Histogram, name, description, buckets)
+
+    def add_collector(self, collector: Callable[[], Any]) -> None:
+        """Register a function that updates metrics before they are read.
+
+        This is useful for values that are expensive to track continuously
+        (e.g. the number of threads), which can be set when needed.
+
+        Args:
+            collector: function called by ``snapshot``
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _get_or_create(
+        self, metric_type: type[MetricType], name: str, *args: Any
+    ) -> MetricType:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_type(name, *args)
+        if not isinstance(metric, metric_type):
+            error = f"Metric {name} has a different type"
+            raise TypeError(error)
+        return metric
+
+    def snapshot(self, worker: str | None = None) -> dict[str, float]:
+        """Obtain the current values of all metrics.
+
+        The values of histograms are split into several samples
+        (one for each bucket, their sum and their count).
+
+        Args:
+            worker: if given, the samples of gauges are labelled with it,
+                so that snapshots of several processes can be summed
+                (gauges such as configuration values cannot be added)
+
+        Returns:
+            a dict that maps the name of each sample to its value
+        """
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+        for collector in collectors:
+            collector()
+        result = {}
+        for metric in metrics:
+            if worker is not None and isinstance(metric, Gauge):
+                result[f'{metric.name}{{worker="{worker}"}}'] = metric.value
+            else:
+                result.update(metric.samples())
+        return result
+
+    def render(self, values: dict[str, float] | None = None) -> str:
+        """Format the metrics in Prometheus text format.
+
+        Args:
+            values: the values of the samples, as returned by ``snapshot``
+                (possibly aggregated from several processes);
+                by default, the current values are used
+
+        Returns:
+            the formatted metrics
+        """
+        if values is None:
+            values = self.snapshot()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            # gauges aggregated from several processes have one sample per worker
+            prefix = metric.name + '{worker="'
+            labelled = [s for s in values if s.startswith(prefix)]
+            if isinstance(metric, Gauge) and labelled:
+                lines += [f"{s} {float(values[s])!r}" for s in sorted(labelled)]
+                continue
+            for sample, value in metric.samples().items():
+                lines.append(f"{sample} {float(values.get(sample, value))!r}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+"""Registry that contains the metrics collected by the library"""
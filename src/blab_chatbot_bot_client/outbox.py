@@ -0,0 +1,161 @@
+"""Contains a bounded queue of messages waiting to be sent to the controller.
+
+The consumer removes all the enqueued messages at once and reports each of
+them as sent. The outbox becomes full when the number of pending messages
+(enqueued or removed but not yet sent) reaches its high watermark, and it
+remains full until they are sent down to its low watermark. What happens to
+messages enqueued while the outbox is full is determined by its policy.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from enum import Enum
+from threading import Condition
+from time import monotonic
+from typing import Generic, TypeVar
+
+from blab_chatbot_bot_client import metrics
+
+T = TypeVar("T")
+
+_dropped_messages = metrics.registry.counter(
+    "outbox_dropped_messages_total", "Number of messages dropped by full outboxes"
+)
+
+
+class OutboxFullError(Exception):
+    """Raised when a message is enqueued in a full outbox with policy RAISE."""
+
+
+class OutboxPolicy(Enum):
+    """Represents what happens when a message is enqueued in a full outbox."""
+
+    BLOCK = "block"
+    """Wait until the outbox is drained down to its low watermark"""
+
+    DROP = "drop"
+    """Discard the message"""
+
+    RAISE = "raise"
+    """Raise ``OutboxFullError``"""
+
+
+class Outbox(Generic[T]):
+    """Represents a bounded queue whose items are consumed all at once."""
+
+    def __init__(
+        self,
+        high_watermark: int = 0,
+        low_watermark: int | None = None,
+        policy: OutboxPolicy = OutboxPolicy.BLOCK,
+        latency: metrics.Histogram | None = None,
+    ):
+        """Create an instance.
+
+        Args:
+            high_watermark: number of items that makes the outbox full
+                (zero for an unbounded outbox)
+            low_watermark: number of items below which a full outbox
+                accepts new items again (by default, half of the high watermark)
+            policy: what happens to items enqueued while the outbox is full
+            latency: if given, where the time (in seconds) between the
+                enqueueing of each item and the report that it has been
+                sent is recorded
+        """
+        self._items: deque[T] = deque()
+        self._latency = latency
+        self._enqueue_times: deque[float] = deque()
+        self._unsent = 0
+        self._high_watermark = high_watermark
+        self._low_watermark = (
+            high_watermark // 2 if low_watermark is None else low_watermark
+        )
+        self._policy = policy
+        self._full = False
+        self._closed = False
+        self._condition = Condition()
+
+    def __len__(self) -> int:
+        return len(self._items) + self._unsent
+
+    def put(self, item: T) -> bool:
+        """Enqueue an item.
+
+        Args:
+            item: the item to be enqueued
+
+        Raises:
+            OutboxFullError: if the outbox is full and its policy is RAISE
+
+        Returns:
+            ``True`` if the item has been enqueued, ``False`` if it has been
+            dropped (because the outbox is full or closed)
+        """
+        with self._condition:
+            if self._full and self._policy != OutboxPolicy.BLOCK:
+                if self._policy == OutboxPolicy.RAISE:
+                    error = "The outbox is full"
+                    raise OutboxFullError(error)
+                _dropped_messages.inc()
+                return False
+            self._condition.wait_for(lambda: not self._full or self._closed)
+            if self._closed:
+                return False
+            self._items.append(item)
+            if self._latency:
+                self._enqueue_times.append(monotonic())
+            if self._high_watermark and len(self) >= self._high_watermark:
+                self._full = True
+            self._condition.notify_all()
+            return True
+
+    def get_all(self) -> list[T] | None:
+        """Remove all the items, waiting until there is at least one.
+
+        The consumer must call ``mark_sent`` after processing each item.
+
+        Returns
+            the items in the order they were enqueued, or ``None`` if the
+            outbox has been closed and there are no more items
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._items or self._closed)
+            if not self._items:
+                return None
+            items = list(self._items)
+            self._items.clear()
+            self._unsent += len(items)
+            return items
+
+    def mark_sent(self, count: int = 1) -> None:
+        """Report that items removed by ``get_all`` have been processed.
+
+        Args:
+            count: number of processed items
+        """
+        with self._condition:
+            self._unsent = max(self._unsent - count, 0)
+            if self._latency:
+                now = monotonic()
+                for _ in range(min(count, len(self._enqueue_times))):
+                    self._latency.observe(now - self._enqueue_times.popleft())
+            if self._full and len(self) <= self._low_watermark:
+                self._full = False
+                self._condition.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        """Whether the outbox has been closed."""
+        return self._closed
+
+    def close(self) -> None:
+        """Close the outbox.
+
+        Items that have already been enqueued can still be obtained,
+        but new items are dropped.
+        """
+        with self._condition:
+            self._closed = True
+            self._full = False
+            self._condition.notify_all()
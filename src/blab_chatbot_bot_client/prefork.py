@@ -0,0 +1,168 @@
+"""Contains a supervisor that runs the HTTP server in several worker processes.
+
+The supervisor creates the listening socket and forks the workers, which
+inherit it. The operating system distributes the incoming connections among
+the workers, and each conversation lives entirely inside the worker that
+accepted it. Workers that terminate unexpectedly are replaced.
+
+Each worker periodically publishes the values in its metrics registry to a
+directory shared with the supervisor, where they can be aggregated: counters
+and histograms are summed, and gauges are labelled with the worker's pid.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import signal
+import socket
+from logging import getLogger
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Any
+
+from blab_chatbot_bot_client import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+_METRICS_PUBLISH_INTERVAL = 5
+"""How often (in seconds) each worker publishes its metrics"""
+
+_METRICS_REPORT_INTERVAL = 60
+"""How often (in seconds) the supervisor logs the aggregated metrics"""
+
+metrics_directory: Path | None = None
+"""Directory where the workers publish their metrics (in the prefork mode only)"""
+
+
+def aggregate_metrics(directory: Path | None = None) -> dict[str, float]:
+    """Aggregate the metrics published by all the workers.
+
+    Counters and histograms are summed. Gauges (which may be configuration
+    values) are kept separately for each worker, with a ``worker`` label.
+
+    Args:
+        directory: directory where the metrics are published
+            (by default, the one used by the current supervisor)
+
+    Returns:
+        a dict that maps the name of each sample to its aggregated value
+    """
+    directory = directory or metrics_directory
+    if not directory:
+        return metrics.registry.snapshot()
+    total: dict[str, float] = {}
+    for path in directory.glob("*.json"):
+        try:
+            values = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue  # the worker has just been replaced
+        for name, value in values.items():
+            total[name] = total.get(name, 0) + value
+    return total
+
+
+class PreforkSupervisor:
+    """Runs an HTTP server in several worker processes sharing one socket."""
+
+    def __init__(
+        self,
+        serve: Callable[[socket.socket], Any],
+        host: str,
+        port: int,
+        workers: int,
+    ):
+        """Create an instance.
+
+        Args:
+            serve: function that runs the server in a worker, accepting
+                connections on the given socket
+            host: address of the HTTP server
+            port: port of the HTTP server
+            workers: number of worker processes
+        """
+        self._serve = serve
+        self._host = host
+        self._port = port
+        self._workers = workers
+        self._pids: set[int] = set()
+        self._stopping = False
+
+    def run(self) -> None:
+        """Start the workers and supervise them until SIGINT or SIGTERM."""
+        global metrics_directory  # noqa: PLW0603
+
+        if not hasattr(os, "fork"):
+            error = "The prefork mode is not supported on this platform"
+            raise RuntimeError(error)
+        metrics_directory = Path(mkdtemp(prefix="blab-metrics-"))
+        sock = socket.create_server((self._host, self._port), backlog=1024)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self._stop)
+        logger = getLogger(__name__)
+        logger.info(
+            "serving on http://%s:%d with %d workers",
+            self._host,
+            self._port,
+            self._workers,
+        )
+        started_at: dict[int, float] = {}
+        for _ in range(self._workers):
+            pid = self._fork_worker(sock)
+            started_at[pid] = monotonic()
+        last_report = monotonic()
+        while self._pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                self._pids.discard(pid)
+                (metrics_directory / f"{pid}.json").unlink(missing_ok=True)
+                if not self._stopping:
+                    logger.warning("worker %d terminated (status %d)", pid, status)
+                    if monotonic() - started_at.pop(pid, 0) < 1:
+                        sleep(1)  # avoid restarting a crashing worker in a loop
+                    new_pid = self._fork_worker(sock)
+                    started_at[new_pid] = monotonic()
+                continue
+            sleep(0.2)
+            if monotonic() - last_report >= _METRICS_REPORT_INTERVAL:
+                last_report = monotonic()
+                logger.info("metrics: %s", aggregate_metrics())
+        sock.close()
+        rmtree(metrics_directory, ignore_errors=True)
+
+    def _stop(self, _signal_number: int, _frame: Any) -> None:
+        self._stopping = True
+        for pid in self._pids:
+            os.kill(pid, signal.SIGTERM)
+
+    def _fork_worker(self, sock: socket.socket) -> int:
+        pid = os.fork()
+        if pid:
+            self._pids.add(pid)
+            return pid
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, signal.SIG_DFL)
+        status = 0
+        try:
+            Thread(target=self._publish_metrics, daemon=True).start()
+            self._serve(sock)
+        except Exception:  # noqa: BLE001
+            getLogger(__name__).exception("worker %d failed", os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _publish_metrics(self) -> None:
+        assert metrics_directory  # noqa: S101
+        path = metrics_directory / f"{os.getpid()}.json"
+        tmp_path = path.with_suffix(".tmp")
+        while True:
+            tmp_path.write_text(
+                json.dumps(metrics.registry.snapshot(worker=str(os.getpid())))
+            )
+            tmp_path.replace(path)
+            sleep(_METRICS_PUBLISH_INTERVAL)
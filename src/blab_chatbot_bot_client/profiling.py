@@ -0,0 +1,291 @@
+"""Contains classes that profile the handlers of individual conversations.
+
+A sample of the conversations (see the setting ``PROFILE_SAMPLE_RATE``) is
+profiled. The profile of each of them is written to a file named after its
+conversation id when it ends, in one of two formats:
+
+- with the sampling profiler (the default), the stacks of the threads running
+  the handlers of the conversation are collected periodically and written in
+  collapsed-stack format (``<conversation_id>.collapsed``), which can be
+  converted to flame graphs;
+- with ``cProfile``, every function call is measured and the statistics are
+  written in ``pstats`` format (``<conversation_id>.pstats``).
+
+Handlers that are coroutines are not profiled, because all of them run
+interleaved on the same thread. Handlers that are generators are profiled
+while they produce each item, but not while they are suspended.
+"""
+
+from __future__ import annotations
+
+import sys
+from collections import Counter
+from cProfile import Profile
+from functools import wraps
+from inspect import iscoroutinefunction, isgeneratorfunction
+from pathlib import Path
+from random import random
+from threading import Condition, Thread, get_ident, local
+from typing import TYPE_CHECKING, Any, TypeVar, cast
+
+from blab_chatbot_bot_client.settings_format import BlabConnectionSettings
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+    from types import FrameType
+
+    from blab_chatbot_bot_client.settings_format import BlabBotClientSettings
+
+FunctionType = TypeVar("FunctionType", bound="Callable[..., Any]")
+
+
+class SamplingProfiler:
+    """Periodically collects the stacks of the threads attached to a tag."""
+
+    def __init__(self, interval: float = 0.005):
+        """Create an instance. The sampling thread starts when needed.
+
+        Args:
+            interval: time (in seconds) between samples
+        """
+        self._interval = interval
+        self._attached: dict[int, str] = {}
+        self._stacks: dict[str, Counter[str]] = {}
+        self._condition = Condition()
+        self._thread: Thread | None = None
+
+    def attach(self, tag: str) -> None:
+        """Attribute the stacks of the current thread to a tag.
+
+        Args:
+            tag: the tag (e.g. a conversation id)
+        """
+        with self._condition:
+            self._attached[get_ident()] = tag
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._sample, name="sampling-profiler", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def detach(self) -> None:
+        """Stop collecting the stacks of the current thread."""
+        with self._condition:
+            self._attached.pop(get_ident(), None)
+
+    def pop_stacks(self, tag: str) -> Counter[str]:
+        """Remove the stacks collected for a tag.
+
+        Args:
+            tag: the tag
+
+        Returns:
+            the number of times each stack has been sampled
+            (frames are separated by semicolons, outermost first)
+        """
+        with self._condition:
+            return self._stacks.pop(tag, Counter())
+
+    @classmethod
+    def _format_stack(cls, frame: FrameType | None) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+            )
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _sample(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._attached)
+                attached = dict(self._attached)
+            frames = sys._current_frames()
+            stacks = [
+                (tag, self._format_stack(frames.get(thread_id)))
+                for thread_id, tag in attached.items()
+            ]
+            with self._condition:
+                for tag, stack in stacks:
+                    if stack:
+                        self._stacks.setdefault(tag, Counter())[stack] += 1
+                self._condition.wait(self._interval)
+
+
+sampling_profiler = SamplingProfiler()
+"""Sampling profiler shared by all conversations"""
+
+_pending_profiles = 0
+_pending_profiles_condition = Condition()
+
+
+class ConversationProfiler:
+    """Profiles the handlers of a conversation."""
+
+    def __init__(self, conversation_id: str, directory: Path, profiler: str):
+        """Create an instance.
+
+        Args:
+            conversation_id: id of the conversation
+            directory: where the profile is written
+            profiler: ``"sampling"`` or ``"cprofile"``
+        """
+        if profiler not in ("sampling", "cprofile"):
+            error = f"Unknown profiler: {profiler}"
+            raise ValueError(error)
+        self.conversation_id = conversation_id
+        self._directory = directory
+        self._profile = Profile() if profiler == "cprofile" else None
+        self._local = local()
+        self._started = False
+
+    def start(self) -> None:
+        """Mark the conversation as running.
+
+        From now on, ``wait_for_profiles`` waits until ``save`` is called.
+        Conversations that are created but never run (e.g. because they
+        were refused) are not waited for.
+        """
+        global _pending_profiles  # noqa: PLW0603
+        if self._started:
+            return
+        self._started = True
+        with _pending_profiles_condition:
+            _pending_profiles += 1
+
+    def wrap(self, function: FunctionType) -> FunctionType:
+        """Wrap a handler so that its calls are profiled.
+
+        Nested calls (e.g. ``generate_answer`` called by
+        ``on_receive_message``) are profiled as part of the outermost call.
+
+        Args:
+            function: the handler (if it is a generator function, the
+                production of each item is profiled)
+
+        Returns:
+            the wrapped handler (or the handler itself if it is a coroutine)
+        """
+        if iscoroutinefunction(function):
+            return function
+
+        if isgeneratorfunction(function):
+
+            @wraps(function)
+            def generator_wrapper(*args: Any, **kwargs: Any) -> Any:
+                iterator: Iterator[Any] = self._call(function, *args, **kwargs)
+                try:
+                    while True:
+                        try:
+                            item = self._call(next, iterator)
+                        except StopIteration as stop:
+                            return stop.value
+                        yield item
+                finally:
+                    close = getattr(iterator, "close", None)
+                    if close:
+                        close()
+
+            return cast("FunctionType", generator_wrapper)
+
+        @wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            return self._call(function, *args, **kwargs)
+
+        return cast("FunctionType", wrapper)
+
+    def _call(self, function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call a function while profiling the current thread.
+
+        Args:
+            function: the function
+            args: positional arguments of the function
+            kwargs: keyword arguments of the function
+
+        Returns:
+            the value returned by the function
+        """
+        if getattr(self._local, "active", False):
+            return function(*args, **kwargs)
+        if self._profile:
+            try:
+                self._profile.enable()
+            except ValueError:
+                # another profiler is active (in Python 3.12+, cProfile
+                # can only profile one conversation at a time)
+                return function(*args, **kwargs)
+        else:
+            sampling_profiler.attach(self.conversation_id)
+        self._local.active = True
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._local.active = False
+            if self._profile:
+                self._profile.disable()
+            else:
+                sampling_profiler.detach()
+
+    def save(self) -> None:
+        """Write the profile of the conversation to a file."""
+        global _pending_profiles  # noqa: PLW0603
+        self._directory.mkdir(parents=True, exist_ok=True)
+        name = "".join(
+            c if c.isalnum() or c in "-_" else "_" for c in self.conversation_id
+        )
+        if self._profile:
+            self._profile.dump_stats(self._directory / f"{name}.pstats")
+        else:
+            stacks = sampling_profiler.pop_stacks(self.conversation_id)
+            (self._directory / f"{name}.collapsed").write_text(
+                "".join(f"{stack} {count}\n" for stack, count in stacks.items())
+            )
+        if self._started:
+            self._started = False
+            with _pending_profiles_condition:
+                _pending_profiles -= 1
+                _pending_profiles_condition.notify_all()
+
+
+def create_conversation_profiler(
+    settings: BlabBotClientSettings, conversation_id: str
+) -> ConversationProfiler | None:
+    """Decide whether a conversation should be profiled.
+
+    Args:
+        settings: the bot settings
+        conversation_id: id of the conversation
+
+    Returns:
+        the profiler of the conversation,
+        or ``None`` if it should not be profiled
+    """
+    connection_settings = cast(
+        BlabConnectionSettings, settings.BLAB_CONNECTION_SETTINGS
+    )
+    rate = connection_settings.get("PROFILE_SAMPLE_RATE", 0)
+    if not rate or random() >= rate:  # noqa: S311
+        return None
+    return ConversationProfiler(
+        conversation_id,
+        Path(connection_settings.get("PROFILE_DIR", "profiles")),
+        connection_settings.get("PROFILER", "sampling"),
+    )
+
+
+def wait_for_profiles(timeout: float | None = None) -> bool:
+    """Wait until the profiles of all profiled conversations have been written.
+
+    Args:
+        timeout: maximum time to wait (in seconds)
+
+    Returns:
+        ``True`` if there are no pending profiles
+    """
+    with _pending_profiles_condition:
+        return _pending_profiles_condition.wait_for(
+            lambda: _pending_profiles <= 0, timeout
+        )
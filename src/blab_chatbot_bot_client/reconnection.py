@@ -0,0 +1,171 @@
+"""Contains classes used to reconnect conversations whose connection was lost.
+
+If the setting ``RECONNECT_ATTEMPTS`` is positive and the WebSocket connection
+of a conversation is lost (instead of being closed normally by the controller
+or by the bot), the conversation connects again, keeping its instance and its
+state. Before each attempt, it waits for a random delay below a bound that
+grows exponentially (from ``RECONNECT_BACKOFF`` up to
+``RECONNECT_MAX_BACKOFF`` seconds), so that conversations dropped at the same
+time do not reconnect at once. The conversation ends after
+``RECONNECT_ATTEMPTS`` consecutive failed attempts.
+
+The messages that have been sent but not yet delivered back to the bot are
+sent again after reconnecting, with the same local ids (the controller
+discards repeated messages). ``on_connect`` and ``on_disconnect`` are only
+called at the start and at the end of the conversation.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from http import HTTPStatus
+from random import uniform
+from threading import Lock
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from blab_chatbot_bot_client.data_structures import OutgoingMessage
+    from blab_chatbot_bot_client.settings_format import (
+        BlabWebSocketConnectionSettings,
+    )
+
+RETRYABLE_CLOSE_CODES = frozenset({1001, 1006, 1011, 1012, 1013, 1014})
+"""WebSocket close codes after which the conversation reconnects
+
+They indicate that the controller is restarting or temporarily unavailable,
+or that the connection was lost.
+"""
+
+
+class ReconnectionPolicy:
+    """Decides whether and when a conversation reconnects."""
+
+    def __init__(
+        self, attempts: int = 0, backoff: float = 0.5, max_backoff: float = 30
+    ):
+        """Create an instance.
+
+        Args:
+            attempts: maximum number of consecutive attempts to reconnect
+                (0 to never reconnect)
+            backoff: bound (in seconds) of the delay before the first attempt
+            max_backoff: upper bound (in seconds) of the delay before
+                an attempt
+        """
+        self.attempts = attempts
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+
+    @classmethod
+    def from_settings(
+        cls, connection_settings: BlabWebSocketConnectionSettings
+    ) -> ReconnectionPolicy:
+        """Create an instance with the values defined in the settings.
+
+        Args:
+            connection_settings: the connection settings
+
+        Returns:
+            the new instance
+        """
+        return cls(
+            connection_settings.get("RECONNECT_ATTEMPTS", 0),
+            connection_settings.get("RECONNECT_BACKOFF", 0.5),
+            connection_settings.get("RECONNECT_MAX_BACKOFF", 30),
+        )
+
+    def should_reconnect(self, close_code: int | None, failed_attempts: int) -> bool:
+        """Decide whether a conversation should reconnect.
+
+        Args:
+            close_code: the code of the close frame sent by the controller,
+                or ``None`` if the connection was lost without one
+            failed_attempts: number of consecutive attempts that have failed
+
+        Returns:
+            whether another attempt should be made
+        """
+        return failed_attempts < self.attempts and (
+            close_code is None or close_code in RETRYABLE_CLOSE_CODES
+        )
+
+    def delay(self, failed_attempts: int) -> float:
+        """Choose the time to wait before an attempt.
+
+        Args:
+            failed_attempts: number of consecutive attempts that have failed
+
+        Returns:
+            the delay (in seconds)
+        """
+        return uniform(  # noqa: S311
+            0, min(self._max_backoff, self._backoff * 2**failed_attempts)
+        )
+
+
+def is_refusal(status_code: int) -> bool:
+    """Check whether the controller refused a connection permanently.
+
+    Args:
+        status_code: the HTTP status of the response to the handshake
+
+    Returns:
+        whether it is a client error (such as an invalid session),
+        after which the conversation does not reconnect
+    """
+    return HTTPStatus.BAD_REQUEST <= status_code < HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+class UnacknowledgedMessages:
+    """Keeps the messages sent to the controller until they are delivered back.
+
+    It can be used by several threads.
+    """
+
+    def __init__(self, max_size: int):
+        """Create an empty instance.
+
+        Args:
+            max_size: maximum number of messages (when it is reached,
+                the oldest ones are forgotten)
+        """
+        self._max_size = max_size
+        self._messages: OrderedDict[str, OutgoingMessage] = OrderedDict()
+        self._lock = Lock()
+
+    def add(self, message: OutgoingMessage) -> None:
+        """Keep a message that is about to be sent.
+
+        Args:
+            message: the message
+        """
+        with self._lock:
+            self._messages[message.local_id] = message
+            if len(self._messages) > self._max_size:
+                self._messages.popitem(last=False)
+
+    def acknowledge(self, local_id: str) -> None:
+        """Forget a message because it has been delivered.
+
+        Args:
+            local_id: the local id of the message
+        """
+        with self._lock:
+            self._messages.pop(local_id, None)
+
+    def messages(self) -> list[OutgoingMessage]:
+        """Obtain the messages that have not been delivered.
+
+        Returns
+            the messages, in the order they were sent
+        """
+        with self._lock:
+            return list(self._messages.values())
+
+    def __len__(self) -> int:
+        """Obtain the number of messages that have not been delivered.
+
+        Returns
+            the number of messages
+        """
+        return len(self._messages)
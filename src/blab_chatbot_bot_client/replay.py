@@ -0,0 +1,317 @@
+"""Contains a tool that replays captured conversations against a bot.
+
+The bot server is started in the same process, as in a load test. For each
+capture file (see ``capture``), a fake controller starts a conversation and
+sends the captured incoming frames with the original intervals between them
+(divided by a speed factor, or without waiting). The frames sent by the bot
+are compared with the captured outgoing frames (ignoring local ids, which are
+random), and the latencies of both runs are compared. The captures are read
+and compared as the replay proceeds, so they are never loaded into memory.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from collections import deque
+from dataclasses import dataclass, field
+from statistics import quantiles
+from time import monotonic
+from typing import TYPE_CHECKING, Any
+from urllib.request import Request, urlopen
+from uuid import uuid4
+
+from blab_chatbot_bot_client.capture import Direction, read_capture
+from blab_chatbot_bot_client.local_controller import (
+    ServerWebSocket,
+    WebSocketClosedError,
+    accept_websocket,
+    start_bot_server,
+)
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from blab_chatbot_bot_client.conversation_websocket import (
+        WebSocketBotClientConversation,
+    )
+    from blab_chatbot_bot_client.conversation_websocket_async import (
+        AsyncWebSocketBotClientConversation,
+    )
+    from blab_chatbot_bot_client.settings_format import (
+        BlabWebSocketBotClientSettings,
+    )
+
+
+@dataclass
+class ReplayResult:
+    """Contains the results of a replay."""
+
+    conversations: int = 0
+    """Number of replayed captures"""
+
+    mismatched_conversations: list[str] = field(default_factory=list)
+    """Names of the captures whose outgoing frames differ from the replay"""
+
+    captured_latencies: list[float] = field(default_factory=list)
+    """Time (in seconds) between each captured outgoing frame
+    and the last incoming frame before it"""
+
+    replayed_latencies: list[float] = field(default_factory=list)
+    """Time (in seconds) between each outgoing frame in the replay
+    and the last incoming frame before it"""
+
+    elapsed_time: float = 0
+    """Duration of the replay (in seconds)"""
+
+    def report(self) -> str:
+        """Summarize the results.
+
+        Returns
+            a human-readable summary
+        """
+        lines = [
+            f"conversations: {self.conversations} replayed, "
+            f"{len(self.mismatched_conversations)} with different outputs",
+            *(f"  different outputs: {name}" for name in self.mismatched_conversations),
+            f"elapsed time: {self.elapsed_time:.2f} s",
+        ]
+        for name, latencies in (
+            ("captured", self.captured_latencies),
+            ("replayed", self.replayed_latencies),
+        ):
+            if len(latencies) > 1:
+                percentiles = quantiles(latencies, n=100, method="inclusive")
+                lines.append(
+                    f"{name} latency: "
+                    + ", ".join(
+                        f"p{p}={percentiles[p - 1] * 1000:.1f} ms" for p in (50, 95, 99)
+                    )
+                )
+        return "\n".join(lines)
+
+
+def _normalize_frame(frame: str | bytes) -> Any:
+    """Remove the parts of an outgoing frame that change in every run.
+
+    Args:
+        frame: the frame
+
+    Returns:
+        the decoded frame, without local ids
+    """
+    try:
+        data = json.loads(frame)
+    except ValueError:
+        return frame
+    if isinstance(data, dict):
+        data.pop("local_id", None)
+    return data
+
+
+class _FrameComparison:
+    """Compares the captured outgoing frames with the replayed ones.
+
+    Each frame is compared as soon as its counterpart is available, so that
+    only the frames that have not been compared yet are kept in memory.
+    """
+
+    def __init__(self) -> None:
+        self.expected_count = 0
+        self.received_count = 0
+        self.mismatched = False
+        self._expected: deque[Any] = deque()
+        self._received: deque[Any] = deque()
+
+    def expect(self, frame: str | bytes) -> None:
+        """Add a captured outgoing frame.
+
+        Args:
+            frame: the frame
+        """
+        self.expected_count += 1
+        self._add(_normalize_frame(frame), self._expected, self._received)
+
+    def receive(self, frame: str | bytes) -> None:
+        """Add a frame sent by the bot during the replay.
+
+        Args:
+            frame: the frame
+        """
+        self.received_count += 1
+        self._add(_normalize_frame(frame), self._received, self._expected)
+
+    def _add(self, frame: Any, own: deque[Any], other: deque[Any]) -> None:
+        if other:
+            self.mismatched |= other.popleft() != frame
+        else:
+            own.append(frame)
+
+    @property
+    def matches(self) -> bool:
+        """Whether all the frames have been received and are equal."""
+        return not (self.mismatched or self._expected or self._received)
+
+
+class CaptureReplayer:
+    """Imitates BLAB Controller, replaying captured conversations."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        bot_url: str,
+        captures: list[Path],
+        speed: float,
+        concurrency: int = 10,
+        timeout: float = 30,
+    ):
+        """Create an instance.
+
+        Args:
+            bot_url: address of the bot's HTTP server
+            captures: paths to the capture files
+            speed: factor by which the intervals between incoming frames are
+                divided (0 to send each frame as soon as possible)
+            concurrency: maximum number of simultaneous conversations
+            timeout: maximum time (in seconds) to wait for the bot
+        """
+        self._bot_url = bot_url
+        self._captures = captures
+        self._speed = speed
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._connections: dict[str, asyncio.Future[ServerWebSocket]] = {}
+        self._result = ReplayResult()
+
+    async def run(self, port: int) -> ReplayResult:
+        """Replay the captures.
+
+        Args:
+            port: port where the fake controller accepts WebSocket connections
+
+        Returns:
+            the results
+        """
+        server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        semaphore = asyncio.Semaphore(self._concurrency)
+        started_at = monotonic()
+
+        async def conversation(path: Path) -> None:
+            async with semaphore:
+                await self._replay(path)
+
+        await asyncio.gather(*(conversation(path) for path in self._captures))
+        self._result.elapsed_time = monotonic() - started_at
+        server.close()
+        return self._result
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        conversation_id, ws = await accept_websocket(reader, writer)
+        connection = self._connections.get(conversation_id)
+        if connection and not connection.done():
+            connection.set_result(ws)
+        else:
+            await ws.close()
+
+    async def _connect(self, conversation_id: str) -> ServerWebSocket:
+        connection = self._connections[
+            conversation_id
+        ] = asyncio.get_running_loop().create_future()
+        request = Request(
+            self._bot_url,
+            data=json.dumps(
+                {
+                    "conversation_id": conversation_id,
+                    "bot_participant_id": "bot",
+                    "session": conversation_id,
+                }
+            ).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+
+        def post() -> None:
+            with urlopen(request, timeout=self._timeout):  # noqa: S310
+                pass
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, post)
+            return await asyncio.wait_for(connection, self._timeout)
+        finally:
+            del self._connections[conversation_id]
+
+    async def _wait_for_frames(
+        self, receiver: asyncio.Task[None], comparison: _FrameComparison
+    ) -> None:
+        deadline = monotonic() + self._timeout
+        while (
+            comparison.received_count < comparison.expected_count
+            and not receiver.done()
+        ):
+            if monotonic() > deadline:
+                return
+            await asyncio.sleep(0.01)
+
+    async def _replay(self, path: Path) -> None:
+        ws = await self._connect(str(uuid4()))
+        comparison = _FrameComparison()
+        start = last_sent = monotonic()
+
+        async def receive() -> None:
+            while True:
+                frame = await ws.receive()
+                self._result.replayed_latencies.append(monotonic() - last_sent)
+                comparison.receive(frame)
+
+        receiver = asyncio.create_task(receive())
+        capture_start = last_captured_in = None
+        try:
+            for record in read_capture(path):
+                if capture_start is None:
+                    capture_start = last_captured_in = record.time
+                if record.direction == Direction.INCOMING:
+                    if self._speed:
+                        delay = (record.time - capture_start) / self._speed
+                        await asyncio.sleep(start + delay - monotonic())
+                    last_sent = monotonic()
+                    last_captured_in = record.time
+                    await ws.send(record.payload.decode("utf-8"))
+                elif record.direction == Direction.OUTGOING:
+                    self._result.captured_latencies.append(
+                        record.time - (last_captured_in or 0)
+                    )
+                    comparison.expect(record.payload)
+            await self._wait_for_frames(receiver, comparison)
+        except (WebSocketClosedError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            receiver.cancel()
+            await ws.close()
+        self._result.conversations += 1
+        if not comparison.matches:
+            self._result.mismatched_conversations.append(path.name)
+
+
+def run_replay(
+    client: type[WebSocketBotClientConversation[Any]]
+    | type[AsyncWebSocketBotClientConversation[Any]],
+    settings: BlabWebSocketBotClientSettings,
+    captures: list[Path],
+    speed: float,
+) -> ReplayResult:
+    """Start the bot server and replay captures against it.
+
+    Args:
+        client: the conversation class of the bot
+        settings: bot settings (the connection settings are replaced
+            with local addresses)
+        captures: paths to the capture files
+        speed: factor by which the intervals between incoming frames are
+            divided (0 to send each frame as soon as possible)
+
+    Returns:
+        the results
+    """
+    bot_port, controller_port = start_bot_server(client, settings)
+    replayer = CaptureReplayer(f"http://127.0.0.1:{bot_port}/", captures, speed)
+    return asyncio.run(replayer.run(controller_port))
@@ -3,11 +3,294 @@
 from typing import Protocol, TypedDict, runtime_checkable
 
 
-class BlabConnectionSettings(TypedDict):
+class BlabConnectionSettings(TypedDict, total=False):
     """Contains settings to interact with BLAB Controller."""
 
+    ANSWER_BATCH_WINDOW: float
+    """Maximum time (in seconds) a message waits for others to form a batch
 
-class BlabWebSocketConnectionSettings(BlabConnectionSettings):
+    It is only used by bots that call ``enqueue_batched_answer``.
+    The default value is 0.02.
+    """
+
+    ANSWER_BATCH_MAX_SIZE: int
+    """Maximum number of messages answered in one batch
+
+    It is only used by bots that call ``enqueue_batched_answer``.
+    The default value is 32.
+    """
+
+    ANSWER_CACHE_SIZE: int
+    """Maximum number of questions whose answers are cached in memory
+
+    If it is positive, the answers returned by ``generate_answer`` are cached
+    under the key computed by ``answer_cache_key``. Use 0 (the default value)
+    to disable the cache.
+    """
+
+    ANSWER_CACHE_TTL: float
+    """Time (in seconds) after which cached answers expire (0 for never)
+
+    The default value is 0.
+    """
+
+    ANSWER_CACHE_PATH: str
+    """Path to an SQLite database where cached answers are also stored
+
+    It can be shared by several processes (e.g. the workers of the server).
+    By default, answers are only cached in memory.
+    """
+
+    ANSWER_CACHE_DISK_SIZE: int
+    """Maximum number of answers stored in ``ANSWER_CACHE_PATH`` (0 for no limit)
+
+    The oldest answers are removed first. The default value is 0.
+    """
+
+    ANSWER_CACHE_STATE_KEYS: list[str]
+    """Keys of the conversation state whose values are part of the cache key
+
+    Answers are only reused in conversations whose states have the same values
+    for these keys. The default value is an empty list.
+    """
+
+    CANCEL_SUPERSEDED: bool
+    """Whether newer messages sent by the user cancel the answers to older ones
+
+    If it is ``True``, ``enqueue_answer`` does not answer messages that have
+    been superseded and stops enqueueing their answers.
+    The default value is ``False``.
+    """
+
+    ANSWER_DEBOUNCE: float
+    """Time (in seconds) ``enqueue_answer`` waits for a newer message
+
+    It is only used if ``CANCEL_SUPERSEDED`` is ``True``. If the user sends
+    another message meanwhile, the older one is not answered.
+    The default value is 0.
+    """
+
+    HISTORY_MAX_MESSAGES: int
+    """Maximum number of messages kept in the history of each conversation
+
+    If it or ``HISTORY_MAX_CHARACTERS`` is positive, the messages of each
+    conversation are recorded in its attribute ``history``. Otherwise
+    (the default), no history is kept.
+    """
+
+    HISTORY_MAX_CHARACTERS: int
+    """Maximum total length of the texts in the history of each conversation
+
+    Use 0 (the default value) for no limit.
+    """
+
+    HISTORY_SPILL_PATH: str
+    """Path to an SQLite database where messages removed from histories are moved
+
+    By default, they are discarded.
+    """
+
+    ATTACHMENT_CACHE_DIR: str
+    """Directory where the files attached to messages are cached
+
+    It can be shared by several processes. By default, files are not cached,
+    so ``fetch_attachment`` cannot be used (``stream_attachment`` can).
+    """
+
+    ATTACHMENT_CACHE_SIZE: int
+    """Maximum total size (in bytes) of the files in ``ATTACHMENT_CACHE_DIR``
+
+    The least recently used files are removed first.
+    The default value is 1073741824 (1 GiB).
+    """
+
+    ATTACHMENT_BASE_URL: str
+    """URL against which relative URLs of attached files are resolved
+
+    By default, it is the HTTP address of ``BLAB_CONTROLLER_WS_URL``.
+    """
+
+    ATTACHMENT_TIMEOUT: float
+    """Timeout (in seconds) of the connections that download attached files
+
+    The default value is 30.
+    """
+
+    OUTBOX_HIGH_WATERMARK: int
+    """Number of unsent messages that makes the outbox of a conversation full
+
+    Use 0 (the default value) for unbounded outboxes.
+    """
+
+    OUTBOX_LOW_WATERMARK: int
+    """Number of unsent messages below which a full outbox accepts messages again
+
+    The default value is half of ``OUTBOX_HIGH_WATERMARK``.
+    """
+
+    OUTBOX_FULL_POLICY: str
+    """What happens to messages enqueued in a full outbox
+
+    It can be ``"block"`` (the default value), ``"drop"`` or ``"raise"``.
+    """
+
+    METRICS_ENABLED: bool
+    """Whether latency histograms and other metrics are collected
+
+    When enabled, the server also exposes all the metrics in Prometheus
+    text format at ``GET /metrics``. The default value is ``False``.
+    """
+
+    PROFILE_SAMPLE_RATE: float
+    """Fraction of the conversations whose handlers are profiled (from 0 to 1)
+
+    The profile of each conversation is written to ``PROFILE_DIR`` when it ends.
+    The default value is 0.
+    """
+
+    PROFILE_DIR: str
+    """Directory where the profiles of conversations are written
+
+    The default value is ``"profiles"``.
+    """
+
+    PROFILER: str
+    """Profiler used for conversations selected by ``PROFILE_SAMPLE_RATE``
+
+    It can be ``"sampling"`` (the default value), which writes collapsed stacks,
+    or ``"cprofile"``, which writes statistics in ``pstats`` format.
+    """
+
+
+class BlabWebSocketConnectionOptionalSettings(BlabConnectionSettings, total=False):
+    """Contains optional settings to interact with BLAB Controller via WebSocket."""
+
+    HTTP_SERVER: str
+    """Name of the HTTP server that accepts the start of new conversations
+
+    It can be ``"waitress"`` (the default value, which requires the packages
+    ``flask`` and ``waitress``) or ``"asyncio"`` (a minimal server based on
+    ``asyncio``, without dependencies, which accepts requests faster).
+    """
+
+    HANDLER_WORKERS: int
+    """Number of threads that run the message handlers of all conversations
+
+    If it is zero, handlers run on the thread that reads the WebSocket of each
+    conversation. The default value is ``min(32, number of CPUs + 4)``.
+    """
+
+    HANDLER_QUEUE_SIZE: int
+    """Maximum number of handler calls waiting for a thread (0 for no limit)"""
+
+    MESSAGE_CODEC: str
+    """Name of the codec used to convert frames exchanged with the controller
+
+    It can be ``"json"`` (the default value), ``"orjson"`` or ``"msgspec"``
+    (the last two require the packages with the same names).
+    """
+
+    COMPACT_MESSAGES: bool
+    """Whether incoming messages are instances of ``CompactMessage``
+
+    ``CompactMessage`` has the same attributes as ``Message``, but it uses less
+    memory and parses the time of the message only when it is read.
+    The default value is ``False``.
+    """
+
+    MAX_CONVERSATIONS: int
+    """Maximum number of simultaneous conversations (0 for no limit)
+
+    When the limit is reached, new conversations are refused with
+    HTTP status 503 (see also ``ADMISSION_WAIT``).
+    """
+
+    ADMISSION_MAX_QUEUE_DEPTH: int
+    """Maximum number of handler calls waiting for a thread (0 for no limit)
+
+    While it is exceeded, new conversations are refused with HTTP status 503.
+    It is not used by ``AsyncWebSocketBotClientConversation``, whose handlers
+    are not queued.
+    """
+
+    ADMISSION_MAX_P99_LATENCY: float
+    """Maximum 99th percentile (in seconds) of the latency of recent messages
+
+    The latency is the time from the arrival of a message until
+    ``on_receive_message`` returns. While the limit is exceeded, new
+    conversations are refused with HTTP status 503. Use 0 (the default
+    value) for no limit.
+    """
+
+    ADMISSION_RETRY_AFTER: float
+    """Time (in seconds) sent in the header ``Retry-After`` of refusals
+
+    The default value is 1.
+    """
+
+    ADMISSION_WAIT: float
+    """Maximum time (in seconds) a new conversation waits for capacity
+
+    After that, it is refused. The default value is 0.
+    """
+
+    IDLE_TIMEOUT: float
+    """Time (in seconds) without messages after which a conversation is closed
+
+    Use 0 (the default value) to keep idle conversations open.
+    """
+
+    PING_INTERVAL: float
+    """Interval (in seconds) between pings sent to the controller (0 to disable)
+
+    The default value is 30.
+    """
+
+    PING_TIMEOUT: float
+    """Time (in seconds) to wait for a pong before the connection is considered dead
+
+    The default value is 10.
+    """
+
+    DELIVER_OWN_MESSAGES: bool
+    """Whether the bot's own messages are passed to ``on_receive_message``
+
+    If it is ``False``, those messages are recognized by their local ids and
+    discarded without being decoded (``on_delivered`` is still called).
+    The default value is ``True``.
+    """
+
+    RECONNECT_ATTEMPTS: int
+    """Maximum number of consecutive attempts to reconnect a lost conversation
+
+    If the connection with the controller is lost, the conversation
+    reconnects, keeping its instance and its state, and the messages that
+    have not been delivered back to the bot are sent again. Use 0 (the
+    default value) to end the conversation instead.
+    """
+
+    RECONNECT_BACKOFF: float
+    """Initial maximum delay (in seconds) before an attempt to reconnect
+
+    The maximum delay doubles after each failed attempt, and the actual delay
+    is chosen randomly below it. The default value is 0.5.
+    """
+
+    RECONNECT_MAX_BACKOFF: float
+    """Upper bound (in seconds) of the delay before an attempt to reconnect
+
+    The default value is 30.
+    """
+
+    CAPTURE_DIR: str
+    """Directory where the frames exchanged in each conversation are recorded
+
+    Captures can be replayed by the command ``replay``. By default,
+    frames are not recorded.
+    """
+
+
+class BlabWebSocketConnectionSettings(BlabWebSocketConnectionOptionalSettings):
     """Contains settings to interact with BLAB Controller via WebSocket."""
 
     BOT_HTTP_SERVER_HOSTNAME: str
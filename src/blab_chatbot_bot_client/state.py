@@ -0,0 +1,347 @@
+"""Contains the state of a conversation, as described by the controller.
+
+The controller sends the state of the conversation (e.g. its participants)
+along with some messages, and ``on_receive_state`` merges it into
+``BotClientConversation.state``. Since the state may be updated while
+handlers read it in other threads, it is never modified in place: each update
+creates a new immutable snapshot (sharing the values of the keys that have not
+changed) with a higher version number. Reads do not acquire locks, and
+``snapshot()`` gives a consistent view for several reads.
+
+The values are frozen when they are stored: dicts and lists become
+``FrozenDict`` and ``FrozenList``, which compare equal to (and are serialized
+to JSON as) regular dicts and lists, but cannot be modified. Therefore,
+snapshots never need to be copied defensively, and ``thaw`` gives a mutable
+deep copy when one is needed.
+
+Handlers that depend on a few keys can ``subscribe`` to them instead of
+comparing the whole state on every update.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable, Iterator, Mapping, MutableMapping
+from logging import getLogger
+from threading import Lock
+from typing import Any, NoReturn
+
+_MISSING = object()
+
+
+def _immutable(value: object, *_args: Any, **_kwargs: Any) -> NoReturn:
+    error = f"{type(value).__name__} cannot be modified"
+    raise TypeError(error)
+
+
+def freeze(value: Any) -> Any:
+    """Obtain an immutable version of a value.
+
+    Args:
+        value: the value (dicts, lists and tuples are frozen recursively)
+
+    Returns:
+        a frozen copy of the value, or the value itself if it is not
+        a dict, a list or a tuple (or if it is already frozen)
+    """
+    if isinstance(value, FrozenDict | FrozenList):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    if isinstance(value, tuple):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Obtain a mutable deep copy of a frozen value.
+
+    Args:
+        value: the value
+
+    Returns:
+        a copy of the value where mappings (e.g. a ``ConversationState``)
+        and lists, frozen or not, are replaced with regular dicts and lists
+    """
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(thaw(v) for v in value)
+    return value
+
+
+class FrozenDict(dict):  # type: ignore[type-arg]
+    """Represents a dict that cannot be modified (see ``freeze``).
+
+    Copies of it (``copy.copy`` and ``copy.deepcopy``) are the object itself.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable  # type: ignore[assignment]
+
+    def __copy__(self) -> FrozenDict:
+        return self
+
+    def __deepcopy__(self, _memo: dict[int, Any]) -> FrozenDict:
+        return self
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return type(self), (dict(self),)
+
+
+class FrozenList(list):  # type: ignore[type-arg]
+    """Represents a list that cannot be modified (see ``freeze``).
+
+    Copies of it (``copy.copy`` and ``copy.deepcopy``) are the object itself.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = clear = extend = insert = remove = reverse = _immutable
+    pop = sort = _immutable  # type: ignore[assignment]
+
+    def __copy__(self) -> FrozenList:
+        return self
+
+    def __deepcopy__(self, _memo: dict[int, Any]) -> FrozenList:
+        return self
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return type(self), (list(self),)
+
+
+class StateSnapshot(FrozenDict):
+    """Represents an immutable version of the state of a conversation.
+
+    It is a ``dict`` (which cannot be modified), so it can be serialized
+    (e.g. with ``json.dumps``) directly.
+    """
+
+    __slots__ = ("version",)
+
+    def __init__(self, data: Mapping[str, Any], version: int):
+        """Create an instance.
+
+        Args:
+            data: the keys and values (the values must be frozen)
+            version: the version number
+        """
+        super().__init__(data)
+        self.version = version
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)!r}, version={self.version})"
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return type(self), (dict(self), self.version)
+
+
+StateCallback = Callable[[Mapping[str, Any], StateSnapshot], Any]
+"""Function called with the changed keys (and their new values) and the new state"""
+
+_Notification = tuple[
+    dict[str, Any],
+    StateSnapshot,
+    list[tuple[frozenset[str] | None, StateCallback]],
+]
+
+
+class ConversationState(MutableMapping[str, Any]):
+    """Holds the current state of a conversation. It is thread-safe.
+
+    Reading it (e.g. ``state["participants"]`` or ``state.get("x")``)
+    uses the most recent snapshot. Modifying it like a dict (e.g.
+    ``state["x"] = 1``, ``del state["x"]`` or ``state.pop("x")``)
+    creates a new snapshot.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty state (version 0)."""
+        self._snapshot = StateSnapshot({}, 0)
+        self._subscriptions: list[tuple[frozenset[str] | None, StateCallback]] = []
+        self._lock = Lock()
+
+    def snapshot(self) -> StateSnapshot:
+        """Obtain the current version of the state.
+
+        Returns
+            an immutable snapshot, which is not affected by later updates
+        """
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        """Current version number (incremented by each update that changes values)."""
+        return self._snapshot.version
+
+    def update(self, changes: Mapping[str, Any]) -> bool:  # type: ignore[override]
+        """Merge new values into the state, creating a new version.
+
+        The subscribers of the changed keys are notified after the update,
+        in the calling thread.
+
+        Args:
+            changes: the new values of some keys (they are frozen)
+
+        Returns:
+            whether any value has changed (otherwise, the version is the same)
+        """
+        with self._lock:
+            notification = self._apply(changes)
+        self._notify(notification)
+        return notification is not None
+
+    def pop(self, key: str, default: Any = _MISSING) -> Any:
+        """Remove a key, creating a new version.
+
+        The subscribers of the key are notified (with the value ``None``).
+
+        Args:
+            key: the key
+            default: the value returned if the key is not in the state
+
+        Raises:
+            KeyError: if the key is not in the state and there is no default
+
+        Returns:
+            the value of the key
+        """
+        with self._lock:
+            value = self._snapshot.get(key, _MISSING)
+            if value is _MISSING:
+                if default is _MISSING:
+                    raise KeyError(key)
+                return default
+            notification = self._apply({}, [key])
+        self._notify(notification)
+        return value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        """Obtain the value of a key, adding it if it is not in the state.
+
+        Args:
+            key: the key
+            default: the value stored (frozen) if the key is not in the state
+
+        Returns:
+            the value of the key
+        """
+        with self._lock:
+            value = self._snapshot.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            notification = self._apply({key: default})
+        self._notify(notification)
+        return self._snapshot.get(key, default)
+
+    def _apply(
+        self, changes: Mapping[str, Any], removed: Iterable[str] = ()
+    ) -> _Notification | None:
+        """Create a new version with some changes.
+
+        It must be called with ``_lock`` held.
+
+        Args:
+            changes: the new values of some keys
+            removed: the keys that are removed
+
+        Returns:
+            what must be notified to the subscribers
+            (``None`` if nothing has changed)
+        """
+        current = self._snapshot
+        changed = {
+            key: freeze(value)
+            for key, value in changes.items()
+            if current.get(key, _MISSING) != value
+        }
+        removed = [key for key in removed if key in current]
+        if not changed and not removed:
+            return None
+        data = {**current, **changed}
+        for key in removed:
+            del data[key]
+            changed[key] = None
+        self._snapshot = StateSnapshot(data, current.version + 1)
+        return changed, self._snapshot, list(self._subscriptions)
+
+    @classmethod
+    def _notify(cls, notification: _Notification | None) -> None:
+        if notification is None:
+            return
+        changed, snapshot, subscriptions = notification
+        for keys, callback in subscriptions:
+            relevant = (
+                changed
+                if keys is None
+                else {k: changed[k] for k in keys & changed.keys()}
+            )
+            if relevant:
+                try:
+                    callback(relevant, snapshot)
+                except Exception:  # noqa: BLE001
+                    getLogger(__name__).exception("error in state subscriber")
+
+    def subscribe(
+        self, callback: StateCallback, keys: Iterable[str] | None = None
+    ) -> Callable[[], None]:
+        """Register a function that is called when some keys change.
+
+        Args:
+            callback: function called with a mapping from the changed keys
+                to their new values (``None`` for removed keys) and with
+                the new snapshot
+            keys: the keys of interest (by default, all of them)
+
+        Returns:
+            a function that cancels the subscription
+        """
+        subscription = (None if keys is None else frozenset(keys), callback)
+        with self._lock:
+            self._subscriptions.append(subscription)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if subscription in self._subscriptions:
+                    self._subscriptions.remove(subscription)
+
+        return unsubscribe
+
+    def __getitem__(self, key: str) -> Any:
+        return self._snapshot[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.update({key: value})
+
+    def __delitem__(self, key: str) -> None:
+        self.pop(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._snapshot)
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self._snapshot)!r})"
+
+    def __copy__(self) -> ConversationState:
+        """Create an independent state with the same values.
+
+        Since the values are immutable, it is also a deep copy.
+
+        Returns
+            the copy (version 0, without subscribers)
+        """
+        result = type(self)()
+        result._snapshot = StateSnapshot(self._snapshot, 0)
+        return result
+
+    def __deepcopy__(self, _memo: dict[int, Any]) -> ConversationState:
+        return self.__copy__()